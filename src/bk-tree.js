@@ -0,0 +1,65 @@
+// BK-tree for nearest neighbour search under a metric such as Hamming
+// distance. Searching for everything within radius r only visits subtrees
+// whose edge distance is within r of the query's distance to the node, so a
+// search touches a small part of the tree instead of every item.
+export class BKTree {
+  constructor(distance) {
+    this.distance = distance;
+    this.root = null;
+    this.size = 0;
+  }
+
+  add(key, value) {
+    const node = { key, values: [value], children: new Map() };
+    this.size++;
+
+    if (!this.root) {
+      this.root = node;
+      return;
+    }
+
+    let current = this.root;
+    for (;;) {
+      const distance = this.distance(key, current.key);
+      if (distance === 0) {
+        // Identical keys share a node
+        current.values.push(value);
+        return;
+      }
+
+      const child = current.children.get(distance);
+      if (!child) {
+        current.children.set(distance, node);
+        return;
+      }
+      current = child;
+    }
+  }
+
+  // Everything within radius of key, as [{ key, value, distance }]
+  search(key, radius) {
+    const found = [];
+    const stack = this.root ? [this.root] : [];
+
+    while (stack.length > 0) {
+      const node = stack.pop();
+      const distance = this.distance(key, node.key);
+
+      if (distance <= radius) {
+        for (const value of node.values) {
+          found.push({ key: node.key, value, distance });
+        }
+      }
+
+      // Triangle inequality: only children at edge distance within
+      // [distance - radius, distance + radius] can hold matches
+      for (const [edge, child] of node.children) {
+        if (edge >= distance - radius && edge <= distance + radius) {
+          stack.push(child);
+        }
+      }
+    }
+
+    return found;
+  }
+}
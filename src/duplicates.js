@@ -0,0 +1,199 @@
+import fs from 'fs';
+import { Worker } from 'worker_threads';
+import { PARTIAL_CHUNK_SIZE } from './hash-worker.js';
+import { mapWithConcurrency } from './concurrency.js';
+
+// Files each worker hashes at once, so one file's reads overlap another's hashing
+const JOBS_PER_WORKER = 2;
+
+// Fixed set of hash-worker.js threads, hashing off the main thread. Jobs
+// queue here and are handed out as workers free up, so only a few files are
+// open at a time however many are queued.
+class HashPool {
+  constructor(size) {
+    this.workers = [];
+    this.queue = [];
+    this.nextId = 0;
+
+    for (let i = 0; i < size; i++) {
+      const worker = new Worker(new URL('./hash-worker.js', import.meta.url));
+      const slot = { worker, jobs: new Map() };
+
+      worker.on('message', ({ id, hash, error }) => {
+        const job = slot.jobs.get(id);
+        slot.jobs.delete(id);
+        if (error) {
+          job.reject(new Error(error));
+        } else {
+          job.resolve(hash);
+        }
+        this.dispatch();
+      });
+      worker.on('error', (e) => {
+        // A worker that dies takes its in-flight jobs with it
+        for (const job of slot.jobs.values()) {
+          job.reject(e);
+        }
+        slot.jobs.clear();
+        this.workers = this.workers.filter(other => other !== slot);
+        if (this.workers.length === 0) {
+          for (const job of this.queue.splice(0)) {
+            job.reject(e);
+          }
+        }
+      });
+
+      this.workers.push(slot);
+    }
+  }
+
+  hash(kind, entry) {
+    return new Promise((resolve, reject) => {
+      this.queue.push({ id: this.nextId++, kind, entry, resolve, reject });
+      this.dispatch();
+    });
+  }
+
+  dispatch() {
+    for (const slot of this.workers) {
+      while (slot.jobs.size < JOBS_PER_WORKER && this.queue.length > 0) {
+        const job = this.queue.shift();
+        slot.jobs.set(job.id, job);
+        slot.worker.postMessage({ id: job.id, kind: job.kind, path: job.entry.path, size: job.entry.size });
+      }
+    }
+  }
+
+  async close() {
+    await Promise.all(this.workers.map(slot => slot.worker.terminate()));
+  }
+}
+
+// Group items by key, keeping only groups with more than one item
+function collisions(items, key) {
+  const groups = new Map();
+  for (const item of items) {
+    const value = key(item);
+    if (!groups.has(value)) {
+      groups.set(value, []);
+    }
+    groups.get(value).push(item);
+  }
+  return [...groups.values()].filter(group => group.length > 1);
+}
+
+// Hash every entry of every group with kind, then split each group by hash.
+// Entries that can't be read are dropped and reported through errors.
+async function splitByHash(pool, groups, kind, errors) {
+  const split = [];
+
+  await Promise.all(groups.map(async (group) => {
+    const hashed = await Promise.all(group.map(entry =>
+      pool.hash(kind, entry)
+        .then(hash => ({ ...entry, hash }))
+        .catch((e) => {
+          errors.push({ path: entry.path, error: String(e), success: false });
+          return null;
+        })
+    ));
+    split.push(...collisions(hashed.filter(Boolean), entry => entry.hash));
+  }));
+
+  return split;
+}
+
+// Reduce entries to one per physical file. Paths reached twice (through
+// symbolic links or overlapping roots) are dropped by real path, and hard
+// links are collapsed by (dev, ino): they share their data, so they are not
+// copies of each other. Returns { files, hardLinks, errors } where each file
+// is { path, size } and hardLinks lists the paths of each multiply linked file.
+async function physicalFiles(entries, concurrency) {
+  const errors = [];
+
+  const resolved = await mapWithConcurrency(entries, concurrency, async (entry) => {
+    try {
+      const realPath = await fs.promises.realpath(entry.path);
+      const stats = await fs.promises.stat(realPath, { bigint: true });
+      return { path: realPath, size: Number(stats.size), inode: `${stats.dev}:${stats.ino}` };
+    } catch (e) {
+      errors.push({ path: entry.path, error: String(e), success: false });
+      return null;
+    }
+  });
+
+  const byInode = new Map();
+  for (const entry of resolved) {
+    if (!entry) {
+      continue;
+    }
+    if (!byInode.has(entry.inode)) {
+      byInode.set(entry.inode, { path: entry.path, size: entry.size, paths: new Set() });
+    }
+    byInode.get(entry.inode).paths.add(entry.path);
+  }
+
+  const files = [];
+  const hardLinks = [];
+  for (const file of byInode.values()) {
+    files.push({ path: file.path, size: file.size });
+    if (file.paths.size > 1) {
+      hardLinks.push([...file.paths].sort());
+    }
+  }
+
+  return { files, hardLinks, errors };
+}
+
+// Find files with identical contents among entries ({ path, size } from
+// walkMedia), in stages so most files are never read:
+//
+//   1. reduce to one entry per physical file (see physicalFiles)
+//   2. group by size, a file with a unique size has no duplicate
+//   3. hash the head and tail of files that share a size
+//   4. hash the whole of files whose partial hashes also match
+//
+// Files no bigger than two partial chunks are read whole in stage 3 and
+// skip stage 4. Returns { groups, hardLinks, stats, errors }, with groups as
+// { size, hash, files } (one real path per physical file) ordered by the
+// space their copies take up, and hardLinks as lists of the paths that are
+// hard links to the same file.
+export async function findDuplicateFiles(entries, { concurrency = 4 } = {}) {
+  const { files, hardLinks, errors } = await physicalFiles(entries, concurrency);
+  const stats = {
+    files: entries.length,
+    physicalFiles: files.length,
+    sameSize: 0,
+    partialHashed: 0,
+    fullHashed: 0
+  };
+
+  const bySize = collisions(files, entry => entry.size);
+  stats.sameSize = bySize.reduce((total, group) => total + group.length, 0);
+
+  let groups = [];
+  if (bySize.length > 0) {
+    const pool = new HashPool(Math.max(1, Math.min(concurrency, stats.sameSize)));
+    try {
+      const byPartial = await splitByHash(pool, bySize, 'partial', errors);
+      stats.partialHashed = stats.sameSize;
+
+      const small = byPartial.filter(group => group[0].size <= PARTIAL_CHUNK_SIZE * 2);
+      const large = byPartial.filter(group => group[0].size > PARTIAL_CHUNK_SIZE * 2);
+      stats.fullHashed = large.reduce((total, group) => total + group.length, 0);
+
+      groups = [...small, ...await splitByHash(pool, large, 'full', errors)];
+    } finally {
+      await pool.close();
+    }
+  }
+
+  const result = groups
+    .map(group => ({
+      size: group[0].size,
+      hash: group[0].hash,
+      files: group.map(entry => entry.path).sort()
+    }))
+    .sort((a, b) => b.size * (b.files.length - 1) - a.size * (a.files.length - 1));
+
+  return { groups: result, hardLinks, stats, errors };
+}
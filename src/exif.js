@@ -0,0 +1,836 @@
+import zlib from 'zlib';
+import { FileBytes } from './image-header.js';
+
+// Upper bounds that keep a corrupt file from making us read or loop forever
+const MAX_IFD_ENTRIES = 1000;
+const MAX_VALUE_SIZE = 64 * 1024;
+const MAX_META_SIZE = 1024 * 1024;
+
+// EXIF tags reported, by IFD. Anything else is skipped to keep results small.
+const ifd0Tags = {
+  0x010e: 'ImageDescription',
+  0x010f: 'Make',
+  0x0110: 'Model',
+  0x0112: 'Orientation',
+  0x011a: 'XResolution',
+  0x011b: 'YResolution',
+  0x0128: 'ResolutionUnit',
+  0x0131: 'Software',
+  0x0132: 'DateTime',
+  0x013b: 'Artist',
+  0x8298: 'Copyright'
+};
+
+const exifTags = {
+  0x829a: 'ExposureTime',
+  0x829d: 'FNumber',
+  0x8822: 'ExposureProgram',
+  0x8827: 'ISO',
+  0x9003: 'DateTimeOriginal',
+  0x9004: 'CreateDate',
+  0x9010: 'OffsetTime',
+  0x9011: 'OffsetTimeOriginal',
+  0x9201: 'ShutterSpeedValue',
+  0x9202: 'ApertureValue',
+  0x9204: 'ExposureCompensation',
+  0x9207: 'MeteringMode',
+  0x9209: 'Flash',
+  0x920a: 'FocalLength',
+  0x9291: 'SubSecTimeOriginal',
+  0xa001: 'ColorSpace',
+  0xa002: 'ExifImageWidth',
+  0xa003: 'ExifImageHeight',
+  0xa402: 'ExposureMode',
+  0xa403: 'WhiteBalance',
+  0xa405: 'FocalLengthIn35mmFormat',
+  0xa431: 'SerialNumber',
+  0xa432: 'LensInfo',
+  0xa433: 'LensMake',
+  0xa434: 'LensModel'
+};
+
+const gpsTags = {
+  0x0001: 'GPSLatitudeRef',
+  0x0002: 'GPSLatitude',
+  0x0003: 'GPSLongitudeRef',
+  0x0004: 'GPSLongitude',
+  0x0005: 'GPSAltitudeRef',
+  0x0006: 'GPSAltitude',
+  0x0007: 'GPSTimeStamp',
+  0x0010: 'GPSImgDirectionRef',
+  0x0011: 'GPSImgDirection',
+  0x001d: 'GPSDateStamp'
+};
+
+// Pointers to sub IFDs and embedded blocks inside IFD0
+const EXIF_IFD_POINTER = 0x8769;
+const GPS_IFD_POINTER = 0x8825;
+const XMP_TAG = 700;
+const IPTC_TAG = 33723;
+
+// IPTC IIM application record (2) datasets
+const iptcDatasets = {
+  5: 'ObjectName',
+  25: 'Keywords',
+  55: 'DateCreated',
+  60: 'TimeCreated',
+  80: 'Byline',
+  90: 'City',
+  95: 'ProvinceState',
+  101: 'Country',
+  105: 'Headline',
+  110: 'Credit',
+  115: 'Source',
+  116: 'CopyrightNotice',
+  120: 'Caption',
+  122: 'Writer'
+};
+
+// TIFF field types to their sizes in bytes
+const typeSizes = { 1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8 };
+
+// Wrap an in memory buffer in the same read(offset, length) interface as FileBytes
+function bufferBytes(buffer) {
+  return {
+    read: async (offset, length) => buffer.subarray(offset, offset + length)
+  };
+}
+
+// Decode one IFD entry's value
+function decodeValue(buffer, type, count, littleEndian) {
+  const u16 = (offset) => littleEndian ? buffer.readUInt16LE(offset) : buffer.readUInt16BE(offset);
+  const u32 = (offset) => littleEndian ? buffer.readUInt32LE(offset) : buffer.readUInt32BE(offset);
+  const s32 = (offset) => littleEndian ? buffer.readInt32LE(offset) : buffer.readInt32BE(offset);
+
+  if (type === 2) {
+    return buffer.toString('latin1', 0, count).replace(/\0+$/, '').trim();
+  }
+
+  const values = [];
+  for (let i = 0; i < count; i++) {
+    switch (type) {
+      case 1:
+      case 6:
+      case 7:
+        values.push(buffer[i]);
+        break;
+      case 3:
+        values.push(u16(i * 2));
+        break;
+      case 4:
+        values.push(u32(i * 4));
+        break;
+      case 9:
+        values.push(s32(i * 4));
+        break;
+      case 5: {
+        const denominator = u32(i * 8 + 4);
+        values.push(denominator ? u32(i * 8) / denominator : 0);
+        break;
+      }
+      case 10: {
+        const denominator = s32(i * 8 + 4);
+        values.push(denominator ? s32(i * 8) / denominator : 0);
+        break;
+      }
+      default:
+        return undefined;
+    }
+  }
+
+  // Undefined type fields such as ExifVersion are mostly short ASCII strings
+  if (type === 7) {
+    const text = Buffer.from(values).toString('latin1').replace(/\0+$/, '');
+    return /^[\x20-\x7e]*$/.test(text) ? text : undefined;
+  }
+
+  return values.length === 1 ? values[0] : values;
+}
+
+// Read the IFD at offset from a TIFF structure. Only tags in names (plus the
+// pointer / raw tags) are decoded. Raw tags are returned as Buffers.
+async function readIfd(bytes, offset, littleEndian, names, rawTags = []) {
+  const u16 = (buffer, at) => littleEndian ? buffer.readUInt16LE(at) : buffer.readUInt16BE(at);
+  const u32 = (buffer, at) => littleEndian ? buffer.readUInt32LE(at) : buffer.readUInt32BE(at);
+
+  const countBuffer = await bytes.read(offset, 2);
+  if (countBuffer.length < 2) {
+    return {};
+  }
+
+  const entryCount = Math.min(u16(countBuffer, 0), MAX_IFD_ENTRIES);
+  const entries = await bytes.read(offset + 2, entryCount * 12);
+  const result = {};
+
+  for (let i = 0; i + 12 <= entries.length && i < entryCount * 12; i += 12) {
+    const tag = u16(entries, i);
+    const isRaw = rawTags.includes(tag);
+    if (!names[tag] && !isRaw) {
+      continue;
+    }
+
+    const type = u16(entries, i + 2);
+    const count = u32(entries, i + 4);
+    const size = (typeSizes[type] || 0) * count;
+    if (!size || size > MAX_VALUE_SIZE) {
+      continue;
+    }
+
+    // Values of up to four bytes are stored in the entry itself
+    const data = size <= 4 ?
+      entries.subarray(i + 8, i + 8 + size) :
+      await bytes.read(u32(entries, i + 8), size);
+    if (data.length < size) {
+      continue;
+    }
+
+    if (isRaw) {
+      result[tag] = Buffer.from(data);
+    } else {
+      const value = decodeValue(data, type, count, littleEndian);
+      if (value !== undefined && value !== '') {
+        result[names[tag]] = value;
+      }
+    }
+  }
+
+  return result;
+}
+
+// Convert degrees, minutes, seconds to signed decimal degrees
+function gpsCoordinate(value, ref) {
+  if (!Array.isArray(value) || value.length < 3) {
+    return undefined;
+  }
+  const degrees = value[0] + value[1] / 60 + value[2] / 3600;
+  return ref === 'S' || ref === 'W' ? -degrees : degrees;
+}
+
+// Parse a TIFF structure (the body of an EXIF block, or a TIFF file) and
+// return { exif, gps, xmp, iptc } where xmp / iptc are raw Buffers when the
+// TIFF embeds them
+async function parseTiffMetadata(bytes) {
+  const header = await bytes.read(0, 8);
+  if (header.length < 8) {
+    return {};
+  }
+
+  const order = header.toString('latin1', 0, 2);
+  if (order !== 'II' && order !== 'MM') {
+    return {};
+  }
+  const littleEndian = order === 'II';
+  const ifd0Offset = littleEndian ? header.readUInt32LE(4) : header.readUInt32BE(4);
+
+  const ifd0 = await readIfd(bytes, ifd0Offset, littleEndian, ifd0Tags,
+    [EXIF_IFD_POINTER, GPS_IFD_POINTER, XMP_TAG, IPTC_TAG]);
+
+  const pointer = (raw) => {
+    if (!raw || raw.length < 4) {
+      return null;
+    }
+    return littleEndian ? raw.readUInt32LE(0) : raw.readUInt32BE(0);
+  };
+
+  const exif = {};
+  for (const [key, value] of Object.entries(ifd0)) {
+    if (isNaN(Number(key))) {
+      exif[key] = value;
+    }
+  }
+
+  const exifOffset = pointer(ifd0[EXIF_IFD_POINTER]);
+  if (exifOffset) {
+    Object.assign(exif, await readIfd(bytes, exifOffset, littleEndian, exifTags));
+  }
+
+  let gps;
+  const gpsOffset = pointer(ifd0[GPS_IFD_POINTER]);
+  if (gpsOffset) {
+    const gpsIfd = await readIfd(bytes, gpsOffset, littleEndian, gpsTags);
+    Object.assign(exif, gpsIfd);
+
+    const latitude = gpsCoordinate(gpsIfd.GPSLatitude, gpsIfd.GPSLatitudeRef);
+    const longitude = gpsCoordinate(gpsIfd.GPSLongitude, gpsIfd.GPSLongitudeRef);
+    if (latitude !== undefined && longitude !== undefined) {
+      gps = { latitude, longitude };
+      if (typeof gpsIfd.GPSAltitude === 'number') {
+        // Altitude ref 1 means below sea level
+        gps.altitude = gpsIfd.GPSAltitudeRef === 1 ? -gpsIfd.GPSAltitude : gpsIfd.GPSAltitude;
+      }
+    }
+  }
+
+  return {
+    exif: Object.keys(exif).length ? exif : undefined,
+    gps,
+    xmp: ifd0[XMP_TAG],
+    iptc: ifd0[IPTC_TAG]
+  };
+}
+
+// Pull simple properties out of an XMP packet: attributes and leaf elements
+// with a namespace prefix, keyed as "prefix:Name"
+function parseXmp(xml) {
+  const text = Buffer.isBuffer(xml) ? xml.toString('utf8') : xml;
+  const properties = {};
+
+  const attributePattern = /\s([A-Za-z][\w-]*):([A-Za-z][\w-]*)="([^"]*)"/g;
+  for (const [, prefix, name, value] of text.matchAll(attributePattern)) {
+    if (!['xmlns', 'xml', 'rdf', 'x'].includes(prefix) && !(`${prefix}:${name}` in properties)) {
+      properties[`${prefix}:${name}`] = value;
+    }
+  }
+
+  const elementPattern = /<([A-Za-z][\w-]*):([A-Za-z][\w-]*)(?:\s[^>]*)?>([^<]+)<\/\1:\2>/g;
+  for (const [, prefix, name, value] of text.matchAll(elementPattern)) {
+    const key = `${prefix}:${name}`;
+    if (prefix === 'rdf') {
+      continue;
+    }
+    if (key in properties) {
+      properties[key] = [].concat(properties[key], value.trim());
+    } else {
+      properties[key] = value.trim();
+    }
+  }
+
+  // rdf:li lists (dc:title, dc:creator, dc:subject) belong to the enclosing property
+  const listPattern = /<([A-Za-z][\w-]*):([A-Za-z][\w-]*)>\s*<rdf:(?:Alt|Seq|Bag)>([\s\S]*?)<\/rdf:(?:Alt|Seq|Bag)>/g;
+  for (const [, prefix, name, body] of text.matchAll(listPattern)) {
+    const items = [...body.matchAll(/<rdf:li[^>]*>([^<]*)<\/rdf:li>/g)].map(match => match[1].trim());
+    if (items.length) {
+      properties[`${prefix}:${name}`] = items.length === 1 ? items[0] : items;
+    }
+  }
+
+  return Object.keys(properties).length ? properties : undefined;
+}
+
+// Parse IPTC IIM records, keeping the application record datasets we know
+function parseIptc(buffer) {
+  const iptc = {};
+  let offset = 0;
+
+  while (offset + 5 <= buffer.length) {
+    if (buffer[offset] !== 0x1c) {
+      offset++;
+      continue;
+    }
+
+    const record = buffer[offset + 1];
+    const dataset = buffer[offset + 2];
+    const length = buffer.readUInt16BE(offset + 3);
+    // Extended datasets (length with the high bit set) are not used by the fields we read
+    if (length & 0x8000) {
+      break;
+    }
+
+    const value = buffer.toString('utf8', offset + 5, offset + 5 + length).trim();
+    const name = iptcDatasets[dataset];
+    if (record === 2 && name && value) {
+      if (name === 'Keywords') {
+        iptc.Keywords = (iptc.Keywords || []).concat(value);
+      } else {
+        iptc[name] = value;
+      }
+    }
+
+    offset += 5 + length;
+  }
+
+  return Object.keys(iptc).length ? iptc : undefined;
+}
+
+// Find the IPTC block (resource 0x0404) in Photoshop image resources
+function photoshopIptc(buffer) {
+  let offset = 0;
+  while (offset + 12 <= buffer.length && buffer.toString('latin1', offset, offset + 4) === '8BIM') {
+    const id = buffer.readUInt16BE(offset + 4);
+    // Pascal string name, padded to an even length including the length byte
+    const nameLength = buffer[offset + 6];
+    let cursor = offset + 6 + nameLength + 1;
+    if (cursor % 2) {
+      cursor++;
+    }
+
+    const size = buffer.readUInt32BE(cursor);
+    const dataStart = cursor + 4;
+    if (id === 0x0404) {
+      return buffer.subarray(dataStart, dataStart + size);
+    }
+
+    offset = dataStart + size + (size % 2);
+  }
+  return null;
+}
+
+// Collect the raw EXIF / XMP / IPTC blocks from the JPEG APPn segments
+async function jpegBlocks(bytes) {
+  const blocks = {};
+  let offset = 2;
+
+  for (;;) {
+    const segment = await bytes.read(offset, 4);
+    if (segment.length < 4 || segment[0] !== 0xff) {
+      break;
+    }
+
+    const marker = segment[1];
+    if (marker === 0xff) {
+      offset++;
+      continue;
+    }
+
+    // Metadata segments all come before the image data
+    if (marker === 0xda || marker === 0xd9) {
+      break;
+    }
+
+    const length = segment.readUInt16BE(2);
+    if (marker === 0xe1 || marker === 0xed) {
+      const payload = await bytes.read(offset + 4, length - 2);
+
+      if (marker === 0xe1 && payload.toString('latin1', 0, 6) === 'Exif\0\0') {
+        blocks.exif = Buffer.from(payload.subarray(6));
+      } else if (marker === 0xe1 && payload.toString('latin1', 0, 29) === 'http://ns.adobe.com/xap/1.0/\0') {
+        blocks.xmp = Buffer.from(payload.subarray(29));
+      } else if (marker === 0xed && payload.toString('latin1', 0, 14) === 'Photoshop 3.0\0') {
+        blocks.iptc = photoshopIptc(payload.subarray(14));
+      }
+    }
+
+    offset += 2 + length;
+  }
+
+  return blocks;
+}
+
+// Collect the raw EXIF / XMP blocks from the PNG eXIf and iTXt chunks
+async function pngBlocks(bytes) {
+  const blocks = {};
+  let offset = 8;
+
+  for (;;) {
+    const chunkHeader = await bytes.read(offset, 8);
+    if (chunkHeader.length < 8) {
+      break;
+    }
+
+    const length = chunkHeader.readUInt32BE(0);
+    const type = chunkHeader.toString('latin1', 4, 8);
+    if (type === 'IDAT' || type === 'IEND') {
+      break;
+    }
+
+    if ((type === 'eXIf' || type === 'iTXt') && length <= MAX_VALUE_SIZE * 16) {
+      const data = await bytes.read(offset + 8, length);
+
+      if (type === 'eXIf') {
+        blocks.exif = Buffer.from(data);
+      } else {
+        const keywordEnd = data.indexOf(0);
+        if (data.toString('latin1', 0, keywordEnd) === 'XML:com.adobe.xmp') {
+          const compressed = data[keywordEnd + 1] === 1;
+          // Skip the language tag and translated keyword
+          const languageEnd = data.indexOf(0, keywordEnd + 3);
+          const translatedEnd = data.indexOf(0, languageEnd + 1);
+          const text = data.subarray(translatedEnd + 1);
+          blocks.xmp = compressed ? zlib.inflateSync(text) : Buffer.from(text);
+        }
+      }
+    }
+
+    offset += length + 12;
+  }
+
+  return blocks;
+}
+
+// Collect the raw EXIF / XMP blocks from the WebP RIFF chunks. Only the
+// extended format (a VP8X chunk first) carries them, after the image data,
+// with flags in VP8X saying which are present.
+async function webpBlocks(bytes) {
+  const blocks = {};
+
+  const vp8x = await bytes.read(12, 9);
+  if (vp8x.length < 9 || vp8x.toString('latin1', 0, 4) !== 'VP8X' || !(vp8x[8] & 0x0c)) {
+    return blocks;
+  }
+
+  const riff = await bytes.read(4, 4);
+  const end = 8 + riff.readUInt32LE(0);
+  let offset = 12;
+
+  while (offset + 8 <= end) {
+    const chunkHeader = await bytes.read(offset, 8);
+    if (chunkHeader.length < 8) {
+      break;
+    }
+
+    const type = chunkHeader.toString('latin1', 0, 4);
+    const size = chunkHeader.readUInt32LE(4);
+
+    if ((type === 'EXIF' || type === 'XMP ') && size <= MAX_META_SIZE) {
+      const data = Buffer.from(await bytes.read(offset + 8, size));
+      if (type === 'EXIF') {
+        blocks.exif = data;
+      } else {
+        blocks.xmp = data;
+      }
+      if (blocks.exif && blocks.xmp) {
+        break;
+      }
+    }
+
+    // Chunks are padded to an even size
+    offset += 8 + size + (size % 2);
+  }
+
+  return blocks;
+}
+
+// Offset just past a run of GIF data sub-blocks (each a length byte and
+// that many bytes, ended by an empty one) starting at offset
+async function skipGifSubBlocks(bytes, offset) {
+  for (;;) {
+    const size = await bytes.read(offset, 1);
+    if (size.length < 1) {
+      return null;
+    }
+    offset += 1 + size[0];
+    if (size[0] === 0) {
+      return offset;
+    }
+  }
+}
+
+// Collect the raw XMP block from a GIF's "XMP DataXMP" application
+// extension. GIF has no EXIF or IPTC container. Only the extensions before
+// the first image are read, which is where XMP writers put it, so the frames
+// of an animation are never walked.
+async function gifBlocks(bytes) {
+  const blocks = {};
+
+  const screen = await bytes.read(10, 1);
+  if (screen.length < 1) {
+    return blocks;
+  }
+  // Skip the global color table, when there is one
+  let offset = 13 + (screen[0] & 0x80 ? 3 * 2 ** ((screen[0] & 0x07) + 1) : 0);
+
+  for (;;) {
+    const introducer = await bytes.read(offset, 2);
+    // Anything but an extension is an image or the trailer
+    if (introducer.length < 2 || introducer[0] !== 0x21) {
+      break;
+    }
+
+    if (introducer[1] === 0xff) {
+      const identifier = await bytes.read(offset + 2, 12);
+      if (identifier.length === 12 && identifier.toString('latin1', 0, 12) === '\x0bXMP DataXMP') {
+        // The packet is stored raw, its bytes doubling as sub-block lengths,
+        // and is followed by a "magic trailer" starting with 0x01, a byte
+        // UTF-8 text never contains
+        const data = await bytes.read(offset + 14, MAX_META_SIZE);
+        const end = data.indexOf(0x01);
+        blocks.xmp = Buffer.from(data.subarray(0, end === -1 ? data.length : end));
+        break;
+      }
+    }
+
+    offset = await skipGifSubBlocks(bytes, offset + 2);
+    if (offset === null) {
+      break;
+    }
+  }
+
+  return blocks;
+}
+
+// Iterate ISO BMFF boxes in buffer[start, end)
+function* isoBoxes(buffer, start, end) {
+  let offset = start;
+  while (offset + 8 <= end) {
+    const size = buffer.readUInt32BE(offset);
+    if (size < 8 || offset + size > end) {
+      return;
+    }
+    yield { type: buffer.toString('latin1', offset + 4, offset + 8), start: offset + 8, end: offset + size };
+    offset += size;
+  }
+}
+
+function readSized(buffer, offset, size) {
+  if (size === 0) {
+    return 0;
+  }
+  return size === 8 ? Number(buffer.readBigUInt64BE(offset)) : buffer.readUIntBE(offset, size);
+}
+
+// Collect the raw EXIF / XMP items from a HEIF / AVIF meta box
+async function heifBlocks(bytes) {
+  // Find the top level meta box
+  let offset = 0;
+  let meta = null;
+  for (let i = 0; i < 16; i++) {
+    const boxHeader = await bytes.read(offset, 8);
+    if (boxHeader.length < 8) {
+      break;
+    }
+    const size = boxHeader.readUInt32BE(0);
+    if (boxHeader.toString('latin1', 4, 8) === 'meta') {
+      if (size > MAX_META_SIZE) {
+        return {};
+      }
+      meta = Buffer.from(await bytes.read(offset, size));
+      break;
+    }
+    if (size < 8) {
+      break;
+    }
+    offset += size;
+  }
+
+  if (!meta) {
+    return {};
+  }
+
+  // meta is a full box, its children start after version and flags
+  const items = new Map();
+  for (const box of isoBoxes(meta, 12, meta.length)) {
+    if (box.type === 'iinf') {
+      const version = meta[box.start];
+      const entriesStart = box.start + (version === 0 ? 6 : 8);
+
+      for (const infe of isoBoxes(meta, entriesStart, box.end)) {
+        if (infe.type !== 'infe' || meta[infe.start] < 2) {
+          continue;
+        }
+        const infeVersion = meta[infe.start];
+        const idSize = infeVersion === 2 ? 2 : 4;
+        const itemId = readSized(meta, infe.start + 4, idSize);
+        const typeStart = infe.start + 4 + idSize + 2;
+        const itemType = meta.toString('latin1', typeStart, typeStart + 4);
+
+        let contentType = null;
+        if (itemType === 'mime') {
+          const nameEnd = meta.indexOf(0, typeStart + 4);
+          const contentTypeEnd = meta.indexOf(0, nameEnd + 1);
+          contentType = meta.toString('latin1', nameEnd + 1, contentTypeEnd);
+        }
+
+        items.set(itemId, { itemType, contentType, extents: [] });
+      }
+    }
+  }
+
+  for (const box of isoBoxes(meta, 12, meta.length)) {
+    if (box.type !== 'iloc') {
+      continue;
+    }
+
+    const version = meta[box.start];
+    let cursor = box.start + 4;
+    const offsetSize = meta[cursor] >> 4;
+    const lengthSize = meta[cursor] & 0x0f;
+    const baseOffsetSize = meta[cursor + 1] >> 4;
+    const indexSize = version === 1 || version === 2 ? meta[cursor + 1] & 0x0f : 0;
+    cursor += 2;
+
+    const itemCount = version < 2 ? meta.readUInt16BE(cursor) : meta.readUInt32BE(cursor);
+    cursor += version < 2 ? 2 : 4;
+
+    for (let i = 0; i < itemCount && cursor < box.end; i++) {
+      const itemId = version < 2 ? meta.readUInt16BE(cursor) : meta.readUInt32BE(cursor);
+      cursor += version < 2 ? 2 : 4;
+
+      let constructionMethod = 0;
+      if (version === 1 || version === 2) {
+        constructionMethod = meta.readUInt16BE(cursor) & 0x0f;
+        cursor += 2;
+      }
+      cursor += 2; // data_reference_index
+
+      const baseOffset = readSized(meta, cursor, baseOffsetSize);
+      cursor += baseOffsetSize;
+
+      const extentCount = meta.readUInt16BE(cursor);
+      cursor += 2;
+
+      const item = items.get(itemId);
+      for (let e = 0; e < extentCount; e++) {
+        cursor += indexSize;
+        const extentOffset = readSized(meta, cursor, offsetSize);
+        cursor += offsetSize;
+        const extentLength = readSized(meta, cursor, lengthSize);
+        cursor += lengthSize;
+
+        // Only items stored in the file itself (not in idat) are read
+        if (item && constructionMethod === 0) {
+          item.extents.push({ offset: baseOffset + extentOffset, length: extentLength });
+        }
+      }
+    }
+  }
+
+  const readItem = async (item) => {
+    const parts = [];
+    for (const extent of item.extents) {
+      if (extent.length > MAX_META_SIZE) {
+        return null;
+      }
+      parts.push(Buffer.from(await bytes.read(extent.offset, extent.length)));
+    }
+    return Buffer.concat(parts);
+  };
+
+  const blocks = {};
+  for (const item of items.values()) {
+    if (!item.extents.length) {
+      continue;
+    }
+
+    if (item.itemType === 'Exif' && !blocks.exif) {
+      const data = await readItem(item);
+      // The item starts with the offset of the TIFF header past these 4 bytes
+      if (data && data.length > 4) {
+        blocks.exif = data.subarray(4 + data.readUInt32BE(0));
+      }
+    } else if (item.itemType === 'mime' && item.contentType === 'application/rdf+xml' && !blocks.xmp) {
+      blocks.xmp = await readItem(item);
+    }
+  }
+
+  return blocks;
+}
+
+// Turn an EXIF "YYYY:MM:DD HH:MM:SS" date into an ISO 8601 string
+function exifDateToIso(value, offset) {
+  const match = typeof value === 'string' &&
+    value.match(/^(\d{4}):(\d{2}):(\d{2})[ T](\d{2}):(\d{2}):(\d{2})/);
+  if (!match) {
+    return undefined;
+  }
+  const [, year, month, day, hours, minutes, seconds] = match;
+  return `${year}-${month}-${day}T${hours}:${minutes}:${seconds}${offset || ''}`;
+}
+
+// Pick the best creation date from the collected metadata
+function creationDate({ exif, xmp, iptc }) {
+  if (exif) {
+    const date = exifDateToIso(exif.DateTimeOriginal, exif.OffsetTimeOriginal) ||
+                 exifDateToIso(exif.CreateDate, exif.OffsetTime) ||
+                 exifDateToIso(exif.DateTime, exif.OffsetTime);
+    if (date) {
+      return date;
+    }
+  }
+
+  if (xmp) {
+    const date = xmp['exif:DateTimeOriginal'] || xmp['xmp:CreateDate'] || xmp['photoshop:DateCreated'];
+    if (date) {
+      return date;
+    }
+  }
+
+  if (iptc && iptc.DateCreated && /^\d{8}$/.test(iptc.DateCreated)) {
+    const date = iptc.DateCreated;
+    return `${date.slice(0, 4)}-${date.slice(4, 6)}-${date.slice(6, 8)}`;
+  }
+
+  return undefined;
+}
+
+// Density in DPI from EXIF XResolution / ResolutionUnit (2 or missing for
+// inches, 3 for centimeters), as sharp reports it, or undefined
+export function exifDensity(exif) {
+  if (!exif || !(exif.XResolution > 0)) {
+    return undefined;
+  }
+  const unit = exif.ResolutionUnit || 2;
+  if (unit === 2) {
+    return Math.round(exif.XResolution);
+  }
+  if (unit === 3) {
+    return Math.round(exif.XResolution * 2.54);
+  }
+  return undefined;
+}
+
+// Read EXIF (including GPS), XMP and IPTC metadata for an image without
+// decoding any pixels. Only the metadata containers are read: JPEG APP1 /
+// APP13 segments, the TIFF IFD chain, PNG eXIf / iTXt chunks, WebP EXIF /
+// XMP chunks, the GIF XMP extension and the HEIF Exif / XMP items.
+//
+// header is the start of the file as already read by the caller. For any
+// other format the raw exif / xmp / iptc Buffers of sharpMetadata (sharp's
+// metadata() for the file) are parsed, when given.
+//
+// Returns { exif, gps, xmp, iptc, creation_date } with missing parts left undefined.
+export async function readImageMetadata(filePath, header, format, sharpMetadata = null) {
+  const bytes = new FileBytes(filePath, header);
+
+  try {
+    let blocks = {};
+    let tiffFile = null;
+
+    switch (format) {
+      case 'jpeg':
+        blocks = await jpegBlocks(bytes);
+        break;
+      case 'png':
+        blocks = await pngBlocks(bytes);
+        break;
+      case 'tiff':
+        tiffFile = await parseTiffMetadata(bytes);
+        break;
+      case 'heif':
+      case 'avif':
+        blocks = await heifBlocks(bytes);
+        break;
+      case 'webp':
+        blocks = await webpBlocks(bytes);
+        break;
+      case 'gif':
+        blocks = await gifBlocks(bytes);
+        break;
+      default:
+        if (sharpMetadata) {
+          blocks = {
+            exif: sharpMetadata.exif,
+            xmp: sharpMetadata.xmp,
+            iptc: sharpMetadata.iptc
+          };
+        }
+    }
+
+    let exifResult = tiffFile || {};
+    if (blocks.exif && blocks.exif.length >= 8) {
+      // sharp's exif buffer, and some WebP writers' EXIF chunk, keep the "Exif\0\0" prefix
+      const exifBuffer = blocks.exif.toString('latin1', 0, 6) === 'Exif\0\0' ?
+        blocks.exif.subarray(6) :
+        blocks.exif;
+      exifResult = await parseTiffMetadata(bufferBytes(exifBuffer));
+    }
+
+    const xmpBuffer = blocks.xmp || exifResult.xmp;
+    const iptcBuffer = blocks.iptc || exifResult.iptc;
+
+    const result = {
+      exif: exifResult.exif,
+      gps: exifResult.gps,
+      xmp: xmpBuffer ? parseXmp(xmpBuffer) : undefined,
+      iptc: iptcBuffer ? parseIptc(iptcBuffer) : undefined
+    };
+    result.creation_date = creationDate(result);
+
+    return result;
+  } catch (e) {
+    // Metadata is best effort, a corrupt block shouldn't fail the whole file
+    console.error(`Error reading image metadata for ${filePath}: ${e.message}`);
+    return {};
+  } finally {
+    await bytes.close();
+  }
+}
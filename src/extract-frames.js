@@ -0,0 +1,257 @@
+import fs from 'fs';
+import path from 'path';
+import crypto from 'crypto';
+import ffmpeg from 'fluent-ffmpeg';
+import { showinfoTime } from './thumbnail.js';
+
+// How frames at given timestamps are extracted:
+//   auto   - whichever the cost model expects to cost less
+//   seek   - timestamps close enough together to decode through are grouped,
+//            and each group is one input with a fast input seek to the
+//            keyframe before its first timestamp, decoding on to the exact
+//            frame of each. At most MAX_INPUTS_PER_PROCESS inputs go in one
+//            ffmpeg process, further ones in further processes.
+//   select - one seek to the first timestamp, then a single decode through
+//            to the last, keeping the frame at each timestamp
+export const extractionMethods = ['auto', 'seek', 'select'];
+
+// Keyframe spacing assumed by the cost model, in seconds. Most encoders put
+// a keyframe every one to five seconds.
+const ASSUMED_KEYFRAME_INTERVAL = 2;
+
+// Fixed cost of an extra input (opening, probing and seeking it), counted
+// in decoded frames
+const SEEK_OVERHEAD_FRAMES = 10;
+
+// Inputs, each with its own decoder holding full resolution frames, open at
+// once in one ffmpeg process
+const MAX_INPUTS_PER_PROCESS = 8;
+
+// Cost of each decoder held open at once (its frame buffers and threads),
+// and of starting another ffmpeg process, counted in decoded frames
+const DECODER_OVERHEAD_FRAMES = 15;
+const PROCESS_OVERHEAD_FRAMES = 30;
+
+// Frame rate assumed when the video doesn't report one
+const DEFAULT_FPS = 30;
+
+// Group sorted timestamps for seeking. A timestamp joins the group before it
+// when decoding on to it is cheaper than a seek of its own.
+function seekGroups(times, fps) {
+  const seekCost = SEEK_OVERHEAD_FRAMES + (fps * ASSUMED_KEYFRAME_INTERVAL) / 2;
+  const groups = [];
+  for (const time of times) {
+    const group = groups[groups.length - 1];
+    if (group && (time - group[group.length - 1]) * fps < seekCost) {
+      group.push(time);
+    } else {
+      groups.push([time]);
+    }
+  }
+  return groups;
+}
+
+// Estimated cost of each method, in decoded frames. A seek decodes on
+// average half a keyframe interval to reach its timestamp and then on
+// through the rest of its group, and every decoder and process held open
+// costs on top. A select decodes everything from the first timestamp to the
+// last.
+export function extractionCosts(times, fps = DEFAULT_FPS) {
+  const halfInterval = (fps * ASSUMED_KEYFRAME_INTERVAL) / 2;
+  const groups = seekGroups(times, fps);
+  const processes = Math.ceil(groups.length / MAX_INPUTS_PER_PROCESS);
+  const decoding = groups.reduce(
+    (total, group) => total + SEEK_OVERHEAD_FRAMES + halfInterval + (group[group.length - 1] - group[0]) * fps,
+    0
+  );
+  return {
+    seek: decoding +
+      Math.min(groups.length, MAX_INPUTS_PER_PROCESS) * DECODER_OVERHEAD_FRAMES +
+      processes * PROCESS_OVERHEAD_FRAMES,
+    select: halfInterval + (times[times.length - 1] - times[0]) * fps +
+      DECODER_OVERHEAD_FRAMES + PROCESS_OVERHEAD_FRAMES
+  };
+}
+
+function chooseMethod(method, times, fps) {
+  if (method !== 'auto') {
+    return method;
+  }
+  if (times.length === 1) {
+    return 'seek';
+  }
+  const costs = extractionCosts(times, fps);
+  return costs.select < costs.seek ? 'select' : 'seek';
+}
+
+function frameFileName(time) {
+  return `frame_${time.toFixed(3)}.png`;
+}
+
+// Run a fluent-ffmpeg command, resolving when it finishes. onStderr gets
+// each line of ffmpeg's log.
+function run(command, onStderr = null) {
+  return new Promise((resolve, reject) => {
+    if (onStderr) {
+      command.on('stderr', onStderr);
+    }
+    command
+      .on('error', (err) => {
+        console.error(`Error extracting frames: ${err.message}`);
+        reject(err);
+      })
+      .on('end', () => resolve())
+      .run();
+  });
+}
+
+// One process for up to MAX_INPUTS_PER_PROCESS groups of timestamps. Each
+// group is an input seeked to its first timestamp, split into a branch per
+// timestamp that trims to the first frame at or after it. The job's threads
+// are shared between the inputs' decoders rather than given to each.
+async function extractGroups(videoPath, outputDir, groups, threads, filters) {
+  const command = ffmpeg();
+  const decoderThreads = threads ? [`-threads ${Math.max(1, Math.floor(threads / groups.length))}`] : [];
+  const graph = [];
+  const outputs = [];
+
+  groups.forEach((group, input) => {
+    // After the input seek, frame times count from the group's first timestamp
+    const start = group[0];
+    command.input(videoPath).inputOptions([...decoderThreads, `-ss ${start.toFixed(3)}`]);
+
+    const branches = group.map((time, index) => `[g${input}_${index}]`);
+    graph.push(group.length > 1 ?
+      `[${input}:v:0]split=${group.length}${branches.join('')}` :
+      `[${input}:v:0]null${branches[0]}`);
+
+    group.forEach((time, index) => {
+      const label = `f${input}_${index}`;
+      const trim = [`trim=start=${(time - start).toFixed(3)}`, 'trim=end_frame=1', ...filters];
+      graph.push(`${branches[index]}${trim.join(',')}[${label}]`);
+      outputs.push({ label, path: path.join(outputDir, frameFileName(time)) });
+    });
+  });
+
+  command.complexFilter(graph);
+  if (threads) {
+    command.outputOptions([`-filter_complex_threads ${threads}`]);
+  }
+  // A single frame gains nothing from encoder threads, so outputs use none
+  for (const output of outputs) {
+    command.output(output.path).outputOptions([`-map [${output.label}]`, '-threads 1', '-frames:v 1']);
+  }
+
+  await run(command);
+  return outputs.map(output => output.path);
+}
+
+// Seek to each group of nearby timestamps (see seekGroups), running the
+// groups a process at a time
+async function extractBySeeking(videoPath, outputDir, times, threads, filters, fps) {
+  const groups = seekGroups(times, fps);
+  const paths = [];
+  for (let i = 0; i < groups.length; i += MAX_INPUTS_PER_PROCESS) {
+    paths.push(...await extractGroups(videoPath, outputDir, groups.slice(i, i + MAX_INPUTS_PER_PROCESS), threads, filters));
+  }
+  return paths;
+}
+
+// Seek to the first timestamp, then one pass keeping the first frame at or
+// after each later one. showinfo logs the time of each kept frame, which
+// maps the numbered outputs back to the timestamps.
+async function extractBySelecting(videoPath, outputDir, times, threadOptions, filters) {
+  // After the input seek, frame times count from the first timestamp
+  const start = times[0];
+  const relative = times.map(time => (time - start).toFixed(3));
+  const terms = relative.map(time => `gte(t,${time})*(isnan(prev_t)+lt(prev_t,${time}))`);
+
+  const pattern = `.extract-${crypto.randomUUID()}-%04d.png`;
+  const keptTimes = [];
+
+  await run(
+    ffmpeg(videoPath)
+      .inputOptions([...threadOptions, `-ss ${start.toFixed(3)}`])
+      .outputOptions([
+        ...threadOptions,
+        `-vf select='${terms.join('+')}',showinfo${filters.map(filter => `,${filter}`).join('')}`,
+        '-vsync vfr',
+        `-frames:v ${times.length}`
+      ])
+      .output(path.join(outputDir, pattern)),
+    (line) => {
+      const time = showinfoTime(line);
+      if (time !== null) {
+        keptTimes.push(time);
+      }
+    }
+  );
+
+  const keptPath = index => path.join(outputDir, pattern.replace('%04d', String(index + 1).padStart(4, '0')));
+
+  // Two timestamps inside one frame's duration share a kept frame
+  const paths = [];
+  const used = new Set();
+  let kept = 0;
+  for (let i = 0; i < times.length; i++) {
+    // The frame kept for a timestamp is the first at or after it
+    while (kept < keptTimes.length && keptTimes[kept] < Number(relative[i]) - 0.0005) {
+      kept++;
+    }
+
+    const framePath = path.join(outputDir, frameFileName(times[i]));
+    if (kept < keptTimes.length) {
+      if (used.has(kept)) {
+        await fs.promises.copyFile(paths[paths.length - 1], framePath);
+      } else {
+        await fs.promises.rename(keptPath(kept), framePath);
+        used.add(kept);
+      }
+      paths.push(framePath);
+    } else {
+      paths.push(null);
+    }
+  }
+
+  // Anything kept but not claimed (which shouldn't happen) is cleaned up
+  for (let i = 0; i < keptTimes.length; i++) {
+    if (!used.has(i)) {
+      await fs.promises.rm(keptPath(i), { force: true });
+    }
+  }
+
+  return paths;
+}
+
+// Extract the frames of a video at timestamps (seconds) into outputDir as
+// frame_<seconds>.png, in one ffmpeg process (or, seeking to many groups of
+// timestamps, one per MAX_INPUTS_PER_PROCESS groups).
+//
+// options.method is one of extractionMethods (default auto), options.fps
+// the video's frame rate for the cost model, options.width scales frames
+// to that width and options.threads limits ffmpeg's threads.
+//
+// Returns { method, costs, frames: [{ time, path }] } with frames in
+// timestamp order. path is null for a timestamp no frame was found for.
+export async function extractFrames(videoPath, outputDir, timestamps, options = {}) {
+  const threadOptions = options.threads ? [`-threads ${options.threads}`] : [];
+  const filters = options.width ? [`scale=${options.width}:-2`] : [];
+  const fps = options.fps || DEFAULT_FPS;
+
+  // Sorted and without repeats, to the millisecond the file names use
+  const times = [...new Set(timestamps.map(time => Number(time.toFixed(3))))].sort((a, b) => a - b);
+  const method = chooseMethod(options.method || 'auto', times, fps);
+
+  const paths = method === 'select' ?
+    await extractBySelecting(videoPath, outputDir, times, threadOptions, filters) :
+    await extractBySeeking(videoPath, outputDir, times, options.threads, filters, fps);
+
+  return {
+    method,
+    costs: extractionCosts(times, fps),
+    frames: times.map((time, index) => ({
+      time,
+      path: paths[index] && fs.existsSync(paths[index]) ? paths[index] : null
+    }))
+  };
+}
@@ -0,0 +1,108 @@
+import { spawn } from 'child_process';
+
+// Same override fluent-ffmpeg honours, so both find the same binary
+const ffprobePath = process.env.FFPROBE_PATH || 'ffprobe';
+
+// Only the fields getVideoInfo reports are requested, which keeps ffprobe's
+// output (and our parse) small
+const formatEntries = [
+  'filename', 'nb_streams', 'format_name', 'format_long_name',
+  'start_time', 'duration', 'size', 'bit_rate'
+];
+
+const streamEntries = [
+  'index', 'codec_name', 'codec_long_name', 'profile', 'codec_type', 'codec_tag_string',
+  'width', 'height', 'display_aspect_ratio', 'pix_fmt', 'field_order',
+  'r_frame_rate', 'avg_frame_rate', 'time_base', 'start_time', 'duration', 'bit_rate', 'nb_frames',
+  'sample_fmt', 'sample_rate', 'channels', 'channel_layout', 'bits_per_raw_sample',
+  'nb_read_packets', 'nb_read_frames'
+];
+
+const tagEntries = [
+  'creation_time', 'date', 'com.apple.quicktime.creationdate',
+  'language', 'title', 'encoder', 'handler_name'
+];
+
+// How much work a probe does:
+//   quick    - container header only, with the smallest probe size
+//   standard - the default; the analyze duration is cut from ffmpeg's 5s to 2s,
+//              which is enough to find the streams in the containers we handle
+//   exact    - also reads every packet to count frames exactly
+export const probeDepths = ['quick', 'standard', 'exact'];
+
+const depthSettings = {
+  quick: { probeSize: 500000, analyzeDuration: 500000, args: [] },
+  standard: { probeSize: 5000000, analyzeDuration: 2000000, args: [] },
+  exact: { probeSize: 5000000, analyzeDuration: 2000000, args: ['-count_packets'] }
+};
+
+// Build the -show_entries selector
+function showEntries() {
+  return [
+    `format=${formatEntries.join(',')}`,
+    `format_tags=${tagEntries.join(',')}`,
+    `stream=${streamEntries.join(',')}`,
+    `stream_tags=${tagEntries.join(',')}`
+  ].join(':');
+}
+
+// Run ffprobe directly with JSON output and return the parsed { streams, format }.
+//
+// options.depth is one of probeDepths (default standard). With depth exact,
+// options.decodeFrames counts frames by decoding every one of them rather than
+// counting packets, which is slower still but right for codecs that pack
+// several frames in a packet.
+export function runFfprobe(filePath, options = {}) {
+  const settings = depthSettings[options.depth] || depthSettings.standard;
+  const countArgs = options.depth === 'exact' && options.decodeFrames ?
+    ['-count_frames'] :
+    settings.args;
+
+  const args = [
+    '-v', 'error',
+    '-probesize', String(settings.probeSize),
+    '-analyzeduration', String(settings.analyzeDuration),
+    '-print_format', 'json',
+    '-show_entries', showEntries(),
+    ...countArgs,
+    '-i', filePath
+  ];
+
+  return new Promise((resolve, reject) => {
+    const child = spawn(ffprobePath, args, { stdio: ['ignore', 'pipe', 'pipe'] });
+    const stdout = [];
+    const stderr = [];
+
+    child.stdout.on('data', chunk => stdout.push(chunk));
+    child.stderr.on('data', chunk => stderr.push(chunk));
+
+    child.on('error', (err) => {
+      if (err.code === 'ENOENT') {
+        reject(new Error(`Cannot find ffprobe at "${ffprobePath}", make sure it is installed and in your path`));
+      } else {
+        reject(err);
+      }
+    });
+
+    child.on('close', (code) => {
+      if (code !== 0) {
+        const message = Buffer.concat(stderr).toString().trim();
+        reject(new Error(message || `ffprobe exited with code ${code}`));
+        return;
+      }
+
+      let metadata;
+      try {
+        metadata = JSON.parse(Buffer.concat(stdout).toString());
+      } catch (e) {
+        reject(new Error(`Could not parse ffprobe output: ${e.message}`));
+        return;
+      }
+
+      resolve({
+        streams: metadata.streams || [],
+        format: metadata.format || {}
+      });
+    });
+  });
+}
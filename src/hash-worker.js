@@ -0,0 +1,59 @@
+import { parentPort } from 'worker_threads';
+import fs from 'fs';
+import crypto from 'crypto';
+
+// Bytes read from each end of a file for a partial hash
+export const PARTIAL_CHUNK_SIZE = 64 * 1024;
+
+// Read size for full hashes. Large sequential reads keep spinning disks and
+// network shares streaming instead of seeking.
+const READ_SIZE = 4 * 1024 * 1024;
+
+const HASH_ALGORITHM = 'sha256';
+
+// Hash the first and last PARTIAL_CHUNK_SIZE bytes. Files no bigger than two
+// chunks are hashed whole, so their partial hash is also their full hash.
+async function partialHash(filePath, size) {
+  const hash = crypto.createHash(HASH_ALGORITHM);
+  const handle = await fs.promises.open(filePath, 'r');
+
+  try {
+    const ranges = size <= PARTIAL_CHUNK_SIZE * 2 ?
+      [[0, size]] :
+      [[0, PARTIAL_CHUNK_SIZE], [size - PARTIAL_CHUNK_SIZE, PARTIAL_CHUNK_SIZE]];
+
+    for (const [position, length] of ranges) {
+      const buffer = Buffer.alloc(length);
+      const { bytesRead } = await handle.read(buffer, 0, length, position);
+      hash.update(buffer.subarray(0, bytesRead));
+    }
+  } finally {
+    await handle.close();
+  }
+
+  return hash.digest('hex');
+}
+
+async function fullHash(filePath) {
+  const hash = crypto.createHash(HASH_ALGORITHM);
+  const stream = fs.createReadStream(filePath, { highWaterMark: READ_SIZE });
+
+  for await (const chunk of stream) {
+    hash.update(chunk);
+  }
+
+  return hash.digest('hex');
+}
+
+// Messages are { id, kind: 'partial' | 'full', path, size },
+// replies are { id, hash } or { id, error }
+if (parentPort) {
+  parentPort.on('message', async ({ id, kind, path, size }) => {
+    try {
+      const hash = kind === 'partial' ? await partialHash(path, size) : await fullHash(path);
+      parentPort.postMessage({ id, hash });
+    } catch (e) {
+      parentPort.postMessage({ id, error: e.message });
+    }
+  });
+}
@@ -0,0 +1,357 @@
+import fs from 'fs';
+
+// Bytes read at a time when a header field lies past the buffer we already have
+const CHUNK_SIZE = 4096;
+
+// Sniffed formats whose headers are parsed here, everything else goes to sharp
+export const headerImageFormats = ['jpeg', 'png', 'gif', 'webp', 'bmp', 'tiff'];
+
+// Gives parsers access to bytes anywhere in the file, served from the header
+// that was already read when possible and from positional reads otherwise
+export class FileBytes {
+  constructor(filePath, header) {
+    this.filePath = filePath;
+    this.header = header;
+    this.handle = null;
+    // Last chunk read from the file, so nearby reads don't hit the disk again
+    this.chunk = null;
+    this.chunkOffset = 0;
+  }
+
+  async read(offset, length) {
+    if (offset + length <= this.header.length) {
+      return this.header.subarray(offset, offset + length);
+    }
+
+    if (this.chunk && offset >= this.chunkOffset &&
+        offset + length <= this.chunkOffset + this.chunk.length) {
+      return this.chunk.subarray(offset - this.chunkOffset, offset - this.chunkOffset + length);
+    }
+
+    if (!this.handle) {
+      this.handle = await fs.promises.open(this.filePath, 'r');
+    }
+
+    const buffer = Buffer.alloc(Math.max(length, CHUNK_SIZE));
+    const { bytesRead } = await this.handle.read(buffer, 0, buffer.length, offset);
+    this.chunk = buffer.subarray(0, bytesRead);
+    this.chunkOffset = offset;
+    return this.chunk.subarray(0, Math.min(length, bytesRead));
+  }
+
+  async close() {
+    if (this.handle) {
+      await this.handle.close();
+    }
+  }
+}
+
+function pixelsPerMeterToDpi(ppm) {
+  return ppm ? Math.round(ppm * 0.0254) : undefined;
+}
+
+function parsePng(header) {
+  if (header.length < 33 || header.toString('latin1', 12, 16) !== 'IHDR') {
+    return null;
+  }
+
+  const colorType = header[25];
+  const metadata = {
+    format: 'png',
+    width: header.readUInt32BE(16),
+    height: header.readUInt32BE(20),
+    // Grayscale + alpha and RGBA
+    hasAlpha: colorType === 4 || colorType === 6
+  };
+
+  // Ancillary chunks before the image data carry transparency and density
+  let offset = 33;
+  while (offset + 8 <= header.length) {
+    const length = header.readUInt32BE(offset);
+    const type = header.toString('latin1', offset + 4, offset + 8);
+
+    if (type === 'IDAT' || type === 'IEND') {
+      break;
+    }
+    if (type === 'tRNS') {
+      metadata.hasAlpha = true;
+    }
+    if (type === 'pHYs' && offset + 17 <= header.length && header[offset + 16] === 1) {
+      metadata.density = pixelsPerMeterToDpi(header.readUInt32BE(offset + 8));
+    }
+
+    offset += length + 12;
+  }
+
+  return metadata;
+}
+
+async function parseJpeg(bytes) {
+  const metadata = { format: 'jpeg', hasAlpha: false };
+  let offset = 2;
+
+  // Walk the marker segments up to the start of frame
+  for (;;) {
+    let segment = await bytes.read(offset, 4);
+    if (segment.length < 4 || segment[0] !== 0xff) {
+      return null;
+    }
+
+    const marker = segment[1];
+    // Fill bytes before a marker
+    if (marker === 0xff) {
+      offset++;
+      continue;
+    }
+
+    const length = segment.readUInt16BE(2);
+
+    // SOF0-SOF15, except DHT (C4), JPG (C8) and DAC (CC)
+    if (marker >= 0xc0 && marker <= 0xcf && marker !== 0xc4 && marker !== 0xc8 && marker !== 0xcc) {
+      segment = await bytes.read(offset + 4, 6);
+      if (segment.length < 6) {
+        return null;
+      }
+      metadata.height = segment.readUInt16BE(1);
+      metadata.width = segment.readUInt16BE(3);
+      return metadata;
+    }
+
+    if (marker === 0xe0) {
+      segment = await bytes.read(offset + 4, 12);
+      if (segment.length >= 12 && segment.toString('latin1', 0, 5) === 'JFIF\0') {
+        const units = segment[7];
+        const xDensity = segment.readUInt16BE(8);
+        if (units === 1) {
+          metadata.density = xDensity;
+        } else if (units === 2) {
+          metadata.density = Math.round(xDensity * 2.54);
+        }
+      }
+    }
+
+    // Start of scan or end of image without a frame header
+    if (marker === 0xda || marker === 0xd9) {
+      return null;
+    }
+
+    offset += 2 + length;
+  }
+}
+
+function parseGif(header) {
+  if (header.length < 13) {
+    return null;
+  }
+
+  const metadata = {
+    format: 'gif',
+    width: header.readUInt16LE(6),
+    height: header.readUInt16LE(8),
+    hasAlpha: false
+  };
+
+  // Skip the global color table, then look for a graphic control extension
+  // with the transparent color flag set
+  let offset = 13;
+  const flags = header[10];
+  if (flags & 0x80) {
+    offset += 3 * (1 << ((flags & 0x07) + 1));
+  }
+
+  if (offset + 8 <= header.length &&
+      header[offset] === 0x21 && header[offset + 1] === 0xf9 && (header[offset + 3] & 0x01)) {
+    metadata.hasAlpha = true;
+  }
+
+  return metadata;
+}
+
+function parseWebp(header) {
+  if (header.length < 30) {
+    return null;
+  }
+
+  const chunk = header.toString('latin1', 12, 16);
+
+  if (chunk === 'VP8X') {
+    return {
+      format: 'webp',
+      hasAlpha: Boolean(header[20] & 0x10),
+      width: header.readUIntLE(24, 3) + 1,
+      height: header.readUIntLE(27, 3) + 1
+    };
+  }
+
+  if (chunk === 'VP8L' && header[20] === 0x2f) {
+    const bits = header.readUInt32LE(21);
+    return {
+      format: 'webp',
+      width: (bits & 0x3fff) + 1,
+      height: ((bits >> 14) & 0x3fff) + 1,
+      hasAlpha: Boolean((bits >> 28) & 0x01)
+    };
+  }
+
+  // Lossy frames start with a 3 byte tag and the 9d 01 2a start code
+  if (chunk === 'VP8 ' && header[23] === 0x9d && header[24] === 0x01 && header[25] === 0x2a) {
+    return {
+      format: 'webp',
+      width: header.readUInt16LE(26) & 0x3fff,
+      height: header.readUInt16LE(28) & 0x3fff,
+      hasAlpha: false
+    };
+  }
+
+  return null;
+}
+
+function parseBmp(header) {
+  if (header.length < 30) {
+    return null;
+  }
+
+  const headerSize = header.readUInt32LE(14);
+
+  // OS/2 v1 headers use 16 bit dimensions
+  if (headerSize === 12) {
+    return {
+      format: 'bmp',
+      width: header.readUInt16LE(18),
+      height: header.readUInt16LE(20),
+      hasAlpha: false
+    };
+  }
+
+  const metadata = {
+    format: 'bmp',
+    width: header.readInt32LE(18),
+    // Negative heights mean the rows are stored top down
+    height: Math.abs(header.readInt32LE(22)),
+    hasAlpha: header.readUInt16LE(28) === 32
+  };
+
+  if (headerSize >= 40 && header.length >= 42) {
+    metadata.density = pixelsPerMeterToDpi(header.readInt32LE(38));
+  }
+
+  return metadata;
+}
+
+async function parseTiff(bytes) {
+  const byteOrder = await bytes.read(0, 8);
+  if (byteOrder.length < 8) {
+    return null;
+  }
+
+  const littleEndian = byteOrder.toString('latin1', 0, 2) === 'II';
+  const u16 = (buffer, offset) => littleEndian ? buffer.readUInt16LE(offset) : buffer.readUInt16BE(offset);
+  const u32 = (buffer, offset) => littleEndian ? buffer.readUInt32LE(offset) : buffer.readUInt32BE(offset);
+
+  const ifdOffset = u32(byteOrder, 4);
+  const countBuffer = await bytes.read(ifdOffset, 2);
+  if (countBuffer.length < 2) {
+    return null;
+  }
+
+  const entryCount = u16(countBuffer, 0);
+  const entries = await bytes.read(ifdOffset + 2, entryCount * 12);
+  if (entries.length < entryCount * 12) {
+    return null;
+  }
+
+  const fields = {};
+  for (let i = 0; i < entryCount; i++) {
+    const entry = i * 12;
+    const tag = u16(entries, entry);
+    const type = u16(entries, entry + 2);
+    const valueOffset = entry + 8;
+
+    if (type === 3) {
+      fields[tag] = u16(entries, valueOffset);
+    } else if (type === 4) {
+      fields[tag] = u32(entries, valueOffset);
+    } else if (type === 5) {
+      // Rationals don't fit in the entry, keep where they live
+      fields[tag] = { rationalAt: u32(entries, valueOffset) };
+    }
+  }
+
+  const width = fields[256];
+  const height = fields[257];
+  if (!width || !height) {
+    return null;
+  }
+
+  const samplesPerPixel = fields[277] || 1;
+  const photometric = fields[262];
+  const colorSamples = photometric === 0 || photometric === 1 ? 1 : 3;
+
+  const metadata = {
+    format: 'tiff',
+    width,
+    height,
+    hasAlpha: samplesPerPixel > colorSamples || fields[338] !== undefined
+  };
+
+  // XResolution, in inches unless ResolutionUnit says centimeters
+  if (fields[282] && fields[282].rationalAt !== undefined) {
+    const rational = await bytes.read(fields[282].rationalAt, 8);
+    if (rational.length === 8 && u32(rational, 4)) {
+      const resolution = u32(rational, 0) / u32(rational, 4);
+      metadata.density = Math.round(fields[296] === 3 ? resolution * 2.54 : resolution);
+    }
+  }
+
+  return metadata;
+}
+
+// Read format, dimensions, density and alpha for an image from its header
+// bytes alone, without decoding it. The result uses the same field names as
+// sharp's metadata().
+//
+// header is the start of the file as already read by the caller. Fields past
+// it are fetched with small positional reads. Returns null when the format is
+// not handled here or the header doesn't look right, so the caller can fall
+// back to sharp.
+export async function readImageHeader(filePath, header, format) {
+  if (!headerImageFormats.includes(format)) {
+    return null;
+  }
+
+  const bytes = new FileBytes(filePath, header);
+
+  try {
+    let metadata;
+    switch (format) {
+      case 'png':
+        metadata = parsePng(header);
+        break;
+      case 'jpeg':
+        metadata = await parseJpeg(bytes);
+        break;
+      case 'gif':
+        metadata = parseGif(header);
+        break;
+      case 'webp':
+        metadata = parseWebp(header);
+        break;
+      case 'bmp':
+        metadata = parseBmp(header);
+        break;
+      case 'tiff':
+        metadata = await parseTiff(bytes);
+        break;
+    }
+
+    if (!metadata || !metadata.width || !metadata.height) {
+      return null;
+    }
+    return metadata;
+  } catch (e) {
+    // Truncated or malformed header, let sharp have a go
+    return null;
+  } finally {
+    await bytes.close();
+  }
+}
@@ -0,0 +1,462 @@
+import fs from 'fs';
+import path from 'path';
+
+// Refuse to load a moov box larger than this, ffprobe handles those instead
+const MAX_MOOV_SIZE = 64 * 1024 * 1024;
+
+// Seconds between the ISO BMFF epoch (1904-01-01) and the Unix epoch
+const MAC_EPOCH_OFFSET = 2082844800;
+
+// Container boxes walked on the way to the sample tables
+const containerBoxes = ['moov', 'trak', 'mdia', 'minf', 'stbl', 'edts', 'udta'];
+
+// Sample entry fourcc to the codec names ffprobe reports
+const codecNames = {
+  avc1: 'h264',
+  avc3: 'h264',
+  hvc1: 'hevc',
+  hev1: 'hevc',
+  av01: 'av1',
+  vp08: 'vp8',
+  vp09: 'vp9',
+  mp4v: 'mpeg4',
+  s263: 'h263',
+  h263: 'h263',
+  jpeg: 'mjpeg',
+  mjpa: 'mjpeg',
+  mjpb: 'mjpeg',
+  apch: 'prores',
+  apcn: 'prores',
+  apcs: 'prores',
+  apco: 'prores',
+  ap4h: 'prores',
+  ap4x: 'prores',
+  mp4a: 'aac',
+  'ac-3': 'ac3',
+  'ec-3': 'eac3',
+  Opus: 'opus',
+  fLaC: 'flac',
+  alac: 'alac',
+  '.mp3': 'mp3',
+  sowt: 'pcm_s16le',
+  twos: 'pcm_s16be',
+  in24: 'pcm_s24be',
+  in32: 'pcm_s32be',
+  fl32: 'pcm_f32be',
+  fl64: 'pcm_f64be'
+};
+
+function fourcc(buffer, offset) {
+  return buffer.toString('latin1', offset, offset + 4);
+}
+
+// Greatest common divisor, for reducing fractions
+export function gcd(a, b) {
+  while (b) {
+    [a, b] = [b, a % b];
+  }
+  return a;
+}
+
+// Read a 32 or 64 bit unsigned value as a Number
+function readUInt(buffer, offset, size) {
+  return size === 8 ? Number(buffer.readBigUInt64BE(offset)) : buffer.readUInt32BE(offset);
+}
+
+function macTimeToIso(seconds) {
+  if (!seconds) {
+    return null;
+  }
+  return new Date((seconds - MAC_EPOCH_OFFSET) * 1000).toISOString().replace('Z', '000Z');
+}
+
+// Iterate over the boxes in buffer[start, end)
+function* boxes(buffer, start, end) {
+  let offset = start;
+  while (offset + 8 <= end) {
+    let size = buffer.readUInt32BE(offset);
+    const type = fourcc(buffer, offset + 4);
+    let headerSize = 8;
+
+    if (size === 1) {
+      if (offset + 16 > end) {
+        return;
+      }
+      size = Number(buffer.readBigUInt64BE(offset + 8));
+      headerSize = 16;
+    } else if (size === 0) {
+      size = end - offset;
+    }
+
+    if (size < headerSize || offset + size > end) {
+      return;
+    }
+
+    yield { type, start: offset + headerSize, end: offset + size };
+    offset += size;
+  }
+}
+
+// Find the top level moov box by walking box headers with positional reads.
+// header holds the first bytes of the file when the caller already read them.
+async function readMoov(handle, fileSize, header) {
+  const headerBuffer = Buffer.alloc(16);
+  let offset = 0;
+  const ftyp = { majorBrand: null, minorVersion: null, compatibleBrands: [] };
+
+  while (offset + 8 <= fileSize) {
+    let boxHeader;
+    if (header && offset + 16 <= header.length) {
+      boxHeader = header.subarray(offset, offset + 16);
+    } else {
+      const { bytesRead } = await handle.read(headerBuffer, 0, 16, offset);
+      if (bytesRead < 8) {
+        return null;
+      }
+      boxHeader = headerBuffer.subarray(0, bytesRead);
+    }
+
+    let size = boxHeader.readUInt32BE(0);
+    const type = fourcc(boxHeader, 4);
+    let headerSize = 8;
+
+    if (size === 1) {
+      if (boxHeader.length < 16) {
+        return null;
+      }
+      size = Number(boxHeader.readBigUInt64BE(8));
+      headerSize = 16;
+    } else if (size === 0) {
+      size = fileSize - offset;
+    }
+
+    if (size < headerSize) {
+      return null;
+    }
+
+    if (type === 'ftyp' && header && offset + size <= header.length) {
+      ftyp.majorBrand = fourcc(header, offset + 8);
+      ftyp.minorVersion = header.readUInt32BE(offset + 12);
+      for (let brand = offset + 16; brand + 4 <= offset + size; brand += 4) {
+        ftyp.compatibleBrands.push(fourcc(header, brand));
+      }
+    }
+
+    if (type === 'moov') {
+      const bodySize = size - headerSize;
+      if (bodySize > MAX_MOOV_SIZE || offset + size > fileSize) {
+        return null;
+      }
+
+      const moov = Buffer.alloc(bodySize);
+      const { bytesRead } = await handle.read(moov, 0, bodySize, offset + headerSize);
+      if (bytesRead < bodySize) {
+        return null;
+      }
+      return { moov, ftyp };
+    }
+
+    // Skip over mdat and anything else, a trailing moov is reached by seeking
+    offset += size;
+  }
+
+  return null;
+}
+
+function parseMvhd(buffer, start) {
+  const version = buffer[start];
+  const fieldSize = version === 1 ? 8 : 4;
+  let offset = start + 4;
+
+  const creationTime = readUInt(buffer, offset, fieldSize);
+  offset += fieldSize * 2;
+  const timescale = buffer.readUInt32BE(offset);
+  offset += 4;
+  const duration = readUInt(buffer, offset, fieldSize);
+
+  return { creationTime, timescale, duration };
+}
+
+function parseTkhd(buffer, start) {
+  const version = buffer[start];
+  // Width and height are 16.16 fixed point values at the end of the box
+  const sizeOffset = start + (version === 1 ? 88 : 76);
+
+  return {
+    width: buffer.readUInt32BE(sizeOffset) / 65536,
+    height: buffer.readUInt32BE(sizeOffset + 4) / 65536
+  };
+}
+
+function parseMdhd(buffer, start) {
+  const version = buffer[start];
+  const fieldSize = version === 1 ? 8 : 4;
+  let offset = start + 4;
+
+  const creationTime = readUInt(buffer, offset, fieldSize);
+  offset += fieldSize * 2;
+  const timescale = buffer.readUInt32BE(offset);
+  offset += 4;
+  const duration = readUInt(buffer, offset, fieldSize);
+  offset += fieldSize;
+
+  // ISO 639-2 language packed as three 5 bit values
+  const packed = buffer.readUInt16BE(offset);
+  const language = String.fromCharCode(
+    ((packed >> 10) & 0x1f) + 0x60,
+    ((packed >> 5) & 0x1f) + 0x60,
+    (packed & 0x1f) + 0x60
+  );
+
+  return { creationTime, timescale, duration, language };
+}
+
+function parseStsd(buffer, start, end, handlerType) {
+  if (buffer.readUInt32BE(start + 4) === 0) {
+    return {};
+  }
+
+  // Only the first sample entry is described, as ffprobe does
+  const entry = start + 8;
+  if (entry + 8 > end) {
+    return {};
+  }
+
+  const result = { codecTag: fourcc(buffer, entry + 4) };
+
+  if (handlerType === 'vide' && entry + 28 <= end) {
+    result.width = buffer.readUInt16BE(entry + 24);
+    result.height = buffer.readUInt16BE(entry + 26);
+  } else if (handlerType === 'soun' && entry + 36 <= end) {
+    const soundVersion = buffer.readUInt16BE(entry + 16);
+
+    if (soundVersion === 2 && entry + 52 <= end) {
+      // QuickTime sound description v2 stores a float64 rate
+      result.sampleRate = Math.round(buffer.readDoubleBE(entry + 40));
+      result.channels = buffer.readUInt32BE(entry + 48);
+    } else {
+      result.channels = buffer.readUInt16BE(entry + 24);
+      result.sampleRate = buffer.readUInt32BE(entry + 32) >>> 16;
+    }
+  }
+
+  return result;
+}
+
+function parseStts(buffer, start) {
+  const entryCount = buffer.readUInt32BE(start + 4);
+  let sampleCount = 0;
+  let totalDuration = 0;
+
+  for (let i = 0; i < entryCount; i++) {
+    const offset = start + 8 + i * 8;
+    const count = buffer.readUInt32BE(offset);
+    sampleCount += count;
+    totalDuration += count * buffer.readUInt32BE(offset + 4);
+  }
+
+  return { sampleCount, totalDuration };
+}
+
+function parseStsz(buffer, start, end) {
+  const sampleSize = buffer.readUInt32BE(start + 4);
+  const sampleCount = buffer.readUInt32BE(start + 8);
+
+  if (sampleSize !== 0) {
+    return { sampleCount, totalBytes: sampleSize * sampleCount };
+  }
+
+  let totalBytes = 0;
+  for (let i = 0; i < sampleCount; i++) {
+    const offset = start + 12 + i * 4;
+    if (offset + 4 > end) {
+      break;
+    }
+    totalBytes += buffer.readUInt32BE(offset);
+  }
+
+  return { sampleCount, totalBytes };
+}
+
+// Collect everything we need from a trak box
+function parseTrak(buffer, start, end) {
+  const track = {};
+
+  const walk = (from, to) => {
+    for (const box of boxes(buffer, from, to)) {
+      switch (box.type) {
+        case 'tkhd':
+          track.tkhd = parseTkhd(buffer, box.start);
+          break;
+        case 'mdhd':
+          track.mdhd = parseMdhd(buffer, box.start);
+          break;
+        case 'hdlr':
+          track.handlerType = fourcc(buffer, box.start + 8);
+          break;
+        case 'stsd':
+          track.stsdBox = box;
+          break;
+        case 'stts':
+          track.stts = parseStts(buffer, box.start);
+          break;
+        case 'stsz':
+          track.stsz = parseStsz(buffer, box.start, box.end);
+          break;
+        default:
+          if (containerBoxes.includes(box.type)) {
+            walk(box.start, box.end);
+          }
+      }
+    }
+  };
+
+  walk(start, end);
+
+  // The sample entry layout depends on the handler, which may come after stsd
+  if (track.stsdBox) {
+    track.stsd = parseStsd(buffer, track.stsdBox.start, track.stsdBox.end, track.handlerType);
+  }
+
+  return track;
+}
+
+// Turn a parsed trak into an ffprobe style stream object
+function trackToStream(track, index) {
+  const stsd = track.stsd || {};
+  const mdhd = track.mdhd || {};
+  const codecTag = stsd.codecTag || null;
+
+  const stream = {
+    index,
+    codec_name: codecTag ? (codecNames[codecTag] || codecTag.trim().toLowerCase()) : null,
+    codec_tag_string: codecTag,
+    codec_type: track.handlerType === 'vide' ? 'video' : 'audio'
+  };
+
+  let duration = null;
+  if (mdhd.timescale) {
+    duration = mdhd.duration / mdhd.timescale;
+    stream.time_base = `1/${mdhd.timescale}`;
+    stream.duration = duration.toFixed(6);
+  }
+
+  const sampleCount = track.stsz ? track.stsz.sampleCount : (track.stts ? track.stts.sampleCount : null);
+  if (sampleCount !== null) {
+    stream.nb_frames = String(sampleCount);
+  }
+
+  if (track.stsz && duration) {
+    stream.bit_rate = String(Math.round(track.stsz.totalBytes * 8 / duration));
+  }
+
+  if (track.handlerType === 'vide') {
+    stream.width = stsd.width || (track.tkhd ? Math.round(track.tkhd.width) : null);
+    stream.height = stsd.height || (track.tkhd ? Math.round(track.tkhd.height) : null);
+
+    // Average frame rate as frames over media duration, kept as a fraction
+    if (sampleCount && mdhd.duration) {
+      const num = sampleCount * mdhd.timescale;
+      const den = mdhd.duration;
+      const divisor = gcd(num, den);
+      stream.avg_frame_rate = `${num / divisor}/${den / divisor}`;
+    } else {
+      stream.avg_frame_rate = '0/0';
+    }
+  } else {
+    const sampleRate = stsd.sampleRate || mdhd.timescale;
+    stream.sample_rate = sampleRate ? String(sampleRate) : null;
+    stream.channels = stsd.channels || null;
+  }
+
+  stream.tags = {};
+  if (mdhd.language && mdhd.language !== '```') {
+    stream.tags.language = mdhd.language;
+  }
+  const creationTime = macTimeToIso(mdhd.creationTime);
+  if (creationTime) {
+    stream.tags.creation_time = creationTime;
+  }
+
+  return stream;
+}
+
+// Read container and stream metadata from an MP4 / MOV / 3GP file without
+// spawning ffprobe. The result mirrors the shape of ffprobe's output
+// ({ streams, format }), with durations, sizes, bit rates and counts as
+// strings as ffprobe writes them, so it can be used in its place.
+//
+// Returns null when the file can't be handled here (fragmented files, a moov
+// that is missing or too large, no video track), in which case the caller
+// should fall back to ffprobe.
+export async function parseIsoBmff(filePath, header = null) {
+  const handle = await fs.promises.open(filePath, 'r');
+
+  try {
+    const { size: fileSize } = await handle.stat();
+    const found = await readMoov(handle, fileSize, header);
+    if (!found) {
+      return null;
+    }
+
+    const { moov, ftyp } = found;
+    let mvhd = null;
+    const tracks = [];
+
+    for (const box of boxes(moov, 0, moov.length)) {
+      if (box.type === 'mvhd') {
+        mvhd = parseMvhd(moov, box.start);
+      } else if (box.type === 'trak') {
+        tracks.push(parseTrak(moov, box.start, box.end));
+      } else if (box.type === 'mvex') {
+        // Fragmented file, samples live in moof boxes we don't read
+        return null;
+      }
+    }
+
+    if (!mvhd || !mvhd.timescale || !mvhd.duration) {
+      return null;
+    }
+
+    const streams = tracks
+      .filter(track => track.handlerType === 'vide' || track.handlerType === 'soun')
+      .map((track, index) => trackToStream(track, index));
+
+    if (!streams.some(stream => stream.codec_type === 'video')) {
+      return null;
+    }
+
+    const duration = mvhd.duration / mvhd.timescale;
+
+    const tags = {};
+    if (ftyp.majorBrand) {
+      tags.major_brand = ftyp.majorBrand;
+      tags.minor_version = String(ftyp.minorVersion);
+      tags.compatible_brands = ftyp.compatibleBrands.join('');
+    }
+    const creationTime = macTimeToIso(mvhd.creationTime);
+    if (creationTime) {
+      tags.creation_time = creationTime;
+    }
+
+    return {
+      streams,
+      format: {
+        filename: filePath,
+        nb_streams: streams.length,
+        format_name: 'mov,mp4,m4a,3gp,3g2,mj2',
+        format_long_name: 'QuickTime / MOV',
+        duration: duration.toFixed(6),
+        size: String(fileSize),
+        bit_rate: String(duration ? Math.round(fileSize * 8 / duration) : 0),
+        tags
+      }
+    };
+  } catch (e) {
+    // Malformed boxes, let ffprobe deal with the file
+    console.error(`Error parsing ${path.basename(filePath)} as ISO BMFF: ${e.message}`);
+    return null;
+  } finally {
+    await handle.close();
+  }
+}
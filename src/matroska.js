@@ -0,0 +1,500 @@
+import fs from 'fs';
+import path from 'path';
+import { gcd } from './isobmff.js';
+
+// Refuse to load a single Info / Tracks / SeekHead element larger than this
+const MAX_ELEMENT_SIZE = 16 * 1024 * 1024;
+
+// Seconds between the Matroska epoch (2001-01-01) and the Unix epoch
+const MATROSKA_EPOCH_OFFSET = 978307200;
+
+// Element IDs, with their length marker bits kept as in the spec
+const ids = {
+  EBML: 0x1a45dfa3,
+  DocType: 0x4282,
+  Segment: 0x18538067,
+  SeekHead: 0x114d9b74,
+  Seek: 0x4dbb,
+  SeekID: 0x53ab,
+  SeekPosition: 0x53ac,
+  Info: 0x1549a966,
+  TimestampScale: 0x2ad7b1,
+  Duration: 0x4489,
+  DateUTC: 0x4461,
+  Title: 0x7ba9,
+  MuxingApp: 0x4d80,
+  WritingApp: 0x5741,
+  Tracks: 0x1654ae6b,
+  TrackEntry: 0xae,
+  TrackType: 0x83,
+  CodecID: 0x86,
+  Language: 0x22b59c,
+  Name: 0x536e,
+  DefaultDuration: 0x23e383,
+  Video: 0xe0,
+  PixelWidth: 0xb0,
+  PixelHeight: 0xba,
+  DisplayWidth: 0x54b0,
+  DisplayHeight: 0x54ba,
+  Audio: 0xe1,
+  SamplingFrequency: 0xb5,
+  Channels: 0x9f,
+  BitDepth: 0x6264,
+  Cluster: 0x1f43b675
+};
+
+// Matroska codec IDs to the codec names ffprobe reports
+const codecNames = {
+  'V_MPEG4/ISO/AVC': 'h264',
+  'V_MPEGH/ISO/HEVC': 'hevc',
+  'V_AV1': 'av1',
+  'V_VP8': 'vp8',
+  'V_VP9': 'vp9',
+  'V_MPEG1': 'mpeg1video',
+  'V_MPEG2': 'mpeg2video',
+  'V_MPEG4/ISO/SP': 'mpeg4',
+  'V_MPEG4/ISO/ASP': 'mpeg4',
+  'V_MPEG4/ISO/AP': 'mpeg4',
+  'V_MJPEG': 'mjpeg',
+  'V_PRORES': 'prores',
+  'V_THEORA': 'theora',
+  'A_OPUS': 'opus',
+  'A_VORBIS': 'vorbis',
+  'A_AC3': 'ac3',
+  'A_EAC3': 'eac3',
+  'A_DTS': 'dts',
+  'A_FLAC': 'flac',
+  'A_ALAC': 'alac',
+  'A_MPEG/L2': 'mp2',
+  'A_MPEG/L3': 'mp3',
+  'A_TRUEHD': 'truehd'
+};
+
+const trackTypes = { 1: 'video', 2: 'audio', 17: 'subtitle' };
+
+// Read a variable length integer. Element IDs keep their length marker,
+// sizes have it stripped. Returns null when the buffer is too short.
+function readVint(buffer, offset, keepMarker) {
+  if (offset >= buffer.length) {
+    return null;
+  }
+
+  const first = buffer[offset];
+  let length = 1;
+  let mask = 0x80;
+  while (length <= 8 && !(first & mask)) {
+    length++;
+    mask >>= 1;
+  }
+
+  if (length > 8 || offset + length > buffer.length) {
+    return null;
+  }
+
+  let value = keepMarker ? first : first & (mask - 1);
+  let allOnes = value === mask - 1;
+  for (let i = 1; i < length; i++) {
+    value = value * 256 + buffer[offset + i];
+    allOnes = allOnes && buffer[offset + i] === 0xff;
+  }
+
+  return { value, length, unknown: !keepMarker && allOnes };
+}
+
+// Read an element header at offset: { id, size, dataStart, end }.
+// size is null for elements of unknown size.
+function readElementHeader(buffer, offset) {
+  const id = readVint(buffer, offset, true);
+  if (!id) {
+    return null;
+  }
+
+  const size = readVint(buffer, offset + id.length, false);
+  if (!size) {
+    return null;
+  }
+
+  const dataStart = offset + id.length + size.length;
+  return {
+    id: id.value,
+    size: size.unknown ? null : size.value,
+    dataStart,
+    end: size.unknown ? null : dataStart + size.value
+  };
+}
+
+// Iterate the child elements in buffer[start, end)
+function* elements(buffer, start, end) {
+  let offset = start;
+  while (offset < end) {
+    const element = readElementHeader(buffer, offset);
+    if (!element || element.size === null || element.end > end) {
+      return;
+    }
+    yield element;
+    offset = element.end;
+  }
+}
+
+function readUnsigned(buffer, element) {
+  let value = 0;
+  for (let i = element.dataStart; i < element.end; i++) {
+    value = value * 256 + buffer[i];
+  }
+  return value;
+}
+
+function readSigned(buffer, element) {
+  const length = element.end - element.dataStart;
+  if (length === 0) {
+    return 0;
+  }
+
+  let value = 0n;
+  for (let i = element.dataStart; i < element.end; i++) {
+    value = (value << 8n) | BigInt(buffer[i]);
+  }
+  return Number(BigInt.asIntN(length * 8, value));
+}
+
+function readFloat(buffer, element) {
+  const length = element.end - element.dataStart;
+  if (length === 4) {
+    return buffer.readFloatBE(element.dataStart);
+  }
+  if (length === 8) {
+    return buffer.readDoubleBE(element.dataStart);
+  }
+  return 0;
+}
+
+function readString(buffer, element) {
+  return buffer.toString('utf8', element.dataStart, element.end).replace(/\0+$/, '');
+}
+
+function parseSeekHead(buffer, element) {
+  const positions = {};
+  for (const seek of elements(buffer, element.dataStart, element.end)) {
+    if (seek.id !== ids.Seek) {
+      continue;
+    }
+
+    let seekId = null;
+    let seekPosition = null;
+    for (const child of elements(buffer, seek.dataStart, seek.end)) {
+      if (child.id === ids.SeekID) {
+        seekId = readUnsigned(buffer, child);
+      } else if (child.id === ids.SeekPosition) {
+        seekPosition = readUnsigned(buffer, child);
+      }
+    }
+
+    if (seekId !== null && seekPosition !== null && !(seekId in positions)) {
+      positions[seekId] = seekPosition;
+    }
+  }
+  return positions;
+}
+
+function parseInfo(buffer, element) {
+  const info = { timestampScale: 1000000 };
+  for (const child of elements(buffer, element.dataStart, element.end)) {
+    switch (child.id) {
+      case ids.TimestampScale:
+        info.timestampScale = readUnsigned(buffer, child);
+        break;
+      case ids.Duration:
+        info.duration = readFloat(buffer, child);
+        break;
+      case ids.DateUTC:
+        // Nanoseconds relative to the Matroska epoch
+        info.dateUtc = readSigned(buffer, child);
+        break;
+      case ids.Title:
+        info.title = readString(buffer, child);
+        break;
+      case ids.MuxingApp:
+        info.muxingApp = readString(buffer, child);
+        break;
+      case ids.WritingApp:
+        info.writingApp = readString(buffer, child);
+        break;
+    }
+  }
+  return info;
+}
+
+function parseTrackEntry(buffer, element) {
+  const track = {};
+  for (const child of elements(buffer, element.dataStart, element.end)) {
+    switch (child.id) {
+      case ids.TrackType:
+        track.type = trackTypes[readUnsigned(buffer, child)] || 'data';
+        break;
+      case ids.CodecID:
+        track.codecId = readString(buffer, child);
+        break;
+      case ids.Language:
+        track.language = readString(buffer, child);
+        break;
+      case ids.Name:
+        track.name = readString(buffer, child);
+        break;
+      case ids.DefaultDuration:
+        track.defaultDuration = readUnsigned(buffer, child);
+        break;
+      case ids.Video:
+        for (const video of elements(buffer, child.dataStart, child.end)) {
+          if (video.id === ids.PixelWidth) {
+            track.width = readUnsigned(buffer, video);
+          } else if (video.id === ids.PixelHeight) {
+            track.height = readUnsigned(buffer, video);
+          } else if (video.id === ids.DisplayWidth) {
+            track.displayWidth = readUnsigned(buffer, video);
+          } else if (video.id === ids.DisplayHeight) {
+            track.displayHeight = readUnsigned(buffer, video);
+          }
+        }
+        break;
+      case ids.Audio:
+        for (const audio of elements(buffer, child.dataStart, child.end)) {
+          if (audio.id === ids.SamplingFrequency) {
+            track.sampleRate = Math.round(readFloat(buffer, audio));
+          } else if (audio.id === ids.Channels) {
+            track.channels = readUnsigned(buffer, audio);
+          } else if (audio.id === ids.BitDepth) {
+            track.bitDepth = readUnsigned(buffer, audio);
+          }
+        }
+        break;
+    }
+  }
+  return track;
+}
+
+function parseTracks(buffer, element) {
+  const tracks = [];
+  for (const child of elements(buffer, element.dataStart, element.end)) {
+    if (child.id === ids.TrackEntry) {
+      tracks.push(parseTrackEntry(buffer, child));
+    }
+  }
+  return tracks;
+}
+
+function codecName(codecId) {
+  if (!codecId) {
+    return null;
+  }
+  if (codecNames[codecId]) {
+    return codecNames[codecId];
+  }
+  if (codecId.startsWith('A_AAC')) {
+    return 'aac';
+  }
+  if (codecId.startsWith('A_PCM/INT/LIT')) {
+    return 'pcm_s16le';
+  }
+  return codecId.replace(/^[VAS]_/, '').toLowerCase();
+}
+
+// Turn a parsed TrackEntry into an ffprobe style stream object
+function trackToStream(track, index) {
+  const stream = {
+    index,
+    codec_name: codecName(track.codecId),
+    codec_type: track.type || 'data',
+    tags: {}
+  };
+
+  if (track.type === 'video') {
+    stream.width = track.width || null;
+    stream.height = track.height || null;
+
+    if (track.displayWidth && track.displayHeight) {
+      const divisor = gcd(track.displayWidth, track.displayHeight);
+      stream.display_aspect_ratio = `${track.displayWidth / divisor}:${track.displayHeight / divisor}`;
+    }
+
+    // DefaultDuration is the nominal frame duration in nanoseconds
+    if (track.defaultDuration) {
+      const divisor = gcd(1000000000, track.defaultDuration);
+      stream.avg_frame_rate = `${1000000000 / divisor}/${track.defaultDuration / divisor}`;
+    } else {
+      stream.avg_frame_rate = '0/0';
+    }
+  } else if (track.type === 'audio') {
+    stream.sample_rate = String(track.sampleRate || 8000);
+    stream.channels = track.channels || 1;
+    if (track.bitDepth) {
+      stream.bits_per_raw_sample = String(track.bitDepth);
+    }
+  }
+
+  if (track.language) {
+    stream.tags.language = track.language;
+  }
+  if (track.name) {
+    stream.tags.title = track.name;
+  }
+
+  return stream;
+}
+
+// Read the element at offset in the file, header and body
+async function readElement(handle, offset, fileSize) {
+  const headerBuffer = Buffer.alloc(12);
+  const { bytesRead } = await handle.read(headerBuffer, 0, 12, offset);
+  const element = readElementHeader(headerBuffer.subarray(0, bytesRead), 0);
+  if (!element || element.size === null || element.size > MAX_ELEMENT_SIZE ||
+      offset + element.end > fileSize) {
+    return null;
+  }
+
+  const buffer = Buffer.alloc(element.end);
+  await handle.read(buffer, 0, element.end, offset);
+  return { buffer, element };
+}
+
+// Read container and track metadata from a Matroska / WebM file without
+// spawning ffprobe. The result mirrors the shape of ffprobe's output
+// ({ streams, format }), with durations, sizes, bit rates and counts as
+// strings as ffprobe writes them, so it can be used in its place.
+//
+// Top level elements are walked by their headers until the first Cluster;
+// elements placed after the clusters are found through the SeekHead, so the
+// media data itself is never read.
+//
+// Returns null when the file can't be handled here (no duration, no video
+// track, malformed elements), in which case the caller should fall back to
+// ffprobe.
+export async function parseMatroska(filePath, header = null) {
+  const handle = await fs.promises.open(filePath, 'r');
+
+  try {
+    const { size: fileSize } = await handle.stat();
+
+    if (!header || header.length < 64) {
+      header = Buffer.alloc(4096);
+      const { bytesRead } = await handle.read(header, 0, header.length, 0);
+      header = header.subarray(0, bytesRead);
+    }
+
+    const ebml = readElementHeader(header, 0);
+    if (!ebml || ebml.id !== ids.EBML || ebml.end === null || ebml.end > header.length) {
+      return null;
+    }
+
+    let docType = 'matroska';
+    for (const child of elements(header, ebml.dataStart, ebml.end)) {
+      if (child.id === ids.DocType) {
+        docType = readString(header, child);
+      }
+    }
+
+    if (docType !== 'matroska' && docType !== 'webm') {
+      return null;
+    }
+
+    const segment = readElementHeader(header, ebml.end);
+    if (!segment || segment.id !== ids.Segment) {
+      return null;
+    }
+
+    const segmentStart = segment.dataStart;
+    const segmentEnd = segment.end === null ? fileSize : Math.min(segment.end, fileSize);
+
+    let info = null;
+    let tracks = null;
+    let seekPositions = {};
+
+    // Walk the segment's children until the first cluster
+    let offset = segmentStart;
+    while (offset < segmentEnd && (!info || !tracks)) {
+      const headerBuffer = Buffer.alloc(12);
+      const { bytesRead } = await handle.read(headerBuffer, 0, 12, offset);
+      const element = readElementHeader(headerBuffer.subarray(0, bytesRead), 0);
+      if (!element || element.id === ids.Cluster || element.size === null) {
+        break;
+      }
+
+      if (element.id === ids.Info || element.id === ids.Tracks || element.id === ids.SeekHead) {
+        const read = await readElement(handle, offset, fileSize);
+        if (!read) {
+          return null;
+        }
+
+        if (element.id === ids.Info) {
+          info = parseInfo(read.buffer, read.element);
+        } else if (element.id === ids.Tracks) {
+          tracks = parseTracks(read.buffer, read.element);
+        } else {
+          seekPositions = { ...parseSeekHead(read.buffer, read.element), ...seekPositions };
+        }
+      }
+
+      offset += element.end;
+    }
+
+    // Anything still missing sits after the clusters, jump to it
+    for (const [id, name] of [[ids.Info, 'info'], [ids.Tracks, 'tracks']]) {
+      if ((name === 'info' ? info : tracks) || !(id in seekPositions)) {
+        continue;
+      }
+
+      const read = await readElement(handle, segmentStart + seekPositions[id], fileSize);
+      if (!read || read.element.id !== id) {
+        return null;
+      }
+
+      if (name === 'info') {
+        info = parseInfo(read.buffer, read.element);
+      } else {
+        tracks = parseTracks(read.buffer, read.element);
+      }
+    }
+
+    if (!info || !info.duration || !tracks) {
+      return null;
+    }
+
+    const streams = tracks.map((track, index) => trackToStream(track, index));
+    if (!streams.some(stream => stream.codec_type === 'video')) {
+      return null;
+    }
+
+    const duration = info.duration * info.timestampScale / 1e9;
+
+    const tags = {};
+    if (info.title) {
+      tags.title = info.title;
+    }
+    if (info.writingApp || info.muxingApp) {
+      tags.encoder = info.writingApp || info.muxingApp;
+    }
+    if (info.dateUtc !== undefined) {
+      const unixMs = MATROSKA_EPOCH_OFFSET * 1000 + info.dateUtc / 1e6;
+      tags.creation_time = new Date(unixMs).toISOString().replace('Z', '000Z');
+    }
+
+    return {
+      streams,
+      format: {
+        filename: filePath,
+        nb_streams: streams.length,
+        format_name: 'matroska,webm',
+        format_long_name: 'Matroska / WebM',
+        duration: duration.toFixed(6),
+        size: String(fileSize),
+        bit_rate: String(duration ? Math.round(fileSize * 8 / duration) : 0),
+        tags
+      }
+    };
+  } catch (e) {
+    // Malformed elements, let ffprobe deal with the file
+    console.error(`Error parsing ${path.basename(filePath)} as Matroska: ${e.message}`);
+    return null;
+  } finally {
+    await handle.close();
+  }
+}
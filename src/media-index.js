@@ -0,0 +1,168 @@
+import fs from 'fs';
+import path from 'path';
+import { walkMedia } from './scan.js';
+import { mapWithConcurrency } from './concurrency.js';
+
+// Wait this long after the last change to a path before re-probing it, so a
+// file being written or copied is probed once when it settles
+const CHANGE_DEBOUNCE_MS = 500;
+
+// In-memory index of media info for every media file under a set of roots.
+//
+// build() walks the roots and probes every file, watch() keeps the index
+// current from recursive fs.watch events, re-probing only the paths that
+// changed. probe(filePath) returns the info for one file (getMediaInfo's
+// result), so probes go through the metadata cache and unchanged files cost
+// a stat on restart.
+//
+// A root is only trusted while its watcher is running. If watching fails to
+// start or later errors (for example when inotify watches run out), get()
+// stops answering for files under that root so callers fall back to a
+// fingerprinted lookup instead of serving metadata that may be stale.
+export class MediaIndex {
+  constructor({ roots, extensions, probe, concurrency = 4 }) {
+    this.roots = roots.map(root => path.resolve(root));
+    this.extensions = new Set(extensions);
+    this.probe = probe;
+    this.concurrency = concurrency;
+
+    // Resolved path to info
+    this.entries = new Map();
+    this.ready = false;
+    this.watchers = [];
+    this.pending = new Map();
+    // Roots whose watcher is running
+    this.watchedRoots = new Set();
+  }
+
+  // True when the build is done and every root is still being watched, so
+  // the index holds every media file and is current
+  get complete() {
+    return this.ready && this.watchedRoots.size === this.roots.length;
+  }
+
+  // The root a resolved path is under, or undefined
+  rootOf(key) {
+    return this.roots.find(root => key === root || key.startsWith(root + path.sep));
+  }
+
+  get size() {
+    return this.entries.size;
+  }
+
+  // Info for a path, or undefined if it is not indexed or its root is no
+  // longer watched
+  get(filePath) {
+    const key = path.resolve(filePath);
+    if (!this.watchedRoots.has(this.rootOf(key))) {
+      return undefined;
+    }
+    return this.entries.get(key);
+  }
+
+  values() {
+    return this.entries.values();
+  }
+
+  // Walk the roots and probe every media file
+  async build() {
+    await this.addTree(this.roots);
+    this.ready = true;
+  }
+
+  async addTree(roots) {
+    // Probe in batches as the walk streams files in, rather than listing first
+    let batch = [];
+    const flush = async () => {
+      await mapWithConcurrency(batch, this.concurrency, entry => this.update(entry.path));
+      batch = [];
+    };
+
+    for await (const entry of walkMedia(roots, { extensions: [...this.extensions] })) {
+      batch.push(entry);
+      if (batch.length >= this.concurrency * 8) {
+        await flush();
+      }
+    }
+    await flush();
+  }
+
+  // Probe a path and store or drop its entry
+  async update(filePath) {
+    const key = path.resolve(filePath);
+    try {
+      const info = await this.probe(key);
+      this.entries.set(key, info);
+    } catch (e) {
+      // Not readable or not media (any more)
+      this.entries.delete(key);
+    }
+  }
+
+  // Start watching the roots for changes
+  watch() {
+    for (const root of this.roots) {
+      try {
+        const watcher = fs.watch(root, { recursive: true }, (eventType, filename) => {
+          if (filename) {
+            this.changed(path.join(root, filename.toString()));
+          }
+        });
+        watcher.on('error', (e) => {
+          console.error(`Error watching ${root}, no longer answering from the index for it: ${e.message}`);
+          this.watchedRoots.delete(root);
+          watcher.close();
+        });
+        this.watchers.push(watcher);
+        this.watchedRoots.add(root);
+      } catch (e) {
+        console.error(`Cannot watch ${root}, not answering from the index for it: ${e.message}`);
+      }
+    }
+  }
+
+  close() {
+    for (const watcher of this.watchers) {
+      watcher.close();
+    }
+    this.watchers = [];
+    this.watchedRoots.clear();
+    for (const timer of this.pending.values()) {
+      clearTimeout(timer);
+    }
+    this.pending.clear();
+  }
+
+  // Debounce change events per path
+  changed(fullPath) {
+    clearTimeout(this.pending.get(fullPath));
+    this.pending.set(fullPath, setTimeout(() => {
+      this.pending.delete(fullPath);
+      this.refresh(fullPath).catch(e => console.error(`Error updating index for ${fullPath}: ${e.message}`));
+    }, CHANGE_DEBOUNCE_MS));
+  }
+
+  async refresh(fullPath) {
+    let stats;
+    try {
+      stats = await fs.promises.lstat(fullPath);
+    } catch (e) {
+      // Removed (or renamed away): drop the file, or everything under a directory
+      this.entries.delete(fullPath);
+      const prefix = fullPath + path.sep;
+      for (const key of this.entries.keys()) {
+        if (key.startsWith(prefix)) {
+          this.entries.delete(key);
+        }
+      }
+      return;
+    }
+
+    if (stats.isDirectory()) {
+      // A directory created or moved in, index what it holds
+      await this.addTree([fullPath]);
+    } else if (stats.isFile() && this.extensions.has(path.extname(fullPath).toLowerCase())) {
+      await this.update(fullPath);
+    }
+  }
+}
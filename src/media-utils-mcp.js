@@ -1,18 +1,45 @@
 import { McpServer } from "@modelcontextprotocol/sdk/server/mcp.js";
 import { StdioServerTransport } from "@modelcontextprotocol/sdk/server/stdio.js";
 import fs from 'fs';
+import os from 'os';
+import crypto from 'crypto';
 import path from 'path';
-import ffmpeg from 'fluent-ffmpeg';
 import sharp from 'sharp';
 import { parseArgs } from 'node:util';
 import { z } from "zod";
+import { MetadataCache } from './metadata-cache.js';
+import { readHeader, sniffMediaType } from './sniff.js';
+import { mapWithConcurrency } from './concurrency.js';
+import { parseIsoBmff } from './isobmff.js';
+import { parseMatroska } from './matroska.js';
+import { readImageHeader } from './image-header.js';
+import { readImageMetadata, exifDensity } from './exif.js';
+import { runFfprobe, probeDepths } from './ffprobe.js';
+import { projectFields, encodeResults, outputLayouts } from './projection.js';
+import { walkMedia } from './scan.js';
+import { MediaIndex } from './media-index.js';
+import { compileWhere, compileSort, selectTop, encodeCursor, decodeCursor, queryFields, queryOperators } from './query.js';
+import { imageHash, videoHash, frameDistance, hashAlgorithms } from './perceptual-hash.js';
+import { BKTree } from './bk-tree.js';
+import { findDuplicateFiles } from './duplicates.js';
+import { generateSmartThumbnail, encodeThumbnail, thumbnailSamplings, thumbnailFormats, formatForExtension } from './thumbnail.js';
+import { ThumbnailStore } from './thumbnail-store.js';
+import { generateContactSheet, extractStoryboardFrames, spriteVtt } from './storyboard.js';
+import { extractFrames, extractionMethods } from './extract-frames.js';
 
-const imageExtensions = ['.jpg', '.jpeg', '.png', '.gif', '.webp', '.tiff', '.bmp', '.svg'];
+const imageExtensions = ['.jpg', '.jpeg', '.png', '.gif', '.webp', '.tiff', '.tif', '.bmp', '.svg', '.heic', '.heif', '.avif'];
 const videoExtensions = ['.mp4', '.mov', '.avi', '.mkv', '.webm', '.wmv', '.flv', '.m4v', '.3gp'];
 
 const IMAGE = "IMAGE"
 const VIDEO = "VIDEO"
 
+// scanMedia walks left open between pages are dropped after this long unused
+const SCAN_SESSION_TTL = 10 * 60 * 1000;
+
+// Sniffed container formats whose metadata we can read without ffprobe
+const isoBmffFormats = ['mp4', 'mov', 'm4v', '3gp'];
+const matroskaFormats = ['matroska', 'webm'];
+
 // Parse command line arguments
 const { values } = parseArgs({
   options: {
@@ -21,6 +48,18 @@ const { values } = parseArgs({
       multiple: true,
       short: 'p'
     },
+    'cache-dir': {
+      type: 'string'
+    },
+    'cache-size': {
+      type: 'string'
+    },
+    'max-concurrency': {
+      type: 'string'
+    },
+    index: {
+      type: 'boolean'
+    },
     help: {
       type: 'boolean',
       short: 'h'
@@ -29,13 +68,89 @@ const { values } = parseArgs({
 });
 
 if (values.help) {
-  console.log('Usage: node index.js --permitted <dir1> <dir2> ...');
+  console.log('Usage: node index.js --permitted <dir1> <dir2> ... [--cache-dir <dir>] [--cache-size <entries>] [--max-concurrency <n>] [--index]');
   process.exit(0);
 }
 
 // Get permitted directories
 const permittedDirectories = values.permitted || [];
 
+// Open scanMedia walks keyed by cursor, so each page continues where the last stopped
+const scanSessions = new Map();
+
+// Metadata cache, persisted to disk only when a cache directory is given
+const metadataCache = new MetadataCache({
+  cacheDir: values['cache-dir'] || null,
+  maxEntries: parseInt(values['cache-size'] || '10000')
+});
+
+// Perceptual hashes, cached under the same file key next to the metadata cache.
+// The file name changes whenever hashes are computed differently, so hashes
+// from an older version are never compared with new ones.
+const hashCache = new MetadataCache({
+  cacheDir: values['cache-dir'] || null,
+  maxEntries: parseInt(values['cache-size'] || '10000'),
+  fileName: 'hash-cache-3.jsonl'
+});
+
+const cpuCount = os.availableParallelism ? os.availableParallelism() : os.cpus().length;
+
+// Maximum number of files probed (or ffmpeg jobs run) at the same time
+const maxConcurrency = parseInt(values['max-concurrency'] || '0') || cpuCount;
+
+try {
+  await metadataCache.load();
+} catch (e) {
+  console.error(`Error loading metadata cache: ${e}`);
+}
+
+try {
+  await hashCache.load();
+} catch (e) {
+  console.error(`Error loading hash cache: ${e}`);
+}
+
+// Generated thumbnails and the outputs they were written to, so repeat
+// requests are skipped or served from the store
+const thumbnailStore = new ThumbnailStore({
+  cacheDir: values['cache-dir'] || null,
+  maxEntries: parseInt(values['cache-size'] || '10000')
+});
+
+try {
+  await thumbnailStore.load();
+} catch (e) {
+  console.error(`Error loading thumbnail cache: ${e}`);
+}
+
+// With --index, keep the info for every media file under the permitted
+// directories in memory, kept current by watching for changes
+let mediaIndex = null;
+
+if (values.index) {
+  mediaIndex = new MediaIndex({
+    roots: permittedDirectories,
+    extensions: [...imageExtensions, ...videoExtensions],
+    concurrency: maxConcurrency,
+    // The index itself must probe the file, not answer from the index
+    probe: async (filePath) => (await getMediaInfo(filePath, { skipIndex: true })).info
+  });
+  
+  // Watch first so changes made while the index is building are not missed.
+  // The server starts answering straight away, from disk until the build is done.
+  mediaIndex.watch();
+  mediaIndex.build()
+    .then(() => {
+      console.error(`Media index built: ${mediaIndex.size} files`);
+      // The cache keeps only the most recent entries, the rest are probed again on restart
+      if (metadataCache.cacheDir && mediaIndex.size > metadataCache.maxEntries) {
+        console.error(`Warning: the index has more files than --cache-size (${metadataCache.maxEntries}), ` +
+          `so a restart will re-probe ${mediaIndex.size - metadataCache.maxEntries} unchanged files`);
+      }
+    })
+    .catch((e) => console.error(`Error building media index: ${e}`));
+}
+
 // Create an MCP server
 const server = new McpServer({
   name: "MediaUtilsMCP",
@@ -83,42 +198,56 @@ server.tool(
   * Container format
   * Creation metadata and timestamps`,
   {
-    mediaPaths: z.array(z.string()).describe("A list of media file paths (images or videos) to analyze")
+    mediaPaths: z.array(z.string()).describe("A list of media file paths (images or videos) to analyze"),
+    depth: z.enum(probeDepths).optional().describe(
+      "How thoroughly to probe: 'quick' reads only the container header (fastest, no EXIF/XMP/IPTC), " +
+      "'standard' (default) is the normal probe, 'exact' also counts every video packet to report exact total frames"
+    ),
+    decodeFrames: z.boolean().optional().describe(
+      "With depth 'exact', count frames by decoding the whole video instead of counting packets. Much slower."
+    ),
+    fields: z.array(z.string()).optional().describe(
+      "Only return these fields of each result, as dotted paths (e.g. 'width', 'duration', 'format.format_name', " +
+      "'video_streams.codec_name'). path, success and error are always returned."
+    ),
+    layout: z.enum(outputLayouts).optional().describe(
+      "Result encoding: 'pretty' (default, indented JSON), 'compact' (JSON without whitespace) or " +
+      "'table' (compact { columns, rows } with one shared header, smallest for large batches)"
+    )
   },
-  async ({ mediaPaths }) => {
-    const results = [];
+  async ({ mediaPaths, depth = 'standard', decodeFrames = false, fields, layout = 'pretty' }, extra) => {
+    const cacheStats = { hits: 0, misses: 0 };
+    const reportProgress = createProgressReporter(extra, mediaPaths.length);
     
-    for (const filePath of mediaPaths) {
+    // Probe files in parallel, results keep the order of mediaPaths
+    const results = await mapWithConcurrency(mediaPaths, maxConcurrency, async (filePath) => {
       try {
         checkPath(filePath);
-        // Use await with the async detectMediaType function
-        const mediaType = await detectMediaType(filePath);
         
-        let info;
-        if (mediaType.isImage) {
-          info = await getImageInfo(filePath);
-          info.mediaType = IMAGE;
-        } else if (mediaType.isVideo) {
-          info = await getVideoInfo(filePath);
-          info.mediaType = VIDEO;
+        const { info, cacheHit } = await getMediaInfo(filePath, { depth, decodeFrames });
+        if (cacheHit) {
+          cacheStats.hits++;
         } else {
-          throw new Error(`File is not a supported media type: ${mediaType.message}`);
+          cacheStats.misses++;
         }
         
         info.success = true;
-        results.push(info);
+        return reportProgress(projectFields(info, fields));
       } catch (e) {
-        results.push({
+        return reportProgress(projectFields({
           path: filePath,
           error: String(e),
           success: false,
           mediaType: 'UNKNOWN'
-        });
+        }, fields));
       }
-    }
+    });
     
     return {
-      content: [{ type: "text", text: JSON.stringify(results, null, 2) }]
+      content: [
+        { type: "text", text: encodeResults(results, layout) },
+        { type: "text", text: encodeResults({ cache: cacheStats }, layout === 'pretty' ? 'pretty' : 'compact') }
+      ]
     };
   }
 );
@@ -128,74 +257,347 @@ server.tool(
   "generateImagesFromVideos",
   `Generates representative thumbnail images from video files.
   
-  This function processes multiple video-to-image conversion tasks, automatically extracting a visually significant frame from each source video and saving it as a PNG image at the specified destination path. The tool intelligently analyzes video content to select a meaningful frame rather than simply capturing the first frame.
+  This function processes multiple video-to-image conversion tasks, automatically extracting a visually significant frame from each source video and saving it as an image at the specified destination path. The tool intelligently analyzes video content to select a meaningful frame rather than simply capturing the first frame. By default candidate frames are taken from keyframes spread across the whole video.
+  
+  With inline, the images are also returned in the result as image content, after the JSON results. Each result's imageIndex is the position of its image among them. Items without an imagePath are only returned inline and nothing is written to disk.
   
-  All generated images are saved in PNG format regardless of the original extension specified in the output path.`,
+  Images are saved in the format given by format, or else the one the output path's extension implies (.png, .jpg/.jpeg, .webp or .avif). Output paths with any other extension are saved as PNG, and the extension is changed to match the format. maxWidth and maxHeight shrink large frames before they are encoded, which makes both encoding and the files much smaller.`,
   {
     items: z.array(
       z.object({
         videoPath: z.string().describe("Path to the source video file"),
-        imagePath: z.string().describe("Path where the generated PNG image will be saved")
+        imagePath: z.string().optional().describe("Path where the generated image will be saved. May be omitted when inline is true.")
       })
-    ).describe("Array of video-to-image conversion tasks")
+    ).describe("Array of video-to-image conversion tasks"),
+    sampling: z.enum(thumbnailSamplings).optional().describe(
+      "How candidate frames are picked: 'keyframes' decodes only keyframes across the whole video, " +
+      "'seek' seeks to evenly spaced points (cheapest for long videos), 'start' uses every frame of the " +
+      "first few seconds. 'auto' (default) uses keyframes, or seek for videos over 10 minutes."
+    ),
+    inline: z.boolean().optional().describe("Also return the generated images as image content (default false)"),
+    format: z.enum(Object.keys(thumbnailFormats)).optional().describe(
+      "Image format for every output. Defaults to the format of each imagePath's extension, or png."
+    ),
+    quality: z.number().int().min(1).max(100).optional().describe("Quality for jpeg, webp and avif (default the encoder's)"),
+    effort: z.number().int().min(0).max(9).optional().describe(
+      "CPU effort spent on compression for png, webp (up to 6) and avif. Higher is smaller and slower."
+    ),
+    maxWidth: z.number().int().min(16).max(16384).optional().describe("Shrink images wider than this, keeping the aspect ratio"),
+    maxHeight: z.number().int().min(16).max(16384).optional().describe("Shrink images taller than this, keeping the aspect ratio")
   },
-  async ({ items }) => {
-    const results = [];
+  async ({ items, sampling = 'auto', inline = false, format, quality, effort, maxWidth, maxHeight }, extra) => {
+    // Everything that changes the chosen frame, part of each image's cache key
+    const frameParams = { sampling, maxWidth, maxHeight };
     
-    for (const item of items) {
+    const results = new Array(items.length);
+    const reportProgress = createProgressReporter(extra, items.length);
+    
+    const setResult = (index, result) => {
+      results[index] = reportProgress(result);
+    };
+    
+    // Jobs keyed by source video, so each video is decoded only once no
+    // matter how many items reference it
+    const jobs = new Map();
+    
+    for (const [index, item] of items.entries()) {
       try {
         // Check if paths are valid and in permitted directories
         checkPath(item.videoPath);
         
-        // Verify the input file is actually a video
-        const mediaType = await detectMediaType(item.videoPath);
-
-        if (!mediaType.isVideo) {
-          throw new Error(`File is not a video: ${mediaType.message || 'Invalid file type'}`);
+        let outputPath = null;
+        let outputFormat = format || 'png';
+        if (item.imagePath) {
+          outputPath = item.imagePath;
+          const currentExt = path.extname(outputPath).toLowerCase();
+          outputFormat = format || formatForExtension(currentExt) || 'png';
+          
+          if (formatForExtension(currentExt) !== outputFormat) {
+            // Replace the extension with the one for the format
+            outputPath = path.join(
+              path.dirname(outputPath),
+              `${path.basename(outputPath, path.extname(outputPath))}${thumbnailFormats[outputFormat]}`
+            );
+          }
+          
+          // Create directory for output image if it doesn't exist
+          await createOutputDirectory(path.dirname(outputPath));
+        } else if (!inline) {
+          throw new Error("imagePath is required unless inline is true");
+        }
+        
+        const videoKey = path.resolve(item.videoPath);
+        if (!jobs.has(videoKey)) {
+          jobs.set(videoKey, { videoPath: item.videoPath, outputs: new Map(), image: null });
+        }
+        
+        // Identical (videoPath, imagePath) pairs share one output, items
+        // without an imagePath share the null one
+        const outputs = jobs.get(videoKey).outputs;
+        const outputKey = outputPath ? path.resolve(outputPath) : null;
+        if (!outputs.has(outputKey)) {
+          outputs.set(outputKey, { outputPath, format: outputFormat, items: [] });
+        }
+        outputs.get(outputKey).items.push({ item, index });
+      } catch (e) {
+        setResult(index, {
+          videoPath: item.videoPath,
+          imagePath: item.imagePath,
+          error: String(e),
+          success: false
+        });
+      }
+    }
+    
+    const jobList = [...jobs.values()];
+    const { poolSize, threads: threadsPerJob } = jobPool(jobList.length);
+    
+    await mapWithConcurrency(jobList, poolSize, async (job) => {
+      const outputs = [...job.outputs.values()];
+      
+      const failOutput = (output, e) => {
+        for (const { item, index } of output.items) {
+          setResult(index, {
+            videoPath: item.videoPath,
+            imagePath: item.imagePath,
+            error: String(e),
+            success: false
+          });
+        }
+      };
+      
+      const succeedOutput = (output, info, source) => {
+        for (const { item, index } of output.items) {
+          setResult(index, {
+            videoPath: item.videoPath,
+            imagePath: output.outputPath, // Return the potentially modified path
+            success: true,
+            source,
+            ...info
+          });
+        }
+      };
+      
+      // The frame is chosen at most once per video, and only if some format
+      // isn't up to date or stored already
+      let framePromise = null;
+      const chooseFrame = () => {
+        framePromise = framePromise || (async () => {
+          // Verify the input file is actually a video
+          const mediaType = await detectMediaType(job.videoPath, { depth: 'quick' });
+          
+          if (!mediaType.isVideo) {
+            throw new Error(`File is not a video: ${mediaType.message || 'Invalid file type'}`);
+          }
+          
+          const formatInfo = mediaType.metadata.format || {};
+          return generateSmartThumbnail(job.videoPath, {
+            threads: threadsPerJob,
+            duration: parseFloat(formatInfo.duration || '0'),
+            sampling,
+            maxWidth,
+            maxHeight
+          });
+        })();
+        return framePromise;
+      };
+      
+      // The inline image is the one for items without an imagePath, or else
+      // for the first output
+      const inlineOutput = job.outputs.get(null) || outputs[0];
+      
+      // Each format is encoded once, then placed at each of its outputs
+      const byFormat = new Map();
+      for (const output of outputs) {
+        if (!byFormat.has(output.format)) {
+          byFormat.set(output.format, []);
         }
+        byFormat.get(output.format).push(output);
+      }
+      
+      for (const [outputFormat, formatOutputs] of byFormat) {
+        const encoding = { format: outputFormat, quality, effort };
+        const wantImage = inline && formatOutputs.includes(inlineOutput);
         
-        // Ensure the output has .png extension
-        let outputPath = item.imagePath;
-        const currentExt = path.extname(outputPath).toLowerCase();
+        // Outputs already written for this video and these parameters, whose
+        // files haven't changed since, are left alone
+        let key;
+        const current = [];
+        const stale = [];
+        try {
+          key = await thumbnailStore.key(job.videoPath, { ...frameParams, ...encoding });
+          for (const output of formatOutputs) {
+            const info = output.outputPath ? await thumbnailStore.upToDate(output.outputPath, key) : null;
+            if (info) {
+              current.push({ output, info });
+            } else {
+              stale.push(output);
+            }
+          }
+        } catch (e) {
+          formatOutputs.forEach(output => failOutput(output, e));
+          continue;
+        }
         
-        if (currentExt !== '.png') {
-          // Remove any existing extension and add .png
+        current.forEach(({ output, info }) => succeedOutput(output, info, 'up-to-date'));
+        if (stale.length === 0 && !wantImage) {
+          continue;
+        }
+        
+        // Reuse the stored image, or an up to date output, before encoding.
+        // An encoded image is made once in memory, then placed at each output.
+        let stored;
+        let source = 'reused';
+        try {
+          stored = await thumbnailStore.lookup(key, outputFormat);
+          if (!stored && current.length > 0) {
+            stored = { key, path: current[0].output.outputPath, info: current[0].info };
+          }
+          
+          if (!stored) {
+            const { frame, ...selection } = await chooseFrame();
+            const { data, ...info } = await encodeThumbnail(frame, encoding);
+            stored = await thumbnailStore.save(key, data, { ...info, ...selection });
+            source = 'generated';
+          }
+          
+          if (wantImage) {
+            const data = await thumbnailStore.read(stored);
+            job.image = { type: "image", data: data.toString('base64'), mimeType: `image/${outputFormat}` };
+          }
+        } catch (e) {
+          stale.forEach(output => failOutput(output, e));
+          continue;
+        }
+        
+        for (const output of stale) {
+          try {
+            if (output.outputPath) {
+              await thumbnailStore.place(stored, output.outputPath);
+            }
+            succeedOutput(output, stored.info, source);
+          } catch (e) {
+            failOutput(output, e);
+          }
+        }
+      }
+    });
+    
+    // Images follow the results in job order, one per video
+    const images = [];
+    for (const job of jobList) {
+      if (!job.image) {
+        continue;
+      }
+      
+      for (const output of job.outputs.values()) {
+        for (const { index } of output.items) {
+          if (results[index].success) {
+            results[index].imageIndex = images.length;
+          }
+        }
+      }
+      images.push(job.image);
+    }
+    
+    return {
+      content: [{ type: "text", text: JSON.stringify(results, null, 2) }, ...images]
+    };
+  }
+);
+
+
+server.tool(
+  "generateStoryboards",
+  `Generates storyboards from video files: a number of frames evenly spaced through each video, taken in a single pass over the video.
+  
+  In 'sheet' mode (the default) the frames are tiled into one PNG contact sheet at outputPath, and a WebVTT sprite index is written next to it (same name, .vtt extension) mapping each time range of the video to its tile, for scrubbing previews in video players. In 'frames' mode outputPath is a directory, and the frames are written into it as frame_0001.png, frame_0002.png and so on.`,
+  {
+    items: z.array(
+      z.object({
+        videoPath: z.string().describe("Path to the source video file"),
+        outputPath: z.string().describe("Path of the contact sheet (saved as PNG) in 'sheet' mode, or directory for the frames in 'frames' mode")
+      })
+    ).describe("Videos to generate storyboards for"),
+    mode: z.enum(['sheet', 'frames']).optional().describe("'sheet' (default) for one tiled image, 'frames' for one image per frame"),
+    frames: z.number().int().min(1).max(400).optional().describe("Number of frames per video (default 16)"),
+    columns: z.number().int().min(1).max(100).optional().describe("Tiles across the contact sheet (default a square-ish grid)"),
+    width: z.number().int().min(16).max(7680).optional().describe(
+      "Width of each frame in pixels, height follows the video's aspect ratio. Defaults to 160 for sheets and the video's width for frames."
+    ),
+    vtt: z.boolean().optional().describe("Write the WebVTT sprite index next to a contact sheet (default true)")
+  },
+  async ({ items, mode = 'sheet', frames = 16, columns, width, vtt = true }, extra) => {
+    const reportProgress = createProgressReporter(extra, items.length);
+    const tileWidth = width || (mode === 'sheet' ? 160 : null);
+    
+    const { poolSize, threads } = jobPool(items.length);
+    
+    const results = await mapWithConcurrency(items, poolSize, async (item) => {
+      try {
+        checkPath(item.videoPath);
+        
+        let outputPath = item.outputPath;
+        if (mode === 'sheet' && path.extname(outputPath).toLowerCase() !== '.png') {
           outputPath = path.join(
             path.dirname(outputPath),
             `${path.basename(outputPath, path.extname(outputPath))}.png`
           );
         }
         
-        // Create directory for output image if it doesn't exist
-        const imageDir = path.dirname(outputPath);
-        if (!fs.existsSync(imageDir)) {
-          fs.mkdirSync(imageDir, { recursive: true });
+        const outputDir = mode === 'sheet' ? path.dirname(outputPath) : outputPath;
+        await createOutputDirectory(outputDir);
+        
+        // Verify the input file is actually a video, and find its duration
+        // to space the frames
+        const mediaType = await detectMediaType(item.videoPath, { depth: 'quick' });
+        if (!mediaType.isVideo) {
+          throw new Error(`File is not a video: ${mediaType.message || 'Invalid file type'}`);
         }
         
-        // Check if the output path is in permitted directories
-        checkPath(imageDir);
+        const formatInfo = mediaType.metadata.format || {};
+        const duration = parseFloat(formatInfo.duration || '0');
+        if (!(duration > 0)) {
+          throw new Error("Video duration is unknown, frames cannot be spaced through it");
+        }
         
-        const thumbnailResult = await generateSmartThumbnail(
-          item.videoPath, 
-          outputPath
-        );
+        const options = { duration, columns, width: tileWidth, threads };
+        
+        if (mode === 'frames') {
+          const written = await extractStoryboardFrames(item.videoPath, outputPath, frames, options);
+          return reportProgress({
+            videoPath: item.videoPath,
+            outputPath,
+            frames: written,
+            success: true
+          });
+        }
+        
+        const { data, ...sheet } = await generateContactSheet(item.videoPath, frames, options);
+        await fs.promises.writeFile(outputPath, data);
+        
+        let vttPath = null;
+        if (vtt) {
+          vttPath = path.join(outputDir, `${path.basename(outputPath, '.png')}.vtt`);
+          await fs.promises.writeFile(vttPath, spriteVtt(path.basename(outputPath), sheet, frames));
+        }
         
-        results.push({
+        return reportProgress({
           videoPath: item.videoPath,
-          imagePath: outputPath, // Return the potentially modified path
-          format: 'png',
+          outputPath,
+          vttPath,
           success: true,
-          ...thumbnailResult
+          ...sheet
         });
       } catch (e) {
-        results.push({
+        return reportProgress({
           videoPath: item.videoPath,
-          imagePath: item.imagePath,
+          outputPath: item.outputPath,
           error: String(e),
           success: false
         });
       }
-    }
+    });
     
     return {
       content: [{ type: "text", text: JSON.stringify(results, null, 2) }]
@@ -204,6 +606,465 @@ server.tool(
 );
 
 
+server.tool(
+  "extractFrames",
+  `Extracts the frames at given timestamps from video files and saves them as PNG images.
+  
+  Frames are found either with a fast seek to the keyframe before each group of nearby timestamps followed by decoding on to the exact frames, or, when the timestamps are close together, with one decode from the first timestamp to the last. Seeks are spread over as few ffmpeg processes as keep the number of open decoders bounded. By default the method expected to cost less is used.
+  
+  Frames are written to outputDir as frame_<seconds>.png (e.g. frame_12.500.png). Timestamps past the end of the video are reported with an error.`,
+  {
+    items: z.array(
+      z.object({
+        videoPath: z.string().describe("Path to the source video file"),
+        timestamps: z.array(z.number().min(0)).min(1).describe("Times in the video to extract frames at, in seconds"),
+        outputDir: z.string().describe("Directory the frames are saved in")
+      })
+    ).describe("Videos and the timestamps to extract from each"),
+    method: z.enum(extractionMethods).optional().describe(
+      "'seek' seeks to each group of nearby timestamps, 'select' decodes once from the first timestamp to the last, " +
+      "'auto' (default) picks whichever should be faster"
+    ),
+    width: z.number().int().min(16).max(7680).optional().describe(
+      "Scale frames to this width in pixels, height follows the video's aspect ratio. Defaults to the video's width."
+    )
+  },
+  async ({ items, method = 'auto', width }, extra) => {
+    const reportProgress = createProgressReporter(extra, items.length);
+    
+    const { poolSize, threads } = jobPool(items.length);
+    
+    const results = await mapWithConcurrency(items, poolSize, async (item) => {
+      try {
+        checkPath(item.videoPath);
+        await createOutputDirectory(item.outputDir);
+        
+        const { info } = await getMediaInfo(item.videoPath, { depth: 'quick' });
+        if (info.mediaType !== VIDEO) {
+          throw new Error("File is not a video");
+        }
+        
+        // Timestamps past the end would leave an output without a frame
+        const inRange = item.timestamps.filter(time => !(info.duration > 0) || time <= info.duration);
+        const outOfRange = item.timestamps
+          .filter(time => !inRange.includes(time))
+          .map(time => ({ time, path: null, error: `Past the end of the video (${info.duration}s)` }));
+        
+        let extracted = { method: null, costs: null, frames: [] };
+        if (inRange.length > 0) {
+          extracted = await extractFrames(item.videoPath, item.outputDir, inRange, {
+            method,
+            fps: info.framerate,
+            width,
+            threads
+          });
+        }
+        
+        return reportProgress({
+          videoPath: item.videoPath,
+          method: extracted.method,
+          // Estimated cost of each method, in decoded frames
+          costs: extracted.costs,
+          frames: [...extracted.frames, ...outOfRange],
+          success: true
+        });
+      } catch (e) {
+        return reportProgress({
+          videoPath: item.videoPath,
+          error: String(e),
+          success: false
+        });
+      }
+    });
+    
+    return {
+      content: [{ type: "text", text: JSON.stringify(results, null, 2) }]
+    };
+  }
+);
+
+
+server.tool(
+  "scanMedia",
+  `Finds media files in the permitted directories.
+  
+  Walks the permitted directories (or a directory inside them) and returns the image and video files found, with their size and modification time. Results are returned a page at a time: when more files remain, the result includes a cursor that is passed back to get the next page. The paths returned can be passed to getMediaInfo.`,
+  {
+    path: z.string().optional().describe("Directory to scan. Defaults to all permitted directories."),
+    extensions: z.array(z.string()).optional().describe(
+      "File extensions to include (e.g. ['.mp4', '.mov']). Defaults to all supported image and video extensions."
+    ),
+    glob: z.string().optional().describe(
+      "Glob matched against the path relative to the scanned directory (e.g. '**/2024/*.jpg')"
+    ),
+    recursive: z.boolean().optional().describe("Scan subdirectories (default true)"),
+    pageSize: z.number().int().min(1).max(10000).optional().describe("Maximum number of files per page (default 1000)"),
+    cursor: z.string().optional().describe("Cursor from a previous scanMedia result, to get the next page"),
+    layout: z.enum(outputLayouts).optional().describe(
+      "Result encoding: 'pretty', 'compact' (default) or 'table'"
+    )
+  },
+  async ({ path: scanPath, extensions, glob, recursive = true, pageSize = 1000, cursor, layout = 'compact' }) => {
+    expireScanSessions();
+    
+    let session;
+    if (cursor) {
+      session = scanSessions.get(cursor);
+      if (!session) {
+        throw new Error("Unknown or expired cursor, start a new scan");
+      }
+    } else {
+      let roots = permittedDirectories;
+      if (scanPath) {
+        checkPath(scanPath);
+        roots = [scanPath];
+      }
+      
+      const wanted = normaliseExtensions(extensions);
+      
+      session = {
+        id: crypto.randomUUID(),
+        iterator: walkMedia(roots, { extensions: wanted, glob, recursive }),
+        returned: 0
+      };
+    }
+    
+    const files = [];
+    let done = false;
+    while (files.length < pageSize) {
+      const next = await session.iterator.next();
+      if (next.done) {
+        done = true;
+        break;
+      }
+      
+      const entry = next.value;
+      files.push({
+        path: entry.path,
+        size: entry.size,
+        modified: entry.modified,
+        mediaType: imageExtensions.includes(entry.extension) ? IMAGE :
+          (videoExtensions.includes(entry.extension) ? VIDEO : 'UNKNOWN')
+      });
+    }
+    
+    session.returned += files.length;
+    session.lastUsed = Date.now();
+    
+    if (done) {
+      scanSessions.delete(session.id);
+    } else {
+      scanSessions.set(session.id, session);
+    }
+    
+    return {
+      content: [
+        { type: "text", text: encodeResults(files, layout) },
+        {
+          type: "text",
+          text: JSON.stringify({ cursor: done ? null : session.id, returned: session.returned, done })
+        }
+      ]
+    };
+  }
+);
+
+server.tool(
+  "queryMedia",
+  `Searches the metadata of media files that have already been analyzed, without reading any files.
+  
+  Answers from the media index when the server runs with --index and the index is complete, otherwise (including while the index is still being built) from the files getMediaInfo has probed and cached. The result reports which was used as source, and indexing is true while the index is being built. Supports filtering, sorting and paging, for example "all h264 videos longer than 10 minutes at 3840 wide" or "the 50 largest PNG images".
+  
+  Video width, height and codec come from the first video stream. Image codec is the image format.`,
+  {
+    where: z.array(
+      z.object({
+        field: z.enum(queryFields).describe("Field to test"),
+        op: z.enum(queryOperators).describe("Comparison operator"),
+        value: z.union([z.string(), z.number(), z.boolean(), z.array(z.union([z.string(), z.number()]))])
+          .describe("Value to compare with, a list for 'in'. Dates are ISO 8601 strings.")
+      })
+    ).optional().describe("Conditions that must all match"),
+    sortBy: z.enum(queryFields).optional().describe("Field to sort by (default path)"),
+    order: z.enum(['asc', 'desc']).optional().describe("Sort order (default asc)"),
+    limit: z.number().int().min(1).max(10000).optional().describe("Maximum number of results per page (default 100)"),
+    cursor: z.string().optional().describe("Cursor from a previous queryMedia result, to get the next page"),
+    fields: z.array(z.string()).optional().describe(
+      "Only return these fields of each result, as dotted paths. path, success and error are always returned."
+    ),
+    layout: z.enum(outputLayouts).optional().describe(
+      "Result encoding: 'pretty' (default), 'compact' or 'table'"
+    )
+  },
+  async ({ where, sortBy = 'path', order = 'asc', limit = 100, cursor, fields, layout = 'pretty' }) => {
+    const matches = compileWhere(where);
+    const sortCompare = compileSort(sortBy, order);
+    // Break ties on path so pages are stable between calls
+    const compare = (a, b) => sortCompare(a, b) || (a.path < b.path ? -1 : (a.path > b.path ? 1 : 0));
+    
+    const offset = cursor ? decodeCursor(cursor) : 0;
+    
+    // A partial index (still building, or with a root no longer watched)
+    // would give incomplete or stale answers, the cache is used until then
+    const useIndex = Boolean(mediaIndex && mediaIndex.complete);
+    
+    let matched = 0;
+    function* candidates() {
+      const source = useIndex ? mediaIndex.values() : metadataCache.values();
+      for (const info of source) {
+        if (isSafePath(info.path) && matches(info)) {
+          matched++;
+          yield info;
+        }
+      }
+    }
+    
+    // Only the best offset + limit are kept, then the page is sliced off
+    const page = selectTop(candidates(), compare, offset + limit).slice(offset);
+    const nextOffset = offset + page.length;
+    
+    const results = page.map(info => projectFields({ ...info, success: true }, fields));
+    
+    return {
+      content: [
+        { type: "text", text: encodeResults(results, layout) },
+        {
+          type: "text",
+          text: JSON.stringify({
+            matched,
+            cursor: nextOffset < matched ? encodeCursor(nextOffset) : null,
+            source: useIndex ? 'index' : 'cache',
+            // With --index, whether the index is still being built
+            indexing: mediaIndex ? !mediaIndex.ready : false
+          })
+        }
+      ]
+    };
+  }
+);
+
+server.tool(
+  "findSimilarMedia",
+  `Finds near-duplicate images and videos, such as resized, re-encoded or re-compressed copies of the same photo or clip.
+  
+  Each file gets a perceptual hash (of a tiny grayscale thumbnail for images, of a few frames spread through the video for videos). Files whose hashes differ in at most threshold bits are grouped together. Images are only compared with images and videos with videos. Hashes are cached, so repeat searches over the same files only hash new or changed files.`,
+  {
+    mediaPaths: z.array(z.string()).optional().describe("Media files to compare. Defaults to every media file under path."),
+    path: z.string().optional().describe("Directory to search when mediaPaths is not given. Defaults to all permitted directories."),
+    algorithm: z.enum(hashAlgorithms).optional().describe(
+      "'dhash' (default, difference hash, fast) or 'phash' (DCT hash, more robust to contrast and compression changes)"
+    ),
+    threshold: z.number().int().min(0).max(32).optional().describe(
+      "Maximum number of differing bits (of 64) for two files to count as similar (default 8). " +
+      "For videos it applies to each sampled frame, and a video's distance is that of its least similar frame."
+    ),
+    layout: z.enum(outputLayouts).optional().describe(
+      "Result encoding: 'pretty' (default), 'compact' or 'table'"
+    )
+  },
+  async ({ mediaPaths, path: searchPath, algorithm = 'dhash', threshold = 8, layout = 'pretty' }, extra) => {
+    let filePaths = mediaPaths;
+    if (!filePaths) {
+      let roots = permittedDirectories;
+      if (searchPath) {
+        checkPath(searchPath);
+        roots = [searchPath];
+      }
+      
+      filePaths = [];
+      for await (const entry of walkMedia(roots, { extensions: [...imageExtensions, ...videoExtensions] })) {
+        filePaths.push(entry.path);
+      }
+    }
+    
+    const reportProgress = createProgressReporter(extra, filePaths.length);
+    const errors = [];
+    
+    const hashed = await mapWithConcurrency(filePaths, maxConcurrency, async (filePath) => {
+      try {
+        checkPath(filePath);
+        const { mediaType, hash } = await getPerceptualHash(filePath, algorithm);
+        reportProgress({ path: filePath, success: true });
+        return { path: filePath, mediaType, hash };
+      } catch (e) {
+        errors.push(reportProgress({ path: filePath, error: String(e), success: false }));
+        return null;
+      }
+    });
+    
+    // Each file is looked up in its media type's BK-tree before being added,
+    // so every similar pair is found once without comparing all pairs.
+    // Videos are compared frame by frame, so threshold bounds every frame.
+    const trees = {
+      [IMAGE]: new BKTree(frameDistance),
+      [VIDEO]: new BKTree(frameDistance)
+    };
+    
+    // Union-find over file indexes, so chains of similar files form one group
+    const parent = hashed.map((item, index) => index);
+    const find = (index) => {
+      while (parent[index] !== index) {
+        parent[index] = parent[parent[index]];
+        index = parent[index];
+      }
+      return index;
+    };
+    
+    hashed.forEach((item, index) => {
+      if (!item) {
+        return;
+      }
+      
+      const tree = trees[item.mediaType];
+      for (const match of tree.search(item.hash, threshold)) {
+        parent[find(index)] = find(match.value);
+      }
+      tree.add(item.hash, index);
+    });
+    
+    const groupsByRoot = new Map();
+    hashed.forEach((item, index) => {
+      if (!item) {
+        return;
+      }
+      
+      const root = find(index);
+      if (!groupsByRoot.has(root)) {
+        groupsByRoot.set(root, []);
+      }
+      groupsByRoot.get(root).push(item);
+    });
+    
+    // Report each group against its first file
+    const groups = [...groupsByRoot.values()]
+      .filter(members => members.length > 1)
+      .map(members => ({
+        mediaType: members[0].mediaType,
+        files: members.map(member => ({
+          path: member.path,
+          distance: frameDistance(members[0].hash, member.hash)
+        }))
+      }));
+    
+    return {
+      content: [
+        { type: "text", text: encodeResults(groups, layout) },
+        {
+          type: "text",
+          text: JSON.stringify({ files: filePaths.length, groups: groups.length, algorithm, errors })
+        }
+      ]
+    };
+  }
+);
+
+server.tool(
+  "findDuplicates",
+  `Finds files with exactly the same contents in the permitted directories.
+  
+  Files are grouped by size first, then files that share a size have the start and end of their contents hashed, and only files that still match are read and hashed in full. Most files are never read. Groups are returned largest wasted space first, with the size and SHA-256 of the shared contents.
+  
+  Each physical file is counted once: paths reached through symbolic links or overlapping directories are reported by their real path, and hard links to the same file are listed separately (under hardLinks) rather than as duplicates, since they take no extra space.`,
+  {
+    path: z.string().optional().describe("Directory to search. Defaults to all permitted directories."),
+    extensions: z.array(z.string()).optional().describe(
+      "File extensions to include (e.g. ['.jpg', '.mp4']). Defaults to all supported image and video extensions."
+    ),
+    glob: z.string().optional().describe(
+      "Glob matched against the path relative to the searched directory (e.g. '**/2024/*.jpg')"
+    ),
+    minSize: z.number().int().min(0).optional().describe("Ignore files smaller than this many bytes (default 1, so empty files are skipped)"),
+    layout: z.enum(outputLayouts).optional().describe(
+      "Result encoding: 'pretty' (default), 'compact' or 'table'"
+    )
+  },
+  async ({ path: searchPath, extensions, glob, minSize = 1, layout = 'pretty' }) => {
+    let roots = permittedDirectories;
+    if (searchPath) {
+      checkPath(searchPath);
+      roots = [searchPath];
+    }
+    
+    const wanted = normaliseExtensions(extensions);
+    
+    const entries = [];
+    for await (const entry of walkMedia(roots, { extensions: wanted, glob })) {
+      if (entry.size >= minSize) {
+        entries.push(entry);
+      }
+    }
+    
+    // Hard links share their data, so they are reported apart from the
+    // duplicate groups and don't count towards wastedBytes
+    const { groups, hardLinks, stats, errors } = await findDuplicateFiles(entries, { concurrency: maxConcurrency });
+    const wastedBytes = groups.reduce((total, group) => total + group.size * (group.files.length - 1), 0);
+    
+    return {
+      content: [
+        { type: "text", text: encodeResults(groups, layout) },
+        {
+          type: "text",
+          text: JSON.stringify({ ...stats, groups: groups.length, wastedBytes, hardLinks, errors })
+        }
+      ]
+    };
+  }
+);
+
+// Close scanMedia walks that haven't been continued for a while
+function expireScanSessions() {
+  const now = Date.now();
+  for (const [id, session] of scanSessions) {
+    if (now - session.lastUsed > SCAN_SESSION_TTL) {
+      scanSessions.delete(id);
+      session.iterator.return();
+    }
+  }
+}
+
+// Build a callback that sends an MCP progress notification for each result
+// as it completes, carrying the result itself so clients can consume results
+// before the whole batch is done (or keep them if the request times out).
+// Does nothing when the client didn't ask for progress.
+function createProgressReporter(extra, total) {
+  const progressToken = extra && extra._meta ? extra._meta.progressToken : undefined;
+  let completed = 0;
+  
+  return (result) => {
+    completed++;
+    
+    if (progressToken !== undefined && extra.sendNotification) {
+      extra.sendNotification({
+        method: "notifications/progress",
+        params: {
+          progressToken,
+          progress: completed,
+          total,
+          message: JSON.stringify(result)
+        }
+      }).catch((e) => console.error(`Error sending progress: ${e}`));
+    }
+    
+    return result;
+  };
+}
+
+// Pool size and ffmpeg threads per job for jobCount jobs. The cores are split
+// between the jobs running at once so parallel ffmpeg processes don't
+// oversubscribe the machine.
+function jobPool(jobCount) {
+  const poolSize = Math.max(1, Math.min(maxConcurrency, jobCount));
+  return { poolSize, threads: Math.max(1, Math.floor(cpuCount / poolSize)) };
+}
+
+// Extensions as walkMedia expects them (lower case, with the dot), all media
+// extensions when none are given
+function normaliseExtensions(extensions) {
+  return (extensions || [...imageExtensions, ...videoExtensions])
+    .map(extension => extension.toLowerCase())
+    .map(extension => extension.startsWith('.') ? extension : `.${extension}`);
+}
+
 // Function to check if a path is safe
 function isSafePath(pathToCheck) {
   const normalizedPath = path.normalize(path.resolve(pathToCheck));
@@ -236,8 +1097,101 @@ function checkPath(filePath) {
   return true;
 }
 
+// Create an output directory, checking it is permitted before anything is
+// created so a refused path leaves nothing behind
+async function createOutputDirectory(directory) {
+  if (!isSafePath(directory)) {
+    throw new Error("Path not allowed: Not in permitted directories");
+  }
+  
+  await fs.promises.mkdir(directory, { recursive: true });
+  return checkPath(directory);
+}
+
+// Probe depths in increasing order of cost, a cached result from a deeper
+// probe can answer a request for a shallower one
+function probeRank(depth, decodeFrames) {
+  return probeDepths.indexOf(depth) + (depth === 'exact' && decodeFrames ? 1 : 0);
+}
+
+// Get info for a single media file, served from the metadata cache when the
+// file has not changed since it was last probed at least as deeply, or from
+// the media index when it is enabled and the file's root is being watched.
+// options.depth and options.decodeFrames are as for the getMediaInfo tool,
+// options.skipIndex forces a cache lookup / probe even when the file is indexed.
+async function getMediaInfo(filePath, options = {}) {
+  const depth = options.depth || 'standard';
+  const rank = probeRank(depth, options.decodeFrames);
+  
+  // The index is kept current by the file watcher, so no stat is needed.
+  // It answers nothing for roots whose watcher has failed.
+  const indexed = mediaIndex && !options.skipIndex ? mediaIndex.get(filePath) : undefined;
+  if (indexed && probeRank(indexed.probe_depth, indexed.frames_decoded) >= rank) {
+    return { info: { ...indexed, path: filePath }, cacheHit: true };
+  }
+  
+  const cached = await metadataCache.get(
+    filePath,
+    info => probeRank(info.probe_depth, info.frames_decoded) >= rank
+  );
+  if (cached) {
+    // Cache entries are keyed by real path, report the path that was asked for
+    const info = { ...cached, path: filePath };
+    if (info.mediaType === IMAGE) {
+      info.filename = path.basename(filePath);
+    }
+    return { info, cacheHit: true };
+  }
+  
+  // Probe the file once, then reuse that result to build the info
+  const mediaType = await detectMediaType(filePath, options);
+  
+  let info;
+  if (mediaType.isImage) {
+    info = await getImageInfo(filePath, mediaType, options);
+    info.mediaType = IMAGE;
+  } else if (mediaType.isVideo) {
+    info = await getVideoInfo(filePath, mediaType, options);
+    info.mediaType = VIDEO;
+  } else {
+    throw new Error(`File is not a supported media type: ${mediaType.message}`);
+  }
+  
+  info.probe_depth = depth;
+  if (depth === 'exact' && options.decodeFrames) {
+    info.frames_decoded = true;
+  }
+  
+  await metadataCache.set(filePath, info);
+  
+  return { info: { ...info }, cacheHit: false };
+}
+
+// Perceptual hash of a file with the given algorithm, from the hash cache
+// when the file has not changed since it was last hashed.
+// Returns { mediaType, hash }.
+async function getPerceptualHash(filePath, algorithm) {
+  // A file's entry holds its media type and a hash per algorithm
+  const cached = (await hashCache.get(filePath)) || {};
+  if (cached[algorithm]) {
+    return { mediaType: cached.mediaType, hash: cached[algorithm] };
+  }
+  
+  const { info } = await getMediaInfo(filePath, { depth: 'quick' });
+  const hash = info.mediaType === VIDEO ?
+    await videoHash(filePath, info.duration, algorithm) :
+    await imageHash(filePath, algorithm);
+  
+  await hashCache.set(filePath, { ...cached, mediaType: info.mediaType, [algorithm]: hash });
+  
+  return { mediaType: info.mediaType, hash };
+}
+
 // Add unified media type detection function
-async function detectMediaType(filePath) {
+// The returned object doubles as the probe result for the file: it carries the
+// sharp or ffprobe metadata and the file stats so callers never probe twice.
+// options.depth and options.decodeFrames control how videos are probed.
+async function detectMediaType(filePath, options = {}) {
   checkPath(filePath);
   
   // Check extension first (fast check)
@@ -247,7 +1201,9 @@ async function detectMediaType(filePath) {
     type: 'UNKNOWN',
     isVideo: false,
     isImage: false,
-    message: null
+    message: null,
+    // Collected once here so the info helpers don't need to stat the file again
+    stats: fs.statSync(filePath)
   };
   
   if (imageExtensions.includes(extension)) {
@@ -260,82 +1216,120 @@ async function detectMediaType(filePath) {
   
   // For more reliable detection, use content-based checks
   try {
-    // Try first as image using sharp - this is faster and more reliable for image check
-    try {
-      const imageMetadata = await sharp(filePath).metadata();
-      mediaType.type = IMAGE;
-      mediaType.isImage = true;
-      mediaType.metadata = imageMetadata;
-      return mediaType;
-    } catch (sharpErr) {
-      // Not an image, could be a video or something else
-      // Now try as video using ffprobe
-      const videoCheck = await new Promise((resolve) => {
-        ffmpeg.ffprobe(filePath, (err, metadata) => {
-          if (err) {
-            resolve({ success: false, error: err.message });
-            return;
-          }
-          
-          const hasVideoStream = metadata.streams && 
-                                metadata.streams.some(stream => stream.codec_type === VIDEO);
-          
-          if (hasVideoStream) {
-            resolve({ 
-              success: true, 
-              metadata,
-              hasVideoStream: true
-            });
-          } else {
-            resolve({ 
-              success: true, 
-              metadata,
-              hasVideoStream: false 
-            });
-          }
-        });
-      });
-      
-      if (videoCheck.success && videoCheck.hasVideoStream) {
-        mediaType.type = VIDEO;
-        mediaType.isVideo = true;
-        mediaType.metadata = videoCheck.metadata;
+    // Identify the file from its leading bytes so it goes straight to the
+    // right backend. Only unrecognized signatures try both.
+    const header = await readHeader(filePath);
+    const sniffed = sniffMediaType(header);
+    mediaType.format = sniffed ? sniffed.format : null;
+    mediaType.header = header;
+    
+    // Common image formats keep their size and format in the first few
+    // hundred bytes, read them from there rather than opening the image
+    if (sniffed && sniffed.isImage) {
+      const headerMetadata = await readImageHeader(filePath, header, sniffed.format);
+      if (headerMetadata) {
+        mediaType.type = IMAGE;
+        mediaType.isImage = true;
+        mediaType.isVideo = false;
+        mediaType.metadata = headerMetadata;
         return mediaType;
       }
-      
-      // Not a video with video streams either
-      if (videoCheck.success) {
-        // It's a file ffprobe recognizes but no video streams
-        // Might be audio-only or other media
-        mediaType.type = 'OTHER_MEDIA';
-        mediaType.message = 'File is recognized by ffprobe but contains no video streams';
-        mediaType.metadata = videoCheck.metadata;
-      } else {
-        // Not recognized by either tool
-        mediaType.type = 'UNKNOWN';
-        mediaType.message = `Unrecognized media: ${videoCheck.error}, ${sharpErr.message}`;
+    }
+    
+    let sharpErr = null;
+    if (!sniffed || sniffed.isImage) {
+      try {
+        const imageMetadata = await sharp(filePath).metadata();
+        mediaType.type = IMAGE;
+        mediaType.isImage = true;
+        mediaType.isVideo = false;
+        mediaType.metadata = imageMetadata;
+        return mediaType;
+      } catch (e) {
+        sharpErr = e;
       }
     }
+    
+    // Not an image, could be a video or something else
+    // Now try as video, in process when the container allows it, otherwise with ffprobe
+    const videoCheck = await probeVideo(filePath, sniffed, header, options)
+      .then((metadata) => ({
+        success: true,
+        metadata,
+        hasVideoStream: Boolean(metadata.streams) &&
+                        metadata.streams.some(stream => stream.codec_type === 'video')
+      }))
+      .catch((err) => ({ success: false, error: err.message }));
+    
+    if (videoCheck.success && videoCheck.hasVideoStream) {
+      mediaType.type = VIDEO;
+      mediaType.isVideo = true;
+      mediaType.isImage = false;
+      mediaType.metadata = videoCheck.metadata;
+      return mediaType;
+    }
+    
+    // Not a video with video streams either
+    if (videoCheck.success) {
+      // It's a file ffprobe recognizes but no video streams
+      // Might be audio-only or other media
+      mediaType.type = 'OTHER_MEDIA';
+      mediaType.message = 'File is recognized by ffprobe but contains no video streams';
+      mediaType.metadata = videoCheck.metadata;
+    } else {
+      // Not recognized by either tool
+      mediaType.type = 'UNKNOWN';
+      mediaType.message = sharpErr ?
+        `Unrecognized media: ${videoCheck.error}, ${sharpErr.message}` :
+        `Unrecognized media: ${videoCheck.error}`;
+    }
   } catch (e) {
     mediaType.message = `Error detecting media type: ${e.message}`;
   }
   
   return mediaType;
 }
+
 // Get image info helper function
-async function getImageInfo(imagePath) {
+// probe is the optional result of detectMediaType, used to avoid opening the file again
+// With options.depth quick, EXIF / XMP / IPTC are skipped
+async function getImageInfo(imagePath, probe = null, options = {}) {
   
   try {
-    const metadata = await sharp(imagePath).metadata();
-    const stats = fs.statSync(imagePath);
+    const metadata = probe && probe.isImage && probe.metadata ?
+      probe.metadata :
+      await sharp(imagePath).metadata();
+    const stats = probe && probe.stats ? probe.stats : fs.statSync(imagePath);
+    
+    // EXIF, XMP and IPTC come from the metadata blocks alone, never the pixels
+    let header = probe && probe.header;
+    let format = probe && probe.format;
+    if (!header) {
+      header = await readHeader(imagePath);
+      const sniffed = sniffMediaType(header);
+      format = sniffed ? sniffed.format : null;
+    }
+    const imageMetadata = options.depth === 'quick' ?
+      {} :
+      await readImageMetadata(imagePath, header, format, metadata);
+    
+    // Header-only metadata has the density of a JFIF segment, camera JPEGs
+    // usually only record it in EXIF
+    const density = metadata.density || exifDensity(imageMetadata.exif);
     
     return {
       format: metadata.format,
       mode: metadata.hasAlpha ? 'RGBA' : 'RGB',
       width: metadata.width,
       height: metadata.height,
-      resolution: metadata.density ? [metadata.density, metadata.density] : null,
+      resolution: density ? [density, density] : null,
       size: stats.size,
+      exif: imageMetadata.exif,
+      gps: imageMetadata.gps,
+      xmp: imageMetadata.xmp,
+      iptc: imageMetadata.iptc,
+      creation_date: imageMetadata.creation_date || null,
+      modification_date: stats.mtime.toISOString(),
       filename: path.basename(imagePath),
       path: imagePath
     };
@@ -345,113 +1339,117 @@ async function getImageInfo(imagePath) {
   }
 }
 
+// Read ffprobe style metadata for a video. MP4 / MOV and MKV / WebM files are parsed in
+// process, which avoids spawning ffprobe; anything the parser can't handle
+// goes to ffprobe. sniffed and header are passed when the caller already
+// read the start of the file. options.depth and options.decodeFrames are
+// passed on to ffprobe.
+async function probeVideo(filePath, sniffed = null, header = null, options = {}) {
+  if (!header) {
+    header = await readHeader(filePath);
+    sniffed = sniffMediaType(header);
+  }
+  
+  // MP4 sample tables hold exact frame counts, so they can answer an exact
+  // probe too. Matroska headers have no counts and decoding needs ffprobe.
+  const exact = options.depth === 'exact';
+  
+  let metadata = null;
+  if (sniffed && !(exact && options.decodeFrames)) {
+    if (isoBmffFormats.includes(sniffed.format)) {
+      metadata = await parseIsoBmff(filePath, header);
+    } else if (matroskaFormats.includes(sniffed.format) && !exact) {
+      metadata = await parseMatroska(filePath, header);
+    }
+  }
+  
+  if (metadata) {
+    return metadata;
+  }
+  
+  return runFfprobe(filePath, options);
+}
+
 // Get video info helper function
-function getVideoInfo(videoPath) {
+// probe is the optional result of detectMediaType, used to avoid running ffprobe again
+async function getVideoInfo(videoPath, probe = null, options = {}) {
   
-  return new Promise((resolve, reject) => {
-    ffmpeg.ffprobe(videoPath, (err, metadata) => {
-      if (err) {
-        console.error(`Error: ${err}`);
-        reject(err);
-        return;
-      }
-      
-      // Extract video streams
-      const videoStreams = metadata.streams.filter(stream => stream.codec_type === VIDEO);
-      const audioStreams = metadata.streams.filter(stream => stream.codec_type === 'audio');
-      
-      // Format information
-      const formatInfo = metadata.format;
-      
-      // Get framerate if video stream exists
-      let framerate = null;
-      
-      if (videoStreams.length > 0) {
-        const videoStream = videoStreams[0];
-        
-        if (videoStream.avg_frame_rate) {
-          const framerateParts = videoStream.avg_frame_rate.split('/');
-          if (framerateParts.length === 2 && parseInt(framerateParts[1]) !== 0) {
-            framerate = parseFloat((parseInt(framerateParts[0]) / parseInt(framerateParts[1])).toFixed(2));
-          }
-        }
+  let metadata;
+  if (probe && probe.isVideo && probe.metadata && probe.metadata.streams) {
+    metadata = probe.metadata;
+  } else {
+    try {
+      metadata = await probeVideo(videoPath, null, null, options);
+    } catch (err) {
+      console.error(`Error: ${err}`);
+      throw err;
+    }
+  }
+  
+  // Extract video streams
+  const videoStreams = metadata.streams.filter(stream => stream.codec_type === 'video');
+  const audioStreams = metadata.streams.filter(stream => stream.codec_type === 'audio');
+  
+  // Format information
+  const formatInfo = metadata.format;
+  
+  // Get framerate if video stream exists
+  let framerate = null;
+  
+  if (videoStreams.length > 0) {
+    const videoStream = videoStreams[0];
+    
+    if (videoStream.avg_frame_rate) {
+      const framerateParts = videoStream.avg_frame_rate.split('/');
+      if (framerateParts.length === 2 && parseInt(framerateParts[1]) !== 0) {
+        framerate = parseFloat((parseInt(framerateParts[0]) / parseInt(framerateParts[1])).toFixed(2));
       }
+    }
+  }
 
-      // Look for creation date in common metadata locations
-      let creationDate = null;
+  // Counted frames from an exact probe, otherwise the count the container
+  // records (MP4 sample tables) when there is one
+  let totalFrames = null;
+  
+  if (videoStreams.length > 0) {
+    const videoStream = videoStreams[0];
+    const frames = videoStream.nb_read_frames || videoStream.nb_read_packets || videoStream.nb_frames;
+    if (frames && parseInt(frames) > 0) {
+      totalFrames = parseInt(frames);
+    }
+  }
 
-      // Check format tags first (most common location)
-      if (formatInfo.tags) {
-        creationDate = formatInfo.tags.creation_time || 
-                      formatInfo.tags.date || 
-                      formatInfo.tags.com_apple_quicktime_creationdate;
-      }
-      
-      // If not found in format tags, check video stream tags
-      if (!creationDate && videoStreams.length > 0 && videoStreams[0].tags) {
-        creationDate = videoStreams[0].tags.creation_time || 
-                      videoStreams[0].tags.date;
-      }
-      
-      resolve({
-        format: formatInfo,
-        video_streams: videoStreams,
-        audio_streams: audioStreams,
-        duration: parseFloat(formatInfo.duration || '0'),
-        size: parseInt(formatInfo.size || '0'),
-        bit_rate: parseInt(formatInfo.bit_rate || '0'),
-        framerate,
-        creation_date: creationDate,
-        path: videoPath
-      });
-    });
-  });
-}
+  // Look for creation date in common metadata locations
+  let creationDate = null;
 
-// Add the helper function for generating smart thumbnails using the thumbnail filter
-function generateSmartThumbnail(videoPath, imagePath) {
-  return new Promise((resolve, reject) => {
-    ffmpeg(videoPath)
-      .outputOptions([
-        // Use the thumbnail filter which selects a representative frame
-        '-vf thumbnail',
-        // Take only one frame
-        '-frames:v 1'
-      ])
-      .output(imagePath)
-      .on('error', (err) => {
-        console.error(`Error generating thumbnail: ${err.message}`);
-        reject(err);
-      })
-      .on('end', () => {
-        // Get info about the generated image
-        sharp(imagePath)
-          .metadata()
-          .then((metadata) => {
-            resolve({
-              width: metadata.width,
-              height: metadata.height,
-              size: fs.statSync(imagePath).size
-            });
-          })
-          .catch(err => {
-            // If we can't get metadata, at least confirm it was created
-            if (fs.existsSync(imagePath)) {
-              resolve({
-                size: fs.statSync(imagePath).size,
-                note: "Image created but metadata could not be read"
-              });
-            } else {
-              reject(new Error("Failed to generate image"));
-            }
-          });
-      })
-      .run();
-  });
+  // Check format tags first (most common location)
+  if (formatInfo.tags) {
+    creationDate = formatInfo.tags.creation_time || 
+                  formatInfo.tags.date || 
+                  formatInfo.tags['com.apple.quicktime.creationdate'] ||
+                  formatInfo.tags.com_apple_quicktime_creationdate;
+  }
+  
+  // If not found in format tags, check video stream tags
+  if (!creationDate && videoStreams.length > 0 && videoStreams[0].tags) {
+    creationDate = videoStreams[0].tags.creation_time || 
+                  videoStreams[0].tags.date;
+  }
+  
+  return {
+    format: formatInfo,
+    video_streams: videoStreams,
+    audio_streams: audioStreams,
+    duration: parseFloat(formatInfo.duration || '0'),
+    size: parseInt(formatInfo.size || '0'),
+    bit_rate: parseInt(formatInfo.bit_rate || '0'),
+    framerate,
+    total_frames: totalFrames,
+    creation_date: creationDate,
+    path: videoPath
+  };
 }
 
-
-
 // Start receiving messages on stdin and sending messages on stdout
 const transport = new StdioServerTransport();
 server.connect(transport).catch(console.error);
\ No newline at end of file
@@ -0,0 +1,177 @@
+import fs from 'fs';
+import path from 'path';
+
+const DEFAULT_FILE_NAME = 'metadata-cache.jsonl';
+
+// Bump when the shape of cached info objects changes so old entries are ignored
+const CACHE_VERSION = 3;
+
+// Metadata cache keyed by (realpath, size, mtimeNs, inode).
+//
+// Entries live in an in-memory LRU (a Map kept in least to most recently used
+// order) bounded by maxEntries. When a cache directory is given, every write is
+// also appended to a JSON lines log so the cache survives restarts. The log is
+// rewritten from the live entries once it grows well past maxEntries.
+// fileName picks the log file, so other per-file data (such as perceptual
+// hashes) can be cached under the same key in the same directory.
+export class MetadataCache {
+  constructor({ cacheDir = null, maxEntries = 10000, fileName = DEFAULT_FILE_NAME } = {}) {
+    this.cacheDir = cacheDir;
+    this.maxEntries = maxEntries;
+    this.entries = new Map();
+    this.hits = 0;
+    this.misses = 0;
+
+    this.logPath = cacheDir ? path.join(cacheDir, fileName) : null;
+    this.logLines = 0;
+    // Log writes are chained so lines are never interleaved
+    this.pendingWrite = Promise.resolve();
+  }
+
+  // Load any persisted entries from the cache directory
+  async load() {
+    if (!this.logPath) {
+      return;
+    }
+
+    await fs.promises.mkdir(this.cacheDir, { recursive: true });
+
+    let data;
+    try {
+      data = await fs.promises.readFile(this.logPath, 'utf8');
+    } catch (e) {
+      if (e.code === 'ENOENT') {
+        return;
+      }
+      throw e;
+    }
+
+    for (const line of data.split('\n')) {
+      if (!line) {
+        continue;
+      }
+
+      this.logLines++;
+
+      let record;
+      try {
+        record = JSON.parse(line);
+      } catch (e) {
+        // A partially written last line from a crash, skip it
+        continue;
+      }
+
+      if (record.v !== CACHE_VERSION) {
+        continue;
+      }
+
+      this.remember(record.path, record);
+    }
+  }
+
+  // Stat a file and build the parts of the cache key
+  async fingerprint(filePath) {
+    const realPath = await fs.promises.realpath(filePath);
+    const stats = await fs.promises.stat(realPath, { bigint: true });
+
+    return {
+      path: realPath,
+      size: String(stats.size),
+      mtimeNs: String(stats.mtimeNs),
+      ino: String(stats.ino)
+    };
+  }
+
+  // Return cached info for the file or undefined if missing or stale.
+  // accept, when given, can turn down an entry that is current but not good
+  // enough for the caller (for example from a shallower probe).
+  async get(filePath, accept = null) {
+    const key = await this.fingerprint(filePath);
+    const entry = this.entries.get(key.path);
+
+    if (!entry ||
+        entry.size !== key.size ||
+        entry.mtimeNs !== key.mtimeNs ||
+        entry.ino !== key.ino ||
+        (accept && !accept(entry.info))) {
+      this.misses++;
+      return undefined;
+    }
+
+    // Move to the most recently used end
+    this.entries.delete(key.path);
+    this.entries.set(key.path, entry);
+
+    this.hits++;
+    return entry.info;
+  }
+
+  // Iterate the cached info, reported under the real path it is keyed by
+  *values() {
+    for (const [realPath, entry] of this.entries) {
+      yield { ...entry.info, path: realPath };
+    }
+  }
+
+  // Store info for the file, keyed by its current fingerprint
+  async set(filePath, info) {
+    const key = await this.fingerprint(filePath);
+    const record = { v: CACHE_VERSION, ...key, info };
+
+    this.remember(key.path, record);
+
+    if (this.logPath) {
+      this.pendingWrite = this.pendingWrite
+        .then(() => this.append(record))
+        .catch((e) => console.error(`Error writing metadata cache: ${e}`));
+      await this.pendingWrite;
+    }
+  }
+
+  remember(realPath, record) {
+    this.entries.delete(realPath);
+    this.entries.set(realPath, {
+      size: record.size,
+      mtimeNs: record.mtimeNs,
+      ino: record.ino,
+      info: record.info
+    });
+
+    // Evict least recently used entries past the limit
+    while (this.entries.size > this.maxEntries) {
+      const oldest = this.entries.keys().next().value;
+      this.entries.delete(oldest);
+    }
+  }
+
+  async append(record) {
+    await fs.promises.appendFile(this.logPath, JSON.stringify(record) + '\n');
+    this.logLines++;
+
+    // Superseded and evicted lines pile up in the log, compact it when it
+    // holds twice as many lines as the cache can keep
+    if (this.logLines > this.maxEntries * 2) {
+      await this.compact();
+    }
+  }
+
+  // Rewrite the log with only the live entries
+  async compact() {
+    const lines = [];
+    for (const [realPath, entry] of this.entries) {
+      lines.push(JSON.stringify({
+        v: CACHE_VERSION,
+        path: realPath,
+        size: entry.size,
+        mtimeNs: entry.mtimeNs,
+        ino: entry.ino,
+        info: entry.info
+      }));
+    }
+
+    const tempPath = `${this.logPath}.${process.pid}.tmp`;
+    await fs.promises.writeFile(tempPath, lines.length ? lines.join('\n') + '\n' : '');
+    await fs.promises.rename(tempPath, this.logPath);
+    this.logLines = lines.length;
+  }
+}
@@ -0,0 +1,179 @@
+import ffmpeg from 'fluent-ffmpeg';
+import sharp from 'sharp';
+
+// Frames sampled from a video. The video hash is their hashes concatenated.
+export const VIDEO_HASH_FRAMES = 4;
+
+// dhash: difference hash, compares neighbouring pixels of a 9x8 thumbnail
+// phash: DCT hash, compares low frequency DCT terms of a 32x32 thumbnail to their median
+export const hashAlgorithms = ['dhash', 'phash'];
+
+const thumbnailSizes = {
+  dhash: { width: 9, height: 8 },
+  phash: { width: 32, height: 32 }
+};
+
+// Turn 64 bits (an array of 0/1) into a 16 character hex string
+function bitsToHex(bits) {
+  let hex = '';
+  for (let i = 0; i < bits.length; i += 4) {
+    hex += ((bits[i] << 3) | (bits[i + 1] << 2) | (bits[i + 2] << 1) | bits[i + 3]).toString(16);
+  }
+  return hex;
+}
+
+function dhash(pixels) {
+  const bits = [];
+  for (let y = 0; y < 8; y++) {
+    for (let x = 0; x < 8; x++) {
+      bits.push(pixels[y * 9 + x] > pixels[y * 9 + x + 1] ? 1 : 0);
+    }
+  }
+  return bitsToHex(bits);
+}
+
+// Precomputed DCT-II basis for 32 samples
+const dctBasis = [];
+for (let k = 0; k < 32; k++) {
+  dctBasis.push([]);
+  for (let n = 0; n < 32; n++) {
+    dctBasis[k].push(Math.cos(Math.PI * (n + 0.5) * k / 32));
+  }
+}
+
+function phash(pixels) {
+  const size = 32;
+
+  // Separable 2D DCT, rows then columns, keeping only the 8x8 low frequencies
+  const rows = [];
+  for (let y = 0; y < size; y++) {
+    const row = [];
+    for (let k = 0; k < 8; k++) {
+      let sum = 0;
+      for (let x = 0; x < size; x++) {
+        sum += pixels[y * size + x] * dctBasis[k][x];
+      }
+      row.push(sum);
+    }
+    rows.push(row);
+  }
+
+  const coefficients = [];
+  for (let v = 0; v < 8; v++) {
+    for (let u = 0; u < 8; u++) {
+      let sum = 0;
+      for (let y = 0; y < size; y++) {
+        sum += rows[y][u] * dctBasis[v][y];
+      }
+      coefficients.push(sum);
+    }
+  }
+
+  // The DC term says nothing about structure, leave it out of the median
+  const sorted = coefficients.slice(1).sort((a, b) => a - b);
+  const median = (sorted[31] + sorted[32]) / 2;
+
+  return bitsToHex(coefficients.map(value => (value > median ? 1 : 0)));
+}
+
+// Hash a grayscale thumbnail of the size thumbnailSizes gives for algorithm
+function hashPixels(pixels, algorithm) {
+  return algorithm === 'phash' ? phash(pixels) : dhash(pixels);
+}
+
+// Perceptual hash of an image, from a small grayscale thumbnail
+export async function imageHash(filePath, algorithm = 'dhash') {
+  const { width, height } = thumbnailSizes[algorithm];
+  const pixels = await sharp(filePath)
+    .rotate()
+    .grayscale()
+    .resize(width, height, { fit: 'fill' })
+    // One byte per pixel, as hashPixels expects, even for images with alpha
+    .removeAlpha()
+    .raw()
+    .toBuffer();
+  return hashPixels(pixels, algorithm);
+}
+
+// Decode the keyframe at or before each of times (seconds), scaled to a tiny
+// grayscale thumbnail, in one ffmpeg process. Each time is an input seeked
+// without decoding on to the exact frame, and the frames are concatenated
+// to one raw stream of width * height bytes per frame.
+function grabKeyframes(filePath, times, width, height) {
+  const command = ffmpeg();
+  for (const time of times) {
+    command
+      .input(filePath)
+      .inputOptions(['-skip_frame nokey', '-noaccurate_seek', `-ss ${time}`]);
+  }
+
+  const frames = times.map((time, index) =>
+    `[${index}:v:0]trim=end_frame=1,setpts=PTS-STARTPTS,scale=${width}:${height}:flags=area,format=gray[f${index}]`
+  );
+  const inputs = times.map((time, index) => `[f${index}]`).join('');
+  command
+    .complexFilter([...frames, `${inputs}concat=n=${times.length}:v=1:a=0[frames]`], 'frames')
+    .outputOptions(['-f rawvideo']);
+
+  const chunks = [];
+  const exited = new Promise((resolve, reject) => {
+    command.on('error', reject).on('end', resolve);
+  });
+  const output = command.pipe();
+  const read = new Promise((resolve, reject) => {
+    output.on('data', chunk => chunks.push(chunk));
+    output.on('end', resolve);
+    output.on('error', reject);
+  });
+
+  return Promise.all([exited, read]).then(() => {
+    const pixels = Buffer.concat(chunks);
+    if (pixels.length < times.length * width * height) {
+      throw new Error(`ffmpeg could not read a frame at each of ${times.join(', ')}s`);
+    }
+    return pixels;
+  });
+}
+
+// Perceptual hash of a video: the hashes of the keyframes at VIDEO_HASH_FRAMES
+// evenly spaced points (skipping the very start and end), concatenated
+export async function videoHash(filePath, duration, algorithm = 'dhash') {
+  const { width, height } = thumbnailSizes[algorithm];
+  const times = [];
+  for (let i = 0; i < VIDEO_HASH_FRAMES; i++) {
+    times.push((duration > 0 ? (duration * (i + 1)) / (VIDEO_HASH_FRAMES + 1) : 0).toFixed(3));
+  }
+
+  const pixels = await grabKeyframes(filePath, times, width, height);
+  const frameSize = width * height;
+  const hashes = times.map((time, index) =>
+    hashPixels(pixels.subarray(index * frameSize, (index + 1) * frameSize), algorithm)
+  );
+
+  return hashes.join('');
+}
+
+// Number of differing bits between two hex hashes of the same length
+export function hammingDistance(a, b) {
+  let distance = 0;
+  for (let i = 0; i < a.length; i += 8) {
+    let x = parseInt(a.slice(i, i + 8), 16) ^ parseInt(b.slice(i, i + 8), 16);
+    // Population count
+    x -= (x >>> 1) & 0x55555555;
+    x = (x & 0x33333333) + ((x >>> 2) & 0x33333333);
+    distance += (((x + (x >>> 4)) & 0x0f0f0f0f) * 0x01010101) >>> 24;
+  }
+  return distance;
+}
+
+// Largest Hamming distance between corresponding frame hashes (16 hex digits
+// each) of two hashes. An image hash is a single frame, so this is its plain
+// Hamming distance. Two videos are as far apart as their least similar pair
+// of sampled frames, which, as a maximum of metrics, is still a metric.
+export function frameDistance(a, b) {
+  let distance = 0;
+  for (let i = 0; i < a.length; i += 16) {
+    distance = Math.max(distance, hammingDistance(a.slice(i, i + 16), b.slice(i, i + 16)));
+  }
+  return distance;
+}
@@ -0,0 +1,111 @@
+// Fields every projected result keeps, so callers can always tell which file
+// a result is for and whether it worked
+const alwaysKept = ['path', 'success', 'error'];
+
+// Output layouts for tool results:
+//   pretty  - indented JSON array (the default)
+//   compact - JSON array without whitespace
+//   table   - compact JSON { columns, rows } with one shared header row
+export const outputLayouts = ['pretty', 'compact', 'table'];
+
+// Pick the value at segments from value. Arrays are walked element by
+// element, so "video_streams.codec_name" picks the codec of every stream.
+function pick(value, segments) {
+  if (segments.length === 0) {
+    return value;
+  }
+
+  if (Array.isArray(value)) {
+    return value.map(item => pick(item, segments));
+  }
+
+  if (value === null || typeof value !== 'object') {
+    return undefined;
+  }
+
+  const [head, ...rest] = segments;
+  if (!(head in value)) {
+    return undefined;
+  }
+
+  const picked = pick(value[head], rest);
+  return picked === undefined ? undefined : { [head]: picked };
+}
+
+function merge(target, source) {
+  if (Array.isArray(target) && Array.isArray(source)) {
+    return source.map((item, index) => merge(target[index], item));
+  }
+
+  if (target && source && typeof target === 'object' && typeof source === 'object') {
+    const merged = { ...target };
+    for (const [key, value] of Object.entries(source)) {
+      merged[key] = key in merged ? merge(merged[key], value) : value;
+    }
+    return merged;
+  }
+
+  return source === undefined ? target : source;
+}
+
+// Keep only the given dotted field paths of a result
+export function projectFields(result, fields) {
+  if (!fields || fields.length === 0) {
+    return result;
+  }
+
+  let projected = {};
+  for (const field of [...alwaysKept, ...fields]) {
+    const picked = pick(result, field.split('.'));
+    if (picked !== undefined) {
+      projected = merge(projected, picked);
+    }
+  }
+  return projected;
+}
+
+// Flatten nested objects into dotted keys, arrays are kept as values
+function flatten(value, prefix, into) {
+  for (const [key, item] of Object.entries(value)) {
+    const name = prefix ? `${prefix}.${key}` : key;
+    if (item && typeof item === 'object' && !Array.isArray(item)) {
+      flatten(item, name, into);
+    } else {
+      into[name] = item;
+    }
+  }
+  return into;
+}
+
+// Lay results out as one header of column names and a row of values per
+// result, so each key is written once rather than once per result
+export function toTable(results) {
+  const columns = [];
+  const seen = new Set();
+  const flattened = results.map(result => flatten(result, '', {}));
+
+  for (const row of flattened) {
+    for (const key of Object.keys(row)) {
+      if (!seen.has(key)) {
+        seen.add(key);
+        columns.push(key);
+      }
+    }
+  }
+
+  return {
+    columns,
+    rows: flattened.map(row => columns.map(column => (column in row ? row[column] : null)))
+  };
+}
+
+// Serialise results in the requested layout
+export function encodeResults(results, layout = 'pretty') {
+  if (layout === 'table') {
+    return JSON.stringify(toTable(results));
+  }
+  if (layout === 'compact') {
+    return JSON.stringify(results);
+  }
+  return JSON.stringify(results, null, 2);
+}
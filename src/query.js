@@ -0,0 +1,192 @@
+// Fields that can be filtered and sorted on, with how to read each from a
+// getMediaInfo result. Video dimensions and codec come from the first video
+// stream, image codec is the image format.
+const fieldReaders = {
+  path: info => info.path,
+  mediaType: info => info.mediaType,
+  format: info => (info.mediaType === 'VIDEO' ? (info.format && info.format.format_name) : info.format),
+  codec: info => (info.mediaType === 'VIDEO' ? firstVideoStream(info).codec_name : info.format),
+  width: info => (info.mediaType === 'VIDEO' ? firstVideoStream(info).width : info.width),
+  height: info => (info.mediaType === 'VIDEO' ? firstVideoStream(info).height : info.height),
+  duration: info => info.duration,
+  framerate: info => info.framerate,
+  total_frames: info => info.total_frames,
+  bit_rate: info => info.bit_rate,
+  size: info => info.size,
+  creation_date: info => info.creation_date,
+  modification_date: info => info.modification_date
+};
+
+export const queryFields = Object.keys(fieldReaders);
+
+export const queryOperators = ['eq', 'ne', 'gt', 'gte', 'lt', 'lte', 'in', 'contains'];
+
+// Fields compared as dates rather than strings
+const dateFields = ['creation_date', 'modification_date'];
+
+function firstVideoStream(info) {
+  return (info.video_streams && info.video_streams[0]) || {};
+}
+
+// Normalise a value for comparison: dates to milliseconds, strings to lower case
+function normalise(field, value) {
+  if (value === undefined || value === null || value === '') {
+    return null;
+  }
+  if (dateFields.includes(field)) {
+    const time = Date.parse(value);
+    return isNaN(time) ? null : time;
+  }
+  if (typeof value === 'string') {
+    return value.toLowerCase();
+  }
+  return value;
+}
+
+// Read a field from a result, normalised for comparison
+export function fieldValue(info, field) {
+  return normalise(field, fieldReaders[field](info));
+}
+
+// Compile a list of { field, op, value } conditions into a single predicate.
+// All conditions must match. Values are normalised once here, not per record.
+export function compileWhere(where = []) {
+  const tests = where.map(({ field, op, value }) => {
+    if (!fieldReaders[field]) {
+      throw new Error(`Unknown field: ${field}`);
+    }
+
+    const read = fieldReaders[field];
+
+    if (op === 'in') {
+      const wanted = new Set([].concat(value).map(item => normalise(field, item)));
+      return info => wanted.has(normalise(field, read(info)));
+    }
+
+    if (op === 'contains') {
+      const wanted = String(value).toLowerCase();
+      return (info) => {
+        const actual = read(info);
+        return actual !== undefined && actual !== null && String(actual).toLowerCase().includes(wanted);
+      };
+    }
+
+    const wanted = normalise(field, value);
+    const compare = {
+      eq: actual => actual === wanted,
+      ne: actual => actual !== wanted,
+      gt: actual => actual !== null && actual > wanted,
+      gte: actual => actual !== null && actual >= wanted,
+      lt: actual => actual !== null && actual < wanted,
+      lte: actual => actual !== null && actual <= wanted
+    }[op];
+
+    if (!compare) {
+      throw new Error(`Unknown operator: ${op}`);
+    }
+
+    return info => compare(normalise(field, read(info)));
+  });
+
+  return info => tests.every(test => test(info));
+}
+
+// Build a comparator for sorting on a field. Missing values sort last.
+export function compileSort(field, order = 'asc') {
+  if (!fieldReaders[field]) {
+    throw new Error(`Unknown field: ${field}`);
+  }
+
+  const direction = order === 'desc' ? -1 : 1;
+  return (a, b) => {
+    const left = fieldValue(a, field);
+    const right = fieldValue(b, field);
+    if (left === right) {
+      return 0;
+    }
+    if (left === null) {
+      return 1;
+    }
+    if (right === null) {
+      return -1;
+    }
+    return left < right ? -direction : direction;
+  };
+}
+
+// Cursor for the page of results starting at offset
+export function encodeCursor(offset) {
+  return Buffer.from(JSON.stringify({ offset })).toString('base64url');
+}
+
+// Offset a cursor from encodeCursor points at. Anything else is refused
+// rather than silently restarting or skipping results.
+export function decodeCursor(cursor) {
+  let offset;
+  try {
+    ({ offset } = JSON.parse(Buffer.from(cursor, 'base64url').toString()));
+  } catch (e) {
+    offset = undefined;
+  }
+  if (!Number.isSafeInteger(offset) || offset < 0) {
+    throw new Error("Invalid cursor, pass one from a previous queryMedia result or none to start again");
+  }
+  return offset;
+}
+
+// Return the first k items of records in compare order without sorting them
+// all: a max-heap (by compare) holds the best k seen so far.
+export function selectTop(records, compare, k) {
+  const heap = [];
+
+  const swap = (i, j) => {
+    [heap[i], heap[j]] = [heap[j], heap[i]];
+  };
+
+  const siftUp = (index) => {
+    while (index > 0) {
+      const parent = (index - 1) >> 1;
+      if (compare(heap[index], heap[parent]) <= 0) {
+        break;
+      }
+      swap(index, parent);
+      index = parent;
+    }
+  };
+
+  const siftDown = (index) => {
+    for (;;) {
+      const left = index * 2 + 1;
+      const right = left + 1;
+      let largest = index;
+      if (left < heap.length && compare(heap[left], heap[largest]) > 0) {
+        largest = left;
+      }
+      if (right < heap.length && compare(heap[right], heap[largest]) > 0) {
+        largest = right;
+      }
+      if (largest === index) {
+        break;
+      }
+      swap(index, largest);
+      index = largest;
+    }
+  };
+
+  if (k <= 0) {
+    return [];
+  }
+
+  for (const record of records) {
+    if (heap.length < k) {
+      heap.push(record);
+      siftUp(heap.length - 1);
+    } else if (compare(record, heap[0]) < 0) {
+      // Better than the worst kept so far
+      heap[0] = record;
+      siftDown(0);
+    }
+  }
+
+  return heap.sort(compare);
+}
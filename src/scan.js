@@ -0,0 +1,145 @@
+import fs from 'fs';
+import path from 'path';
+
+// Number of matching files stat'ed together
+const STAT_BATCH_SIZE = 64;
+
+// Convert a glob to a RegExp matched against forward slash relative paths.
+// Supports *, **, ?, [...] and {a,b}.
+export function globToRegExp(glob) {
+  let pattern = '';
+  let inGroup = false;
+
+  for (let i = 0; i < glob.length; i++) {
+    const char = glob[i];
+
+    if (char === '*') {
+      if (glob[i + 1] === '*') {
+        // "**/" matches zero or more directories
+        if (glob[i + 2] === '/') {
+          pattern += '(?:.*/)?';
+          i += 2;
+        } else {
+          pattern += '.*';
+          i += 1;
+        }
+      } else {
+        pattern += '[^/]*';
+      }
+    } else if (char === '?') {
+      pattern += '[^/]';
+    } else if (char === '[') {
+      const end = glob.indexOf(']', i + 1);
+      if (end === -1) {
+        pattern += '\\[';
+      } else {
+        pattern += `[${glob.slice(i + 1, end).replace(/^!/, '^').replace(/\\/g, '\\\\')}]`;
+        i = end;
+      }
+    } else if (char === '{') {
+      inGroup = true;
+      pattern += '(?:';
+    } else if (char === '}' && inGroup) {
+      inGroup = false;
+      pattern += ')';
+    } else if (char === ',' && inGroup) {
+      pattern += '|';
+    } else {
+      pattern += char.replace(/[.+^$()|\\]/g, '\\$&');
+    }
+  }
+
+  return new RegExp(`^${pattern}$`, 'i');
+}
+
+// Walk roots and yield an entry for every matching file:
+// { path, size, modified, extension }.
+//
+// Directories are read with fs.promises.opendir, so entries are streamed
+// rather than listed in full, and matching files are stat'ed in parallel
+// batches. Symbolic links to directories are not followed. Unreadable
+// directories are skipped.
+//
+// options.extensions is a list of lowercase extensions (with the dot) to keep,
+// options.glob filters on the path relative to its root and
+// options.recursive (default true) controls descending into subdirectories.
+export async function* walkMedia(roots, options = {}) {
+  const extensions = options.extensions ? new Set(options.extensions) : null;
+  const globPattern = options.glob ? globToRegExp(options.glob) : null;
+  const recursive = options.recursive !== false;
+
+  for (const root of roots) {
+    const stack = [path.resolve(root)];
+
+    while (stack.length > 0) {
+      const directory = stack.pop();
+
+      let handle;
+      try {
+        handle = await fs.promises.opendir(directory);
+      } catch (e) {
+        console.error(`Error reading directory ${directory}: ${e.message}`);
+        continue;
+      }
+
+      let batch = [];
+      for await (const dirent of handle) {
+        const fullPath = path.join(directory, dirent.name);
+
+        if (dirent.isDirectory()) {
+          if (recursive) {
+            stack.push(fullPath);
+          }
+          continue;
+        }
+
+        if (!dirent.isFile() && !dirent.isSymbolicLink()) {
+          continue;
+        }
+
+        const extension = path.extname(dirent.name).toLowerCase();
+        if (extensions && !extensions.has(extension)) {
+          continue;
+        }
+
+        if (globPattern) {
+          const relative = path.relative(root, fullPath).split(path.sep).join('/');
+          if (!globPattern.test(relative)) {
+            continue;
+          }
+        }
+
+        batch.push({ path: fullPath, extension });
+        if (batch.length >= STAT_BATCH_SIZE) {
+          yield* await statBatch(batch);
+          batch = [];
+        }
+      }
+
+      if (batch.length > 0) {
+        yield* await statBatch(batch);
+      }
+    }
+  }
+}
+
+async function statBatch(batch) {
+  const stats = await Promise.all(batch.map(entry =>
+    fs.promises.stat(entry.path).catch(() => null)
+  ));
+
+  const entries = [];
+  batch.forEach((entry, index) => {
+    const stat = stats[index];
+    // Broken links and links to directories are dropped here
+    if (stat && stat.isFile()) {
+      entries.push({
+        path: entry.path,
+        size: stat.size,
+        modified: stat.mtime.toISOString(),
+        extension: entry.extension
+      });
+    }
+  });
+  return entries;
+}
@@ -0,0 +1,148 @@
+import fs from 'fs';
+
+// Number of bytes read from the start of a file to identify it
+export const HEADER_SIZE = 4096;
+
+// ISO BMFF major / compatible brands that identify still images rather than video
+const heifBrands = ['heic', 'heix', 'heim', 'heis', 'mif1', 'msf1'];
+const avifBrands = ['avif', 'avis'];
+
+const asfGuid = Buffer.from([
+  0x30, 0x26, 0xb2, 0x75, 0x8e, 0x66, 0xcf, 0x11,
+  0xa6, 0xd9, 0x00, 0xaa, 0x00, 0x62, 0xce, 0x6c
+]);
+
+// QuickTime files written without an ftyp box start straight with one of these atoms
+const quickTimeAtoms = ['moov', 'mdat', 'wide', 'free', 'skip', 'pnot'];
+
+// Read up to length bytes from the start of a file with a single read
+export async function readHeader(filePath, length = HEADER_SIZE) {
+  const handle = await fs.promises.open(filePath, 'r');
+  try {
+    const buffer = Buffer.alloc(length);
+    const { bytesRead } = await handle.read(buffer, 0, length, 0);
+    return buffer.subarray(0, bytesRead);
+  } finally {
+    await handle.close();
+  }
+}
+
+function ascii(buffer, start, end) {
+  return buffer.toString('latin1', start, end);
+}
+
+// Identify a file from its leading bytes.
+// Returns { isImage, isVideo, format } or null when the signature is not recognized
+export function sniffMediaType(buffer) {
+  const image = (format) => ({ isImage: true, isVideo: false, format });
+  const video = (format) => ({ isImage: false, isVideo: true, format });
+
+  if (buffer.length < 4) {
+    return null;
+  }
+
+  if (buffer[0] === 0xff && buffer[1] === 0xd8 && buffer[2] === 0xff) {
+    return image('jpeg');
+  }
+
+  if (buffer.length >= 8 &&
+      buffer.readUInt32BE(0) === 0x89504e47 &&
+      buffer.readUInt32BE(4) === 0x0d0a1a0a) {
+    return image('png');
+  }
+
+  const magic6 = ascii(buffer, 0, 6);
+  if (magic6 === 'GIF87a' || magic6 === 'GIF89a') {
+    return image('gif');
+  }
+
+  if (ascii(buffer, 0, 4) === 'RIFF' && buffer.length >= 12) {
+    const riffType = ascii(buffer, 8, 12);
+    if (riffType === 'WEBP') {
+      return image('webp');
+    }
+    if (riffType === 'AVI ') {
+      return video('avi');
+    }
+  }
+
+  const magic4 = ascii(buffer, 0, 4);
+  if (magic4 === 'II*\0' || magic4 === 'MM\0*') {
+    return image('tiff');
+  }
+
+  if (buffer[0] === 0x42 && buffer[1] === 0x4d && buffer.length >= 14) {
+    // "BM" is short, check the reserved fields are zero to cut false positives
+    if (buffer.readUInt32LE(6) === 0) {
+      return image('bmp');
+    }
+  }
+
+  if (buffer.length >= 12 && ascii(buffer, 4, 8) === 'ftyp') {
+    return sniffFtyp(buffer, image, video);
+  }
+
+  if (buffer.length >= 8 && quickTimeAtoms.includes(ascii(buffer, 4, 8))) {
+    return video('mov');
+  }
+
+  if (buffer.readUInt32BE(0) === 0x1a45dfa3) {
+    // The EBML DocType sits in the first few dozen bytes
+    const head = ascii(buffer, 0, Math.min(buffer.length, 64));
+    return video(head.includes('webm') ? 'webm' : 'matroska');
+  }
+
+  if (ascii(buffer, 0, 3) === 'FLV' && buffer[3] === 0x01) {
+    return video('flv');
+  }
+
+  if (buffer.length >= 16 && buffer.subarray(0, 16).equals(asfGuid)) {
+    return video('asf');
+  }
+
+  if (isSvg(buffer)) {
+    return image('svg');
+  }
+
+  return null;
+}
+
+// Classify an ISO BMFF file (MP4, MOV, 3GP, HEIF, AVIF) from its ftyp box
+function sniffFtyp(buffer, image, video) {
+  const boxSize = Math.min(buffer.readUInt32BE(0), buffer.length);
+  const majorBrand = ascii(buffer, 8, 12);
+
+  const brands = [majorBrand];
+  for (let offset = 16; offset + 4 <= boxSize; offset += 4) {
+    brands.push(ascii(buffer, offset, offset + 4));
+  }
+
+  // Only the major brand decides images, since video files often list mif1
+  // among their compatible brands
+  if (avifBrands.includes(majorBrand)) {
+    return image('avif');
+  }
+  if (heifBrands.includes(majorBrand)) {
+    return image('heif');
+  }
+
+  if (majorBrand === 'qt  ') {
+    return video('mov');
+  }
+  if (majorBrand.startsWith('3g')) {
+    return video('3gp');
+  }
+  if (brands.includes('M4V ') || brands.includes('M4VH') || brands.includes('M4VP')) {
+    return video('m4v');
+  }
+
+  return video('mp4');
+}
+
+function isSvg(buffer) {
+  const text = buffer.toString('utf8').replace(/^\uFEFF/, '').trimStart();
+  if (!text.startsWith('<')) {
+    return false;
+  }
+  return /<svg[\s>]/i.test(text);
+}
@@ -0,0 +1,136 @@
+import fs from 'fs';
+import path from 'path';
+import ffmpeg from 'fluent-ffmpeg';
+import sharp from 'sharp';
+import { pipeImage, showinfoTime } from './thumbnail.js';
+
+// Select filter keeping the first frame of each of count equal slots of the
+// video, starting half a slot in. Slots are computed from the frame's own
+// time, so picks don't drift however the frame times fall.
+function slotSelect(duration, count) {
+  const interval = duration / count;
+  const offset = (interval / 2).toFixed(3);
+  const spacing = interval.toFixed(6);
+  const slot = time => `floor((${time}-${offset})/${spacing})`;
+  return `select='gte(t,${offset})*(isnan(prev_selected_t)+gt(${slot('t')},${slot('prev_selected_t')}))'`;
+}
+
+function scaleFilter(width) {
+  return width ? [`scale=${width}:-2`] : [];
+}
+
+// Render count evenly spaced frames of a video as one tiled contact sheet,
+// in a single decode of the video. Returns the encoded PNG and its layout:
+// { data, format, width, height, size, columns, rows, tileWidth, tileHeight, interval }.
+//
+// options.duration is the video's duration in seconds, options.columns the
+// number of tiles across (default a square-ish grid), options.width each
+// tile's width (height follows the video's aspect) and options.threads
+// limits ffmpeg's threads.
+export async function generateContactSheet(videoPath, count, options = {}) {
+  const threadOptions = options.threads ? [`-threads ${options.threads}`] : [];
+  const columns = options.columns || Math.ceil(Math.sqrt(count));
+  const rows = Math.ceil(count / columns);
+
+  const filters = [
+    slotSelect(options.duration, count),
+    ...scaleFilter(options.width),
+    `tile=${columns}x${rows}`
+  ];
+
+  const sheet = await pipeImage(
+    ffmpeg(videoPath)
+      .inputOptions(threadOptions)
+      .outputOptions([...threadOptions, `-vf ${filters.join(',')}`])
+  );
+
+  const { data, info } = await sharp(sheet).png().toBuffer({ resolveWithObject: true });
+
+  return {
+    data,
+    format: info.format,
+    width: info.width,
+    height: info.height,
+    size: info.size,
+    columns,
+    rows,
+    tileWidth: Math.floor(info.width / columns),
+    tileHeight: Math.floor(info.height / rows),
+    interval: options.duration / count
+  };
+}
+
+// Write count evenly spaced frames of a video into outputDir as
+// frame_0001.png, frame_0002.png and so on, in a single decode of the video.
+// Options are as for generateContactSheet. Returns [{ path, time }] where
+// time is the timestamp of the frame in the video, as logged by showinfo.
+export function extractStoryboardFrames(videoPath, outputDir, count, options = {}) {
+  const threadOptions = options.threads ? [`-threads ${options.threads}`] : [];
+  const filters = [slotSelect(options.duration, count), 'showinfo', ...scaleFilter(options.width)];
+  const interval = options.duration / count;
+  const keptTimes = [];
+
+  return new Promise((resolve, reject) => {
+    ffmpeg(videoPath)
+      .inputOptions(threadOptions)
+      .outputOptions([
+        ...threadOptions,
+        `-vf ${filters.join(',')}`,
+        // One image per selected frame, not per input frame
+        '-vsync vfr',
+        `-frames:v ${count}`
+      ])
+      .output(path.join(outputDir, 'frame_%04d.png'))
+      .on('stderr', (line) => {
+        const time = showinfoTime(line);
+        if (time !== null) {
+          keptTimes.push(time);
+        }
+      })
+      .on('error', (err) => {
+        console.error(`Error generating storyboard: ${err.message}`);
+        reject(err);
+      })
+      .on('end', () => {
+        const frames = [];
+        for (let i = 0; i < count; i++) {
+          const framePath = path.join(outputDir, `frame_${String(i + 1).padStart(4, '0')}.png`);
+          if (fs.existsSync(framePath)) {
+            // Slots with no frame are skipped, so only the logged time is
+            // exact. Without one, fall back to where the slot's pick starts.
+            const time = i < keptTimes.length ? keptTimes[i] : (i + 0.5) * interval;
+            frames.push({ path: framePath, time });
+          }
+        }
+        resolve(frames);
+      })
+      .run();
+  });
+}
+
+// WebVTT timestamp, HH:MM:SS.mmm
+function vttTime(seconds) {
+  const milliseconds = Math.round(seconds * 1000);
+  const hours = Math.floor(milliseconds / 3600000);
+  const minutes = Math.floor(milliseconds / 60000) % 60;
+  const secs = Math.floor(milliseconds / 1000) % 60;
+  const pad = (value, length = 2) => String(value).padStart(length, '0');
+  return `${pad(hours)}:${pad(minutes)}:${pad(secs)}.${pad(milliseconds % 1000, 3)}`;
+}
+
+// WebVTT sprite index for a contact sheet: one cue per tile, pointing at the
+// tile's region of sheetUrl with a media fragment (#xywh=x,y,w,h), as used by
+// video players for scrubbing previews
+export function spriteVtt(sheetUrl, sheet, count) {
+  const lines = ['WEBVTT', ''];
+
+  for (let i = 0; i < count; i++) {
+    const x = (i % sheet.columns) * sheet.tileWidth;
+    const y = Math.floor(i / sheet.columns) * sheet.tileHeight;
+    lines.push(`${vttTime(i * sheet.interval)} --> ${vttTime((i + 1) * sheet.interval)}`);
+    lines.push(`${sheetUrl}#xywh=${x},${y},${sheet.tileWidth},${sheet.tileHeight}`);
+    lines.push('');
+  }
+
+  return lines.join('\n');
+}
@@ -0,0 +1,162 @@
+import fs from 'fs';
+import path from 'path';
+import crypto from 'crypto';
+import { MetadataCache } from './metadata-cache.js';
+
+// Chunks read, evenly spaced from start to end, for a video's sampled hash
+const SAMPLE_COUNT = 8;
+const SAMPLE_SIZE = 64 * 1024;
+
+// Hash of a file's size and SAMPLE_COUNT chunks spread through it. Cheap to
+// compute on any size of file, and any re-encode, trim or remux changes it.
+async function sampledHash(filePath) {
+  const hash = crypto.createHash('sha256');
+  const handle = await fs.promises.open(filePath, 'r');
+
+  try {
+    const { size } = await handle.stat();
+    hash.update(String(size));
+
+    const buffer = Buffer.alloc(SAMPLE_SIZE);
+    const last = Math.max(0, size - SAMPLE_SIZE);
+    for (let i = 0; i < SAMPLE_COUNT; i++) {
+      const position = Math.floor((last * i) / (SAMPLE_COUNT - 1));
+      const { bytesRead } = await handle.read(buffer, 0, SAMPLE_SIZE, position);
+      hash.update(buffer.subarray(0, bytesRead));
+    }
+  } finally {
+    await handle.close();
+  }
+
+  return hash.digest('hex');
+}
+
+// Thumbnails generated before, and where they were written.
+//
+// A thumbnail is addressed by a key hashed from its source video's sampled
+// hash and the generation parameters. Generated images are kept in a store
+// under that key (in the cache directory, when there is one) so the same
+// request for another output path is served by a hard link or copy instead
+// of ffmpeg. Outputs are recorded with the key they were made for, keyed by
+// the output file's own fingerprint, so an output that hasn't changed since
+// it was written for the same key is up to date and left alone.
+//
+// Records (and the sampled hashes of videos, which are keyed the same way)
+// go in a MetadataCache, so they are persisted with the other caches.
+export class ThumbnailStore {
+  constructor({ cacheDir = null, maxEntries = 10000 } = {}) {
+    this.records = new MetadataCache({ cacheDir, maxEntries, fileName: 'thumbnail-cache.jsonl' });
+    this.storeDir = cacheDir ? path.join(cacheDir, 'thumbnails') : null;
+  }
+
+  async load() {
+    await this.records.load();
+  }
+
+  // Key for a thumbnail of videoPath made with params
+  async key(videoPath, params) {
+    let record = await this.records.get(videoPath);
+    if (!record || !record.sample) {
+      record = { sample: await sampledHash(videoPath) };
+      await this.records.set(videoPath, record);
+    }
+
+    return crypto.createHash('sha256')
+      .update(JSON.stringify({ source: record.sample, params }))
+      .digest('hex');
+  }
+
+  // The info an output was generated with, if it is up to date for key
+  async upToDate(outputPath, key) {
+    try {
+      const record = await this.records.get(outputPath);
+      return record && record.key === key ? record.info : null;
+    } catch (e) {
+      // Missing output
+      return null;
+    }
+  }
+
+  storePath(key, format) {
+    return path.join(this.storeDir, key.slice(0, 2), `${key}.${format}`);
+  }
+
+  // The stored thumbnail for key as { key, path, info }, or null
+  async lookup(key, format) {
+    if (!this.storeDir) {
+      return null;
+    }
+
+    const storePath = this.storePath(key, format);
+    try {
+      const record = await this.records.get(storePath);
+      return record && record.key === key ? { key, path: storePath, info: record.info } : null;
+    } catch (e) {
+      return null;
+    }
+  }
+
+  // Keep a generated thumbnail (info holds its format) and return it as
+  // { key, path, data, info }. path is null when there is no store.
+  async save(key, data, info) {
+    if (!this.storeDir) {
+      return { key, path: null, data, info };
+    }
+
+    const storePath = this.storePath(key, info.format);
+    await fs.promises.mkdir(path.dirname(storePath), { recursive: true });
+    await writeAtomic(storePath, tempPath => fs.promises.writeFile(tempPath, data));
+    await this.records.set(storePath, { key, info });
+
+    return { key, path: storePath, data, info };
+  }
+
+  // The image data of a stored thumbnail
+  async read(stored) {
+    return stored.data || fs.promises.readFile(stored.path);
+  }
+
+  // Put a stored thumbnail at outputPath, hard linked to the store when
+  // possible, and record it as up to date. An output that is already a link
+  // to the stored file (its record was evicted or never written) is kept:
+  // renaming a link over another link to the same file does nothing and
+  // would leave the temporary file behind.
+  async place(stored, outputPath) {
+    if (!stored.path) {
+      await fs.promises.writeFile(outputPath, stored.data);
+    } else if (!await sameFile(stored.path, outputPath)) {
+      await writeAtomic(outputPath, tempPath =>
+        fs.promises.link(stored.path, tempPath).catch(() => fs.promises.copyFile(stored.path, tempPath))
+      );
+    }
+
+    await this.records.set(outputPath, { key: stored.key, info: stored.info });
+  }
+}
+
+// Whether two paths are the same file (hard links to one inode)
+async function sameFile(a, b) {
+  try {
+    const [statsA, statsB] = await Promise.all([
+      fs.promises.stat(a, { bigint: true }),
+      fs.promises.stat(b, { bigint: true })
+    ]);
+    return statsA.dev === statsB.dev && statsA.ino === statsB.ino;
+  } catch (e) {
+    // Missing output
+    return false;
+  }
+}
+
+// Create a file next to filePath with write, then move it into place, so
+// the file is never seen half written
+async function writeAtomic(filePath, write) {
+  const tempPath = `${filePath}.${process.pid}.${crypto.randomUUID()}.tmp`;
+  try {
+    await write(tempPath);
+    await fs.promises.rename(tempPath, filePath);
+  } catch (e) {
+    await fs.promises.rm(tempPath, { force: true });
+    throw e;
+  }
+}
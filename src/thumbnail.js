@@ -0,0 +1,284 @@
+import ffmpeg from 'fluent-ffmpeg';
+import sharp from 'sharp';
+
+// How candidate frames are chosen for the thumbnail filter to score:
+//   auto      - keyframes, or seek for long videos (the default)
+//   keyframes - decode only keyframes (-skip_frame nokey), thinned to
+//               THUMBNAIL_CANDIDATES evenly spaced over the whole video
+//   seek      - THUMBNAIL_CANDIDATES evenly spaced input seeks, each decoding
+//               one keyframe. Only the data around each seek point is read.
+//   start     - every frame of the first 100 (the thumbnail filter's
+//               default batch), which only sees the first few seconds
+export const thumbnailSamplings = ['auto', 'keyframes', 'seek', 'start'];
+
+// Candidate frames scored per video when sampling keyframes or seeking
+const THUMBNAIL_CANDIDATES = 24;
+
+// Above this duration (seconds) auto seeks rather than demuxing the whole
+// file for its keyframes
+const LONG_VIDEO_SECONDS = 600;
+
+// Pick the sampling for a video. Seeking needs the duration to place the
+// seeks, without it keyframes are sampled instead.
+function resolveSampling(sampling, duration) {
+  if (sampling === 'auto') {
+    return duration > LONG_VIDEO_SECONDS ? 'seek' : 'keyframes';
+  }
+  if (sampling === 'seek' && !(duration > 0)) {
+    return 'keyframes';
+  }
+  return sampling;
+}
+
+// Evenly spaced candidate timestamps, skipping the very start and end
+function candidateTimes(duration) {
+  const times = [];
+  for (let i = 0; i < THUMBNAIL_CANDIDATES; i++) {
+    times.push(((duration * (i + 0.5)) / THUMBNAIL_CANDIDATES).toFixed(3));
+  }
+  return times;
+}
+
+// Width candidates are scaled to before scoring. Histograms of a thumbnail
+// this size pick the same kind of frame as full resolution ones, and the
+// thumbnail filter's frame buffer stays small.
+const ANALYSIS_WIDTH = 160;
+
+// Logged (at verbose level) by the thumbnail filter for the frame it picks
+const SELECTED_FRAME_PATTERN = /frame id #(\d+) \(pts_time=([\d.]+)\) selected/;
+
+// Build the ffmpeg command that scores the candidates for a sampling on a
+// downscaled stream. It writes nothing, the choice is read from its log.
+function buildAnalysisCommand(videoPath, sampling, duration, threadOptions) {
+  const analysisOptions = [...threadOptions, '-v verbose'];
+  const scale = `scale=${ANALYSIS_WIDTH}:-2`;
+
+  if (sampling === 'seek') {
+    // One input per candidate, each seeked to its keyframe, concatenated and
+    // scored together. -noaccurate_seek keeps the keyframe rather than
+    // decoding on to the exact timestamp.
+    const command = ffmpeg();
+    const times = candidateTimes(duration);
+    for (const time of times) {
+      command
+        .input(videoPath)
+        .inputOptions([...analysisOptions, ...seekOptions('seek', time)]);
+    }
+
+    const trims = times.map((time, index) => `[${index}:v:0]trim=end_frame=1,setpts=PTS-STARTPTS[c${index}]`);
+    const inputs = times.map((time, index) => `[c${index}]`).join('');
+    return command.complexFilter(
+      [...trims, `${inputs}concat=n=${times.length}:v=1:a=0,${scale},thumbnail=${times.length}[thumb]`],
+      'thumb'
+    );
+  }
+
+  if (sampling === 'start') {
+    return ffmpeg(videoPath)
+      .inputOptions(analysisOptions)
+      .outputOptions([`-vf ${scale},thumbnail`]);
+  }
+
+  // Keyframes closer together than the candidate spacing are dropped before
+  // scoring, so the candidates cover the whole video
+  const spacing = duration > 0 ? (duration / THUMBNAIL_CANDIDATES).toFixed(3) : 0;
+  return ffmpeg(videoPath)
+    .inputOptions([...analysisOptions, '-skip_frame nokey'])
+    .outputOptions([
+      `-vf select='isnan(prev_selected_t)+gte(t-prev_selected_t,${spacing})',${scale},thumbnail=${THUMBNAIL_CANDIDATES}`
+    ]);
+}
+
+// Input options that land a seek on the frame the analysis picked.
+//
+// seek candidates were each the keyframe at or before their time, so the
+// same non-accurate seek finds them again. keyframes and start picks are
+// found by an accurate seek to just before their timestamp (which is only
+// printed to the microsecond), decoding only keyframes for keyframes.
+function seekOptions(sampling, time) {
+  if (sampling === 'seek') {
+    return ['-skip_frame nokey', '-noaccurate_seek', `-ss ${time}`];
+  }
+
+  const start = Math.max(0, time - 0.001).toFixed(6);
+  return sampling === 'keyframes' ? ['-skip_frame nokey', `-ss ${start}`] : [`-ss ${start}`];
+}
+
+// Score the candidates and return the input options that seek to the best
+function chooseFrame(videoPath, sampling, duration, threadOptions) {
+  return new Promise((resolve, reject) => {
+    let selected = null;
+
+    buildAnalysisCommand(videoPath, sampling, duration, threadOptions)
+      .outputOptions([...threadOptions, '-frames:v 1', '-f null'])
+      .output('-')
+      .on('stderr', (line) => {
+        const match = SELECTED_FRAME_PATTERN.exec(line);
+        if (match) {
+          selected = sampling === 'seek' ?
+            // Candidates were re-timed to be concatenated, use the seek time
+            candidateTimes(duration)[parseInt(match[1])] :
+            parseFloat(match[2]);
+        }
+      })
+      .on('error', reject)
+      .on('end', () => {
+        if (selected === null) {
+          reject(new Error("ffmpeg did not report a selected frame"));
+        } else {
+          resolve({ time: Number(selected), inputOptions: seekOptions(sampling, selected) });
+        }
+      })
+      .run();
+  });
+}
+
+// Time (seconds) of the frame a showinfo filter logged in an ffmpeg log
+// line, or null for any other line
+export function showinfoTime(line) {
+  const match = /Parsed_showinfo.*\bpts_time:\s*([\d.]+)/.exec(line);
+  return match ? parseFloat(match[1]) : null;
+}
+
+// Run an ffmpeg command whose output is a single image, and return that image
+// as an uncompressed PNG read from ffmpeg's stdout. Compression is left to sharp.
+export function pipeImage(command) {
+  command.outputOptions([
+    '-frames:v 1',
+    '-f image2pipe',
+    '-c:v png',
+    '-compression_level 0'
+  ]);
+
+  // Done once ffmpeg has exited and its output has been read
+  const chunks = [];
+  const exited = new Promise((resolve, reject) => {
+    command
+      .on('error', (err) => {
+        console.error(`Error generating image: ${err.message}`);
+        reject(err);
+      })
+      .on('end', resolve);
+  });
+  const output = command.pipe();
+  const read = new Promise((resolve, reject) => {
+    output.on('data', chunk => chunks.push(chunk));
+    output.on('end', resolve);
+    output.on('error', reject);
+  });
+
+  return Promise.all([exited, read]).then(() => {
+    if (chunks.length === 0) {
+      throw new Error("Failed to generate image");
+    }
+    return Buffer.concat(chunks);
+  });
+}
+
+// Formats thumbnails can be written in, with the extension each is saved with
+export const thumbnailFormats = {
+  png: '.png',
+  jpeg: '.jpg',
+  webp: '.webp',
+  avif: '.avif'
+};
+
+// Format implied by an output path's extension, or null
+export function formatForExtension(extension) {
+  return {
+    '.png': 'png',
+    '.jpg': 'jpeg',
+    '.jpeg': 'jpeg',
+    '.webp': 'webp',
+    '.avif': 'avif'
+  }[extension.toLowerCase()] || null;
+}
+
+// Scale filter fitting frames inside maxWidth x maxHeight (either may be
+// missing), keeping the aspect ratio and never scaling up
+function fitFilter(maxWidth, maxHeight) {
+  if (maxWidth && maxHeight) {
+    return [`scale='min(iw,${maxWidth})':'min(ih,${maxHeight})':force_original_aspect_ratio=decrease`];
+  }
+  if (maxWidth) {
+    return [`scale='min(iw,${maxWidth})':-2`];
+  }
+  if (maxHeight) {
+    return [`scale=-2:'min(ih,${maxHeight})'`];
+  }
+  return [];
+}
+
+// Decode one frame, scaled in the filter graph so large frames are never
+// handed to the encoder at full size
+function grabFrame(videoPath, inputOptions, threadOptions, filters) {
+  return pipeImage(
+    ffmpeg(videoPath)
+      .inputOptions([...threadOptions, ...inputOptions])
+      .outputOptions([...threadOptions, ...(filters.length ? [`-vf ${filters.join(',')}`] : [])])
+  );
+}
+
+// Pick the most representative frame of a video, in memory. Frames are
+// picked by options.sampling (one of thumbnailSamplings, default auto) and
+// scored by ffmpeg's thumbnail filter at ANALYSIS_WIDTH wide, then only the
+// chosen frame is decoded again and piped back.
+//
+// options.duration is the video's duration in seconds, needed to spread the
+// candidates over the video. options.maxWidth and options.maxHeight bound
+// the frame's size. options.threads limits the threads ffmpeg uses for
+// decoding and filtering.
+//
+// Returns { frame, sampling, time } where frame is an uncompressed PNG for
+// encodeThumbnail and time the timestamp of the frame in the video.
+export async function generateSmartThumbnail(videoPath, options = {}) {
+  const threadOptions = options.threads ? [`-threads ${options.threads}`] : [];
+  const duration = options.duration || 0;
+  const sampling = resolveSampling(options.sampling || 'auto', duration);
+
+  const selected = await chooseFrame(videoPath, sampling, duration, threadOptions);
+  const frame = await grabFrame(
+    videoPath,
+    selected.inputOptions,
+    threadOptions,
+    fitFilter(options.maxWidth, options.maxHeight)
+  );
+
+  return { frame, sampling, time: selected.time };
+}
+
+// Encode a frame from generateSmartThumbnail with sharp. encoding.format is
+// a key of thumbnailFormats, encoding.quality (1-100) applies to jpeg, webp
+// and avif, and encoding.effort (0-9, CPU spent on compression) to png (as
+// the zlib level), webp (capped at its maximum of 6) and avif.
+//
+// Returns { data, format, width, height, size }. Dimensions come from the
+// encode rather than reading the result back.
+export async function encodeThumbnail(frame, encoding = {}) {
+  const format = encoding.format || 'png';
+  const { quality, effort } = encoding;
+
+  const options = {
+    png: { compressionLevel: effort },
+    jpeg: { quality },
+    webp: { quality, effort: effort === undefined ? undefined : Math.min(6, effort) },
+    avif: { quality, effort }
+  }[format];
+
+  // Leave unset options to sharp's defaults
+  for (const key of Object.keys(options)) {
+    if (options[key] === undefined) {
+      delete options[key];
+    }
+  }
+
+  const { data, info } = await sharp(frame)[format](options).toBuffer({ resolveWithObject: true });
+
+  return {
+    data,
+    format,
+    width: info.width,
+    height: info.height,
+    size: info.size
+  };
+}